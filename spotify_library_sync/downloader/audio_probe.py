@@ -0,0 +1,108 @@
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable
+
+from pymediainfo import MediaInfo
+
+from django.db import transaction
+
+from library_manager.models import LibraryFile
+from . import utils
+from .metrics import time_stage
+
+def parse_bitrate(path: str) -> float:
+    """Read the bitrate (in kbps) of the first audio track, or 0 if there is no audio track"""
+    media_info = MediaInfo.parse(path)
+    for media_track in media_info.tracks:
+        if media_track.track_type == "Audio":
+            return (media_track.bit_rate or 0) / 1000
+    return 0
+
+class AudioProber:
+    """Probe downloaded files with MediaInfo on a thread pool, so the next download doesn't wait on the file read
+
+    Only the parsing runs on the pool. Cache lookups and writes stay on the calling thread, so the pool threads never
+    open database connections of their own. Results are cached on the file's `LibraryFile` row by (path, size, mtime),
+    so an unchanged file is never parsed twice.
+    """
+
+    def __init__(self, max_workers: int = 2):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="audio_probe")
+
+    def submit(self, path: str, song_gid: str | None = None) -> "Future[float]":
+        """Start probing a file, pass the finished probe to `save` to cache its result"""
+        path = str(path)
+        cached_bitrate = self.cached_bitrates([path]).get(path)
+        if cached_bitrate is not None:
+            probe: "Future[float]" = Future()
+            probe.set_result(cached_bitrate)
+            return probe
+        return self.executor.submit(self.parse, path)
+
+    def probe_many(self, paths: Iterable[str]) -> dict[str, float | None]:
+        """Probe many files, caching every result in one go; files that can't be read are `None`"""
+        paths = list(paths)
+        bitrates: dict[str, float | None] = {}
+        for path_batch in utils.chunked(paths, utils.SQLITE_IN_BATCH_SIZE):
+            bitrates.update(self.cached_bitrates(path_batch))
+        uncached_paths = [path for path in paths if path not in bitrates]
+        bitrates.update(zip(uncached_paths, self.executor.map(self.parse_or_none, uncached_paths)))
+        self.save([(path, None, bitrate) for path, bitrate in bitrates.items() if bitrate is not None])
+        return {path: bitrates[path] for path in paths}
+
+    @staticmethod
+    def cached_bitrates(paths: list[str]) -> dict[str, float]:
+        file_stats: dict[str, os.stat_result] = {}
+        for path in paths:
+            try:
+                file_stats[path] = os.stat(path)
+            except OSError:
+                continue
+        return {
+            path: bitrate
+            for path, size, mtime, bitrate in LibraryFile.objects.filter(
+                path__in=file_stats.keys(),
+                bitrate__isnull=False,
+            ).values_list('path', 'size', 'mtime', 'bitrate')
+            if file_stats[path].st_size == size and file_stats[path].st_mtime == mtime
+        }
+
+    @staticmethod
+    def parse(path: str) -> float:
+        with time_stage('probe'):
+            return parse_bitrate(path)
+
+    def parse_or_none(self, path: str) -> float | None:
+        try:
+            return self.parse(path)
+        except OSError:
+            return None
+
+    @staticmethod
+    def save(results: list[tuple[str, str | None, float]]):
+        """Cache probe results, given as (path, song GID or `None` if unknown, bitrate), in a single transaction"""
+        library_files: dict[bool, list[LibraryFile]] = {True: [], False: []}
+        for path, song_gid, bitrate in results:
+            try:
+                file_stat = os.stat(path)
+            except OSError:
+                continue
+            library_files[song_gid is not None].append(LibraryFile(
+                path=path,
+                directory=os.path.dirname(path),
+                size=file_stat.st_size,
+                mtime=file_stat.st_mtime,
+                song_gid=song_gid,
+                bitrate=bitrate,
+            ))
+
+        update_fields = ["directory", "size", "mtime", "bitrate", "indexed_at"]
+        with transaction.atomic():
+            # Files probed without a song GID keep whichever one the library index already found for them
+            for has_song_gid, library_file_batch in library_files.items():
+                LibraryFile.objects.bulk_create(
+                    library_file_batch,
+                    update_conflicts=True,
+                    unique_fields=["path"],
+                    update_fields=update_fields + ["song_gid"] if has_song_gid else update_fields,
+                )
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db.models import Q
+from django.utils import timezone
+
+from library_manager import stats as library_stats
+from library_manager.models import Album, Artist
+from . import utils
+from .downloader import Downloader
+from .rate_limiter import RateLimited
+
+# Largest page Spotify returns from the artist albums endpoint
+ARTIST_ALBUMS_PAGE_SIZE = 50
+# Artists whose albums are fetched before they're written, so a large refresh never holds every response in memory
+ARTIST_BATCH_SIZE = 200
+
+# Bounds on how often an artist's albums are refreshed
+MIN_REFRESH_INTERVAL = timedelta(hours=8)
+MAX_REFRESH_INTERVAL = timedelta(days=30)
+# Artists are re-checked this many times over the time since they last released something,
+# so one who released last week is checked daily while one who's been quiet for years is checked monthly
+REFRESH_CADENCE_DIVISOR = 8
+
+def next_refresh_interval(last_new_album_at: datetime | None, now: datetime) -> timedelta:
+    if last_new_album_at is None:
+        return MAX_REFRESH_INTERVAL
+    return min(MAX_REFRESH_INTERVAL, max(MIN_REFRESH_INTERVAL, (now - last_new_album_at) / REFRESH_CADENCE_DIVISOR))
+
+def latest_release_date(artist_albums: dict) -> datetime | None:
+    # Release dates are only as precise as Spotify knows them, ie. "1999", "1999-04" or "1999-04-20"
+    release_dates = [album['release_date'] for album in artist_albums['items'] if album.get('release_date')]
+    if len(release_dates) == 0:
+        return None
+    year, month, day = (list(map(int, max(release_dates).split('-'))) + [1, 1])[:3]
+    return datetime(year, month, day, tzinfo=dt_timezone.utc)
+
+class DiscographyRefresher:
+    """Refresh the albums of many artists at once, with up to `max_concurrency` Spotify requests in flight
+
+    Once the first page of an artist's albums reveals the `total`, the remaining pages are all requested together.
+    Requests still go through the (blocking) spotipy client on worker threads, so they keep sharing its auth,
+    retries and the `spotify` rate limit budget, and are only written to the database once a batch has been fetched.
+    """
+
+    def __init__(self, downloader: Downloader, max_concurrency: int = 8, logger: logging.Logger | None = None):
+        self.downloader = downloader
+        self.max_concurrency = max_concurrency
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+
+    def refresh(self, artists: list[Artist], failures: dict[int, Exception] | None = None) -> dict[str, int]:
+        """Fetch and upsert the albums for every artist
+
+        Once the `spotify` budget runs out the remaining batches are left for later, and the artists that ran into it
+        keep their `next_refresh_at`, so they're still due when the budget has refilled.
+
+        Args:
+            failures: If given, filled with the exception raised fetching each artist that failed, by artist id
+
+        Returns:
+            dict[str, int]: the number of artists refreshed, failed and rate limited, and the number of albums upserted
+        """
+        stats = {'artists': 0, 'failed': 0, 'rate_limited': 0, 'albums': 0, 'new_albums': 0}
+        for artist_batch in utils.chunked(artists, ARTIST_BATCH_SIZE):
+            artist_albums_by_gid: dict[str, dict | Exception] = {}
+            uncached_artists: list[Artist] = []
+            for artist in artist_batch:
+                cached_artist_albums = self.downloader.response_cache.get('artist_albums', utils.gid_to_uri(artist.gid))
+                if cached_artist_albums is None:
+                    uncached_artists.append(artist)
+                else:
+                    artist_albums_by_gid[artist.gid] = cached_artist_albums
+
+            artist_albums_by_gid.update(asyncio.run(self.fetch_many_artist_albums([artist.gid for artist in uncached_artists])))
+
+            known_album_gids: dict[str, set[str]] = {artist.gid: set() for artist in artist_batch}
+            for artist_gid, album_gid in Album.objects.filter(artist__in=artist_batch).values_list('artist_id', 'spotify_gid'):
+                known_album_gids[artist_gid].add(album_gid)
+
+            now = timezone.now()
+            rate_limited = False
+            for artist in artist_batch:
+                artist_albums = artist_albums_by_gid[artist.gid]
+                if isinstance(artist_albums, RateLimited):
+                    stats['rate_limited'] += 1
+                    rate_limited = True
+                    if failures is not None:
+                        failures[artist.id] = artist_albums
+                    continue
+                if isinstance(artist_albums, Exception):
+                    stats['failed'] += 1
+                    if failures is not None:
+                        failures[artist.id] = artist_albums
+                    self.logger.error(f"Failed to fetch albums for artist {artist.id}: {artist_albums}")
+                    # Try again next cycle, without holding up the artists queued behind it in the meantime
+                    artist.next_refresh_at = now + MIN_REFRESH_INTERVAL
+                    continue
+                stats['artists'] += 1
+                stats['albums'] += len(self.downloader.upsert_artist_albums(artist, artist_albums))
+
+                new_album_count = sum(1 for album in artist_albums['items'] if album['id'] not in known_album_gids[artist.gid])
+                if len(known_album_gids[artist.gid]) == 0:
+                    # Everything is "new" the first time around, so go by the release dates instead
+                    artist.last_new_album_at = latest_release_date(artist_albums)
+                elif new_album_count > 0:
+                    stats['new_albums'] += new_album_count
+                    artist.last_new_album_at = now
+                artist.next_refresh_at = now + next_refresh_interval(artist.last_new_album_at, now)
+
+            Artist.objects.bulk_update(artist_batch, ['last_new_album_at', 'next_refresh_at'])
+            if rate_limited:
+                self.logger.warning(f"Stopped refreshing artist discographies, {stats['rate_limited']} artist(s) ran into the spotify rate limit")
+                break
+
+        library_stats.refresh_library_stats()
+        self.logger.info(f"Refreshed artist discographies: {stats}")
+        return stats
+
+    def due_artists(self, request_budget: int) -> list[Artist]:
+        """Tracked artists whose refresh is due, most overdue first, up to an estimated `request_budget` Spotify requests"""
+        due_artists: list[Artist] = []
+        estimated_requests = 0
+        # SQLite sorts NULLs (never refreshed) first, so this reads straight from the `tracked, next_refresh_at` index
+        candidates = Artist.objects.filter(
+            Q(next_refresh_at=None) | Q(next_refresh_at__lte=timezone.now()),
+            tracked=True,
+        ).order_by('next_refresh_at', 'id')
+        for artist in candidates.iterator():
+            # One request per page of albums, from the stored count (so at least one for an artist whose albums aren't known yet)
+            artist_requests = max(1, math.ceil(artist.known_album_count / ARTIST_ALBUMS_PAGE_SIZE))
+            if estimated_requests + artist_requests > request_budget:
+                break
+            due_artists.append(artist)
+            estimated_requests += artist_requests
+        return due_artists
+
+    async def fetch_many_artist_albums(self, artist_gids: list[str]) -> dict[str, dict | Exception]:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        results = await asyncio.gather(
+            *(self.fetch_artist_albums(semaphore, utils.gid_to_uri(artist_gid)) for artist_gid in artist_gids),
+            return_exceptions=True,
+        )
+        return dict(zip(artist_gids, results))
+
+    async def fetch_artist_albums(self, semaphore: asyncio.Semaphore, artist_uri: str) -> dict:
+        first_page = await self.fetch_artist_albums_page(semaphore, artist_uri, 0)
+        remaining_pages = await asyncio.gather(*(
+            self.fetch_artist_albums_page(semaphore, artist_uri, offset)
+            for offset in range(ARTIST_ALBUMS_PAGE_SIZE, first_page['total'], ARTIST_ALBUMS_PAGE_SIZE)
+        ))
+
+        artist_albums = {'items': list(first_page['items'])}
+        for page in remaining_pages:
+            artist_albums['items'].extend(page['items'])
+        self.downloader.response_cache.set('artist_albums', artist_uri, artist_albums)
+        return artist_albums
+
+    async def fetch_artist_albums_page(self, semaphore: asyncio.Semaphore, artist_uri: str, offset: int) -> dict:
+        async with semaphore:
+            return await asyncio.to_thread(
+                self.downloader.spotipy_client.artist_albums, artist_uri, limit=ARTIST_ALBUMS_PAGE_SIZE, offset=offset,
+            )
@@ -1,13 +1,28 @@
 import re
 
-from library_manager.models import Album, Artist, ContributingArtist, DownloadHistory, Song, TrackedPlaylist
+from library_manager import stats
+from library_manager.models import Album, Artist, ContributingArtist, DownloadHistory, PendingArtistRefresh, PlaylistTrack, Song, TrackedPlaylist
 from . import utils
+from .metrics import time_stage
+from .spotdl_songs import song_from_metadata
+from .spotify_cache import SpotifyResponseCache, default_response_cache
 
+from spotdl.types.song import Song as SpotdlSong
 from spotdl.utils.spotify import SpotifyClient
 
+# Maximum number of IDs Spotify accepts per request on its multi-get endpoints
+SPOTIFY_TRACKS_BATCH_SIZE = 50
+SPOTIFY_ALBUMS_BATCH_SIZE = 20
+
 class Downloader:
-    def __init__(self, spotipy_client: SpotifyClient):
+    def __init__(self, spotipy_client: SpotifyClient, response_cache: SpotifyResponseCache | None = None):
         self.spotipy_client = spotipy_client
+        self._response_cache = response_cache
+
+    @property
+    def response_cache(self) -> SpotifyResponseCache:
+        # Only processes that actually talk to Spotify open the shared cache
+        return self._response_cache if self._response_cache is not None else default_response_cache()
 
     def get_artist_albums(self, artist_gid: str) -> list[Album]:
         """Get all albums (including EPs and Singles) for this artist
@@ -19,26 +34,28 @@ class Downloader:
             list[str]: an array of urls to each album for the artist
         """
         artist = Artist.objects.get(gid=artist_gid)
-        albums_to_create_or_update: list[dict] = []
         artist_uri = utils.gid_to_uri(artist_gid)
 
-        album_iterator = self.spotipy_client.artist_albums(artist_uri, limit=50)
+        artist_albums = self.response_cache.get_or_fetch('artist_albums', artist_uri, lambda: self.fetch_artist_albums(artist_uri))
+        albums = self.upsert_artist_albums(artist, artist_albums)
+        stats.refresh_library_stats()
+        return albums
 
-        while album_iterator is not None:
-            for album in album_iterator['items']:
-                new_or_updated_album_data: dict = {
-                    'spotify_gid': album['id'],
-                    'artist': artist,
-                    'spotify_uri': album['uri'],
-                    'total_tracks': album['total_tracks'],
-                    'name': album['name'],
-                    'album_type': album['album_type'],
-                    'album_group': album['album_group']
-                }
+    @time_stage('db_upsert')
+    def upsert_artist_albums(self, artist: Artist, artist_albums: dict) -> list[Album]:
+        albums_to_create_or_update: list[dict] = []
+        for album in artist_albums['items']:
+            new_or_updated_album_data: dict = {
+                'spotify_gid': album['id'],
+                'artist': artist,
+                'spotify_uri': album['uri'],
+                'total_tracks': album['total_tracks'],
+                'name': album['name'],
+                'album_type': album['album_type'],
+                'album_group': album['album_group']
+            }
 
-                albums_to_create_or_update.append(new_or_updated_album_data)
-            
-            album_iterator = self.spotipy_client.next(album_iterator)
+            albums_to_create_or_update.append(new_or_updated_album_data)
 
         if len(albums_to_create_or_update) == 0:
             return []
@@ -49,10 +66,241 @@ class Downloader:
             unique_fields=["spotify_gid"],
             update_fields=albums_to_create_or_update[0].keys(),
         )
+        # bulk_create skips model signals, so keep the artist's stats up to date here
+        stats.refresh_artist_stats(Artist.objects.filter(gid=artist.gid))
         return albums
-    
+
+    def fetch_artist_albums(self, artist_uri: str) -> dict:
+        album_iterator = self.spotipy_client.artist_albums(artist_uri, limit=50)
+        artist_albums = {'items': []}
+
+        while album_iterator is not None:
+            artist_albums['items'].extend(album_iterator['items'])
+            album_iterator = self.spotipy_client.next(album_iterator)
+        return artist_albums
+
+    @time_stage('db_upsert')
+    def upsert_tracks(self, tracks: list[dict], track_artists: bool = False) -> dict[str, Song]:
+        """Create or update the artists, songs and contributing artists for a batch of tracks
+
+        Args:
+            tracks (list[dict]): Spotify track objects, as returned by `get_download_queue`
+            track_artists (bool): Whether the primary artist of each track should be marked as tracked
+
+        Returns:
+            dict[str, Song]: the persisted songs, keyed by song GID
+        """
+        artists_to_create_or_update: dict[str, dict] = {}
+        primary_artist_gids: set[str] = set()
+        songs_to_create_or_update: dict[str, dict] = {}
+        song_artist_gids: dict[str, list[str]] = {}
+
+        for track in tracks:
+            if track is None or track.get('id') is None or len(track['artists']) == 0:
+                continue
+            # Placeholder artists (ie. local files) can't be linked back to Spotify
+            if track['artists'][0]['id'] is None:
+                continue
+
+            track_artist_gids: list[str] = []
+            for artist in track['artists']:
+                if artist['id'] is None:
+                    continue
+                artist_gid = utils.uri_to_gid(artist['id'])
+                artists_to_create_or_update[artist_gid] = {
+                    'gid': artist_gid,
+                    'name': artist['name'],
+                }
+                if artist_gid not in track_artist_gids:
+                    track_artist_gids.append(artist_gid)
+
+            song = self.get_song_core_info(track)
+            primary_artist_gids.add(track_artist_gids[0])
+            songs_to_create_or_update[song['song_gid']] = {
+                'gid': song['song_gid'],
+                'name': song['song_name'],
+                'primary_artist_gid': track_artist_gids[0],
+            }
+            song_artist_gids[song['song_gid']] = track_artist_gids
+
+        if len(songs_to_create_or_update) == 0:
+            return {}
+
+        existing_artist_gids: set[str] = set()
+        for gid_batch in utils.chunked(artists_to_create_or_update.keys(), utils.SQLITE_IN_BATCH_SIZE):
+            existing_artist_gids.update(Artist.objects.filter(gid__in=gid_batch).values_list('gid', flat=True))
+
+        # Only the name is updated on conflict so existing artists are never un-tracked
+        Artist.objects.bulk_create(
+            [
+                Artist(**artist, tracked=track_artists and artist['gid'] in primary_artist_gids)
+                for artist in artists_to_create_or_update.values()
+            ],
+            update_conflicts=True,
+            unique_fields=["gid"],
+            update_fields=["name"],
+        )
+        if track_artists:
+            for gid_batch in utils.chunked(primary_artist_gids, utils.SQLITE_IN_BATCH_SIZE):
+                Artist.objects.filter(gid__in=gid_batch, tracked=False).update(tracked=True)
+
+        db_artists: dict[str, Artist] = {}
+        for gid_batch in utils.chunked(artists_to_create_or_update.keys(), utils.SQLITE_IN_BATCH_SIZE):
+            db_artists.update({artist.gid: artist for artist in Artist.objects.filter(gid__in=gid_batch)})
+
+        Song.objects.bulk_create(
+            [
+                Song(gid=song['gid'], name=song['name'], primary_artist=db_artists[song['primary_artist_gid']])
+                for song in songs_to_create_or_update.values()
+            ],
+            update_conflicts=True,
+            unique_fields=["gid"],
+            update_fields=["name", "primary_artist"],
+        )
+
+        db_songs: dict[str, Song] = {}
+        for gid_batch in utils.chunked(songs_to_create_or_update.keys(), utils.SQLITE_IN_BATCH_SIZE):
+            db_songs.update({song.gid: song for song in Song.objects.filter(gid__in=gid_batch)})
+
+        ContributingArtist.objects.bulk_create(
+            [
+                ContributingArtist(song=db_songs[song_gid], artist=db_artists[artist_gid])
+                for song_gid, artist_gids in song_artist_gids.items()
+                for artist_gid in artist_gids
+            ],
+            ignore_conflicts=True,
+        )
+        for artist_id_batch in utils.chunked([db_artist.id for db_artist in db_artists.values()], utils.SQLITE_IN_BATCH_SIZE):
+            stats.refresh_artist_stats(Artist.objects.filter(id__in=artist_id_batch))
+
+        # bulk_create skips the `post_save` receiver, so add the new artists to the pending album refresh set directly
+        PendingArtistRefresh.objects.bulk_create(
+            [
+                PendingArtistRefresh(artist=db_artist)
+                for artist_gid, db_artist in db_artists.items()
+                if artist_gid not in existing_artist_gids
+            ],
+            ignore_conflicts=True,
+        )
+
+        if track_artists:
+            # Newly tracked artists move their albums into the library totals
+            stats.refresh_library_stats()
+
+        return db_songs
+
+    @time_stage('db_upsert')
+    def diff_playlist_tracks(self, tracked_playlist: TrackedPlaylist, tracks: list[dict]) -> tuple[list[dict], list[int]]:
+        """Compare a freshly fetched playlist against its stored membership
+
+        Args:
+            tracked_playlist (TrackedPlaylist): The playlist the tracks were fetched for
+            tracks (list[dict]): Spotify track objects, as returned by `get_download_queue`
+
+        Returns:
+            tuple[list[dict], list[int]]: the tracks not yet in the playlist, and the IDs of the `PlaylistTrack` rows no longer in it
+        """
+        existing_playlist_tracks: dict[str, int] = dict(
+            PlaylistTrack.objects.filter(playlist=tracked_playlist).values_list('song__gid', 'id')
+        )
+
+        fetched_tracks: dict[str, dict] = {}
+        for track in tracks:
+            if track is None or track.get('id') is None:
+                continue
+            fetched_tracks[utils.uri_to_gid(track['id'])] = track
+
+        added_tracks = [track for song_gid, track in fetched_tracks.items() if song_gid not in existing_playlist_tracks]
+        removed_playlist_track_ids = [
+            playlist_track_id for song_gid, playlist_track_id in existing_playlist_tracks.items() if song_gid not in fetched_tracks
+        ]
+        return added_tracks, removed_playlist_track_ids
+
+    @time_stage('db_upsert')
+    def update_playlist_tracks(self, tracked_playlist: TrackedPlaylist, added_tracks: list[dict], removed_playlist_track_ids: list[int], db_songs: dict[str, Song]):
+        for playlist_track_id_batch in utils.chunked(removed_playlist_track_ids, utils.SQLITE_IN_BATCH_SIZE):
+            PlaylistTrack.objects.filter(id__in=playlist_track_id_batch).delete()
+
+        playlist_tracks_to_create: list[PlaylistTrack] = []
+        for track in added_tracks:
+            db_song = db_songs.get(utils.uri_to_gid(track['id']))
+            if db_song is None:
+                continue
+            playlist_tracks_to_create.append(PlaylistTrack(
+                playlist=tracked_playlist,
+                song=db_song,
+                added_at=utils.convert_date_string_to_datetime(track['added_at']) if track.get('added_at') else None,
+            ))
+
+        PlaylistTrack.objects.bulk_create(playlist_tracks_to_create, ignore_conflicts=True)
+
     def get_track(self, track_id: str) -> dict:
-        return self.spotipy_client.track(track_id)
+        return self.response_cache.get_or_fetch('track', track_id, lambda: self.spotipy_client.track(track_id))
+
+    def get_tracks(self, track_ids: list[str]) -> list[dict]:
+        tracks: dict[str, dict] = {}
+        uncached_track_ids: list[str] = []
+        for track_id in track_ids:
+            track = self.response_cache.get('track', track_id)
+            if track is None:
+                uncached_track_ids.append(track_id)
+            else:
+                tracks[track_id] = track
+
+        for track_id_batch in utils.chunked(uncached_track_ids, SPOTIFY_TRACKS_BATCH_SIZE):
+            for track in self.spotipy_client.tracks(track_id_batch)['tracks']:
+                if track is None:
+                    continue
+                self.response_cache.set('track', track['id'], track)
+                tracks[track['id']] = track
+
+        return [tracks[track_id] for track_id in track_ids if track_id in tracks]
+
+    def get_artist(self, artist_id: str) -> dict:
+        return self.response_cache.get_or_fetch('artist', artist_id, lambda: self.spotipy_client.artist(artist_id))
+
+    @time_stage('queue_resolution')
+    def get_spotdl_songs(self, tracks: list[dict]) -> dict[str, SpotdlSong]:
+        """Build spotdl songs for a queue item from the metadata that has already been fetched
+
+        Album track listings only contain simplified tracks, so those are re-fetched in batches.
+        Every album and primary artist is only fetched once for the whole queue item.
+
+        Args:
+            tracks (list[dict]): Spotify track objects, as returned by `get_download_queue`
+
+        Returns:
+            dict[str, SpotdlSong]: the songs, keyed by Spotify track ID; tracks that could not be built are omitted
+        """
+        full_tracks: dict[str, dict] = {}
+        simplified_track_ids: list[str] = []
+        for track in tracks:
+            if track is None or track.get('id') is None:
+                continue
+            if 'album' in track and 'external_ids' in track and 'popularity' in track:
+                full_tracks[track['id']] = track
+            else:
+                simplified_track_ids.append(track['id'])
+
+        for track in self.get_tracks(simplified_track_ids):
+            full_tracks[track['id']] = track
+
+        albums: dict[str, dict] = {}
+        artists: dict[str, dict] = {}
+        spotdl_songs: dict[str, SpotdlSong] = {}
+        for track_id, track in full_tracks.items():
+            try:
+                album_id = track['album']['id']
+                if album_id not in albums:
+                    albums[album_id] = self.get_album(album_id)
+                artist_id = track['artists'][0]['id']
+                if artist_id not in artists:
+                    artists[artist_id] = self.get_artist(artist_id)
+                spotdl_songs[track_id] = song_from_metadata(track, albums[album_id], artists[artist_id])
+            except Exception:
+                # Anything that can't be built here falls back to `SpotdlSong.from_url`
+                continue
+        return spotdl_songs
 
     def create_album(self, album_id: str, artist: Artist) -> Album:
         album_details = self.get_album(album_id)
@@ -66,7 +314,32 @@ class Downloader:
         return album
 
     def get_album(self, album_id: str) -> dict:
-        album = self.spotipy_client.album(album_id)
+        return self.response_cache.get_or_fetch('album', album_id, lambda: self.fetch_album(album_id))
+
+    def get_albums(self, album_ids: list[str]) -> list[dict]:
+        albums: dict[str, dict] = {}
+        uncached_album_ids: list[str] = []
+        for album_id in album_ids:
+            album = self.response_cache.get('album', album_id)
+            if album is None:
+                uncached_album_ids.append(album_id)
+            else:
+                albums[album_id] = album
+
+        for album_id_batch in utils.chunked(uncached_album_ids, SPOTIFY_ALBUMS_BATCH_SIZE):
+            for album in self.spotipy_client.albums(album_id_batch)['albums']:
+                if album is None:
+                    continue
+                album = self.fetch_remaining_album_tracks(album)
+                self.response_cache.set('album', album['id'], album)
+                albums[album['id']] = album
+
+        return [albums[album_id] for album_id in album_ids if album_id in albums]
+
+    def fetch_album(self, album_id: str) -> dict:
+        return self.fetch_remaining_album_tracks(self.spotipy_client.album(album_id))
+
+    def fetch_remaining_album_tracks(self, album: dict) -> dict:
         album_track_iterator = self.spotipy_client.next(album["tracks"])
 
         while album_track_iterator is not None:
@@ -74,7 +347,15 @@ class Downloader:
             album_track_iterator = self.spotipy_client.next(album_track_iterator)
         return album
     
-    def get_playlist(self, playlist_id: str) -> dict:
+    def get_playlist(self, playlist_id: str, force_refresh: bool = False) -> dict:
+        return self.response_cache.get_or_fetch('playlist', playlist_id, lambda: self.fetch_playlist(playlist_id), force_refresh=force_refresh)
+
+    @time_stage('queue_resolution')
+    def get_playlist_snapshot_id(self, playlist_id: str) -> str:
+        # Only request the snapshot ID, so checking for changes doesn't page through any tracks
+        return self.spotipy_client.playlist(playlist_id, fields='snapshot_id')['snapshot_id']
+
+    def fetch_playlist(self, playlist_id: str) -> dict:
         playlist = self.spotipy_client.playlist(playlist_id)
         playlist_iterator = self.spotipy_client.next(playlist["tracks"])
 
@@ -83,7 +364,8 @@ class Downloader:
             playlist_iterator = self.spotipy_client.next(playlist_iterator)
         return playlist
     
-    def get_download_queue(self, url: str) -> list[dict]:
+    @time_stage('queue_resolution')
+    def get_download_queue(self, url: str, force_refresh: bool = False) -> list[dict]:
         uri = re.search(r"(\w{22})", url).group(1)
         download_queue = []
         if "album" in url:
@@ -91,7 +373,7 @@ class Downloader:
         elif "track" in url:
             download_queue.append(self.get_track(uri))
         elif "playlist" in url:
-            raw_playlist = self.get_playlist(uri)["tracks"]["items"]
+            raw_playlist = self.get_playlist(uri, force_refresh=force_refresh)["tracks"]["items"]
             for i in raw_playlist:
                 i['track']['added_at'] = i['added_at']
             download_queue.extend(
@@ -100,6 +382,40 @@ class Downloader:
         else:
             raise Exception("Not a valid Spotify URL")
         return download_queue
+
+    @time_stage('queue_resolution')
+    def get_download_queues(self, urls: list[str]) -> dict[str, list[dict]]:
+        """Resolve many album and track URLs at once through Spotify's multi-get endpoints
+
+        Args:
+            urls (list[str]): The URLs to resolve, as accepted by `get_download_queue`
+
+        Returns:
+            dict[str, list[dict]]: the download queue for each URL, the same as `get_download_queue` would return.
+                Playlists, and anything Spotify didn't return, are left out to be resolved by `get_download_queue`
+        """
+        album_ids: dict[str, str] = {}
+        track_ids: dict[str, str] = {}
+        for url in urls:
+            uri = re.search(r"(\w{22})", url)
+            if uri is None:
+                continue
+            if "album" in url:
+                album_ids[url] = uri.group(1)
+            elif "track" in url:
+                track_ids[url] = uri.group(1)
+
+        albums = {album['id']: album for album in self.get_albums(list(dict.fromkeys(album_ids.values())))}
+        tracks = {track['id']: track for track in self.get_tracks(list(dict.fromkeys(track_ids.values())))}
+
+        download_queues: dict[str, list[dict]] = {}
+        for url, album_id in album_ids.items():
+            if album_id in albums:
+                download_queues[url] = list(albums[album_id]["tracks"]["items"])
+        for url, track_id in track_ids.items():
+            if track_id in tracks:
+                download_queues[url] = [tracks[track_id]]
+        return download_queues
     
     def get_song_core_info(self, metadata: dict) -> str:
         return {
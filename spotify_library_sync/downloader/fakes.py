@@ -0,0 +1,462 @@
+import random
+import re
+import struct
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+from spotdl.types.song import Song as SpotdlSong
+from spotipy.exceptions import SpotifyException
+
+from . import utils
+from .metrics import time_stage
+
+API_ROOT = "https://api.spotify.com/v1"
+# Page sizes Spotify uses for the listings embedded in album and playlist responses
+ALBUM_TRACKS_PAGE_SIZE = 50
+PLAYLIST_TRACKS_PAGE_SIZE = 100
+
+NAME_WORDS = [
+    "black", "blue", "city", "crystal", "dream", "echo", "electric", "fever", "fire", "ghost", "glass", "golden",
+    "heart", "home", "iron", "lights", "lost", "love", "machine", "moon", "neon", "night", "ocean", "paper", "radio",
+    "rivers", "shadow", "silver", "sonic", "summer", "sun", "tonight", "velvet", "wild", "björk", "rós", "beyoncé",
+]
+ALBUM_GROUPS = [("album", 0.4), ("single", 0.4), ("compilation", 0.05), ("appears_on", 0.15)]
+
+class FakeSpotifyCatalog:
+    """A reproducible catalog of artists, albums, tracks and playlists, shaped like Spotify Web API responses
+
+    Albums are stored with their full track listing, `FakeSpotifyClient` pages them the way Spotify does when serving them.
+    """
+
+    def __init__(self, seed: int = 0, albums_per_artist: int = 6, tracks_per_album: int = 12):
+        self.rng = random.Random(seed)
+        self.albums_per_artist = albums_per_artist
+        self.tracks_per_album = tracks_per_album
+        self.artists: dict[str, dict] = {}
+        self.artist_ids: list[str] = []
+        self.albums: dict[str, dict] = {}
+        self.tracks: dict[str, dict] = {}
+        self.playlists: dict[str, dict] = {}
+        self.artist_album_ids: dict[str, list[str]] = {}
+        # Tracks of the artists added for playlists that aren't in a playlist yet, so playlists never share tracks with other jobs
+        self.unused_track_ids: list[str] = []
+        self.added_at_origin = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+    def random_id(self) -> str:
+        return utils.gid_to_uri(f"{self.rng.getrandbits(128):032x}")
+
+    def random_name(self, length: int) -> str:
+        return " ".join(self.rng.choice(NAME_WORDS) for _ in range(self.rng.randint(1, length))).title()
+
+    @staticmethod
+    def simplified(resource: dict, fields: list[str]) -> dict:
+        return {field: resource[field] for field in fields}
+
+    def add_artist(self) -> dict:
+        """Add an artist with `albums_per_artist` albums (of mixed types), and return it"""
+        artist_id = self.random_id()
+        artist = {
+            'external_urls': {'spotify': f"https://open.spotify.com/artist/{artist_id}"},
+            'followers': {'href': None, 'total': self.rng.randint(0, 1000000)},
+            'genres': self.rng.sample(["indie", "pop", "rock", "electronic", "folk", "hip hop"], 2),
+            'href': f"{API_ROOT}/artists/{artist_id}",
+            'id': artist_id,
+            'images': [{'url': f"https://i.scdn.co/image/{artist_id}", 'height': 640, 'width': 640}],
+            'name': self.random_name(3),
+            'popularity': self.rng.randint(0, 100),
+            'type': 'artist',
+            'uri': f"spotify:artist:{artist_id}",
+        }
+        self.artists[artist_id] = artist
+        self.artist_ids.append(artist_id)
+        self.artist_album_ids[artist_id] = []
+
+        album_groups, album_group_weights = zip(*ALBUM_GROUPS)
+        for _ in range(self.albums_per_artist):
+            self.add_album(artist, self.rng.choices(album_groups, album_group_weights)[0])
+        return artist
+
+    def add_album(self, artist: dict, album_group: str) -> dict:
+        album_id = self.random_id()
+        simplified_artist = self.simplified(artist, ['external_urls', 'href', 'id', 'name', 'type', 'uri'])
+        release_date = (self.added_at_origin - timedelta(days=self.rng.randint(0, 20 * 365))).date().isoformat()
+        album = {
+            'album_type': 'album' if album_group == 'appears_on' else album_group,
+            'album_group': album_group,
+            'artists': [simplified_artist],
+            'copyrights': [{'text': f"{release_date[:4]} {artist['name']}", 'type': 'C'}],
+            'external_ids': {'upc': f"{self.rng.getrandbits(40):013d}"},
+            'external_urls': {'spotify': f"https://open.spotify.com/album/{album_id}"},
+            'genres': [],
+            'href': f"{API_ROOT}/albums/{album_id}",
+            'id': album_id,
+            'images': [
+                {'url': f"https://i.scdn.co/image/{album_id}{size}", 'height': size, 'width': size}
+                for size in (640, 300, 64)
+            ],
+            'label': f"{self.random_name(2)} Records",
+            'name': self.random_name(4),
+            'popularity': self.rng.randint(0, 100),
+            'release_date': release_date,
+            'release_date_precision': 'day',
+            'total_tracks': 0,
+            'tracks': {'items': []},
+            'type': 'album',
+            'uri': f"spotify:album:{album_id}",
+        }
+        simplified_album = self.simplified(album, [
+            'album_type', 'artists', 'external_urls', 'href', 'id', 'images', 'name', 'release_date',
+            'release_date_precision', 'total_tracks', 'type', 'uri',
+        ])
+
+        track_count = 1 if album_group == 'single' else self.tracks_per_album
+        album['total_tracks'] = simplified_album['total_tracks'] = track_count
+        for track_number in range(1, track_count + 1):
+            track_artists = [simplified_artist]
+            # Some tracks are features, with a second artist
+            if self.rng.random() < 0.2 and len(self.artist_ids) > 1:
+                featured_artist = self.artists[self.rng.choice(self.artist_ids)]
+                if featured_artist['id'] != artist['id']:
+                    track_artists.append(self.simplified(featured_artist, ['external_urls', 'href', 'id', 'name', 'type', 'uri']))
+            track = self.add_track(simplified_album, track_artists, track_number)
+            album['tracks']['items'].append(self.simplified_track(track))
+
+        self.albums[album_id] = album
+        self.artist_album_ids[artist['id']].append(album_id)
+        return album
+
+    def add_track(self, simplified_album: dict, track_artists: list[dict], track_number: int) -> dict:
+        track_id = self.random_id()
+        track = {
+            'album': simplified_album,
+            'artists': track_artists,
+            'disc_number': 1,
+            'duration_ms': self.rng.randint(90000, 360000),
+            'explicit': self.rng.random() < 0.1,
+            'external_ids': {'isrc': f"QZ{self.rng.getrandbits(32):010d}"},
+            'external_urls': {'spotify': f"https://open.spotify.com/track/{track_id}"},
+            'href': f"{API_ROOT}/tracks/{track_id}",
+            'id': track_id,
+            'is_local': False,
+            'name': self.random_name(5),
+            'popularity': self.rng.randint(0, 100),
+            'preview_url': None,
+            'track_number': track_number,
+            'type': 'track',
+            'uri': f"spotify:track:{track_id}",
+        }
+        self.tracks[track_id] = track
+        return track
+
+    @staticmethod
+    def simplified_track(track: dict) -> dict:
+        return {field: value for field, value in track.items() if field not in ('album', 'external_ids', 'popularity')}
+
+    def take_unused_tracks(self, count: int) -> list[str]:
+        while len(self.unused_track_ids) < count:
+            artist = self.add_artist()
+            for album_id in self.artist_album_ids[artist['id']]:
+                self.unused_track_ids.extend(track['id'] for track in self.albums[album_id]['tracks']['items'])
+        track_ids = self.unused_track_ids[:count]
+        del self.unused_track_ids[:count]
+        return track_ids
+
+    def add_playlist(self, track_count: int) -> dict:
+        """Add a playlist of `track_count` tracks from artists only added for playlists (so no other job has downloaded them)"""
+        playlist_id = self.random_id()
+        playlist = {
+            'collaborative': False,
+            'description': "",
+            'external_urls': {'spotify': f"https://open.spotify.com/playlist/{playlist_id}"},
+            'href': f"{API_ROOT}/playlists/{playlist_id}",
+            'id': playlist_id,
+            'images': [],
+            'name': self.random_name(3),
+            'owner': {'display_name': "benchmark", 'id': "benchmark", 'type': 'user', 'uri': "spotify:user:benchmark"},
+            'public': True,
+            'snapshot_id': self.random_id(),
+            'tracks': {'items': []},
+            'type': 'playlist',
+            'uri': f"spotify:playlist:{playlist_id}",
+        }
+        self.playlists[playlist_id] = playlist
+        self.add_playlist_tracks(playlist_id, track_count)
+        return playlist
+
+    def add_playlist_tracks(self, playlist_id: str, count: int) -> list[str]:
+        """Append `count` new tracks to the playlist, changing its snapshot ID like Spotify does"""
+        playlist = self.playlists[playlist_id]
+        track_ids = self.take_unused_tracks(count)
+        first_added_at = self.added_at_origin + timedelta(minutes=len(playlist['tracks']['items']))
+        for index, track_id in enumerate(track_ids):
+            playlist['tracks']['items'].append({
+                'added_at': (first_added_at + timedelta(minutes=index)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                'added_by': playlist['owner'],
+                'is_local': False,
+                'track': self.tracks[track_id],
+            })
+        playlist['snapshot_id'] = self.random_id()
+        return track_ids
+
+class FakeSpotifyClient:
+    """Serves a `FakeSpotifyCatalog` through the parts of spotipy's `Spotify` client the downloader uses
+
+    Listings are paged (and followed with `next`) like the real API, so every request the pipeline makes is counted
+    in `request_counts` and optionally delayed by `latency` seconds.
+    """
+
+    def __init__(self, catalog: FakeSpotifyCatalog, latency: float = 0):
+        self.catalog = catalog
+        self.latency = latency
+        self.request_counts: Counter[str] = Counter()
+        self._lock = threading.Lock()
+
+    def _request(self, endpoint: str):
+        with self._lock:
+            self.request_counts[endpoint] += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    @staticmethod
+    def _get_id(resource_id: str) -> str:
+        # Accepts IDs, URIs and URLs, like spotipy
+        match = re.search(r"(\w{22})", resource_id)
+        return match.group(1) if match is not None else resource_id
+
+    @staticmethod
+    def _not_found(url: str):
+        raise SpotifyException(404, -1, f"{url}:\n Resource not found", reason=None)
+
+    @staticmethod
+    def _page(items: list, href: str, offset: int, limit: int) -> dict:
+        page_items = items[offset:offset + limit]
+        return {
+            'href': f"{href}?offset={offset}&limit={limit}",
+            'items': page_items,
+            'limit': limit,
+            'next': f"{href}?offset={offset + limit}&limit={limit}" if offset + limit < len(items) else None,
+            'offset': offset,
+            'previous': f"{href}?offset={max(0, offset - limit)}&limit={limit}" if offset > 0 else None,
+            'total': len(items),
+        }
+
+    def _album_response(self, album: dict) -> dict:
+        return {
+            **album,
+            'tracks': self._page(album['tracks']['items'], f"{album['href']}/tracks", 0, ALBUM_TRACKS_PAGE_SIZE),
+        }
+
+    def album(self, album_id: str, market: str | None = None) -> dict:
+        self._request('album')
+        album = self.catalog.albums.get(self._get_id(album_id))
+        if album is None:
+            self._not_found(f"{API_ROOT}/albums/{album_id}")
+        return self._album_response(album)
+
+    def albums(self, albums: list[str], market: str | None = None) -> dict:
+        self._request('albums')
+        return {'albums': [
+            self._album_response(self.catalog.albums[album_id]) if album_id in self.catalog.albums else None
+            for album_id in map(self._get_id, albums)
+        ]}
+
+    def track(self, track_id: str, market: str | None = None) -> dict:
+        self._request('track')
+        track = self.catalog.tracks.get(self._get_id(track_id))
+        if track is None:
+            self._not_found(f"{API_ROOT}/tracks/{track_id}")
+        return track
+
+    def tracks(self, tracks: list[str], market: str | None = None) -> dict:
+        self._request('tracks')
+        return {'tracks': [self.catalog.tracks.get(track_id) for track_id in map(self._get_id, tracks)]}
+
+    def artist(self, artist_id: str) -> dict:
+        self._request('artist')
+        artist = self.catalog.artists.get(self._get_id(artist_id))
+        if artist is None:
+            self._not_found(f"{API_ROOT}/artists/{artist_id}")
+        return artist
+
+    def artist_albums(self, artist_id: str, album_type: str | None = None, include_groups: str | None = None, country: str | None = None, limit: int = 20, offset: int = 0) -> dict:
+        self._request('artist_albums')
+        artist_id = self._get_id(artist_id)
+        if artist_id not in self.catalog.artists:
+            self._not_found(f"{API_ROOT}/artists/{artist_id}/albums")
+        albums = [
+            {field: value for field, value in self.catalog.albums[album_id].items() if field not in ('copyrights', 'external_ids', 'genres', 'label', 'popularity', 'tracks')}
+            for album_id in self.catalog.artist_album_ids[artist_id]
+        ]
+        return self._page(albums, f"{API_ROOT}/artists/{artist_id}/albums", offset, min(limit, 50))
+
+    def playlist(self, playlist_id: str, fields: str | None = None, market: str | None = None, additional_types: tuple[str, ...] = ("track",)) -> dict:
+        self._request('playlist')
+        playlist = self.catalog.playlists.get(self._get_id(playlist_id))
+        if playlist is None:
+            self._not_found(f"{API_ROOT}/playlists/{playlist_id}")
+        if fields == 'snapshot_id':
+            return {'snapshot_id': playlist['snapshot_id']}
+        return {
+            **playlist,
+            'tracks': self._page(playlist['tracks']['items'], f"{playlist['href']}/tracks", 0, PLAYLIST_TRACKS_PAGE_SIZE),
+        }
+
+    def next(self, result: dict) -> dict | None:
+        if not result.get('next'):
+            return None
+        self._request('next')
+        next_url = urlparse(result['next'])
+        query = parse_qs(next_url.query)
+        offset, limit = int(query['offset'][0]), int(query['limit'][0])
+        path = next_url.path.removeprefix(urlparse(API_ROOT).path).strip('/').split('/')
+        href = f"{API_ROOT}/{'/'.join(path)}"
+        match path:
+            case ['albums', album_id, 'tracks']:
+                items = self.catalog.albums[album_id]['tracks']['items']
+            case ['playlists', playlist_id, 'tracks']:
+                items = self.catalog.playlists[playlist_id]['tracks']['items']
+            case ['artists', artist_id, 'albums']:
+                return self.artist_albums(artist_id, limit=limit, offset=offset)
+            case _:
+                self._not_found(result['next'])
+        return self._page(items, href, offset, limit)
+
+def _box(kind: bytes, *payloads: bytes) -> bytes:
+    payload = b"".join(payloads)
+    return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+def _full_box(kind: bytes, version: int, flags: int, *payloads: bytes) -> bytes:
+    return _box(kind, struct.pack(">I", (version << 24) | flags), *payloads)
+
+def _descriptor(tag: int, payload: bytes) -> bytes:
+    return bytes([tag, 0x80, 0x80, 0x80, len(payload)]) + payload
+
+def m4a_bytes(duration: float, bitrate: int, sample_rate: int = 44100) -> bytes:
+    """Build a minimal (silent) AAC LC stereo m4a that MediaInfo reports with the given duration (in seconds) and bitrate (in kbps)"""
+    # AAC frames are 1024 samples each, sized to match the bitrate
+    frame_count = max(1, round(duration * sample_rate / 1024))
+    frame_size = max(8, round(bitrate * 1000 / 8 * 1024 / sample_rate))
+    media_duration = frame_count * 1024
+    movie_duration = round(media_duration / sample_rate * 1000)
+    identity_matrix = struct.pack(">9I", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+
+    ftyp = _box(b"ftyp", b"M4A ", struct.pack(">I", 0), b"M4A isomiso2")
+    mdat = _box(b"mdat", bytes(frame_size * frame_count))
+
+    # AudioSpecificConfig: AAC LC (object type 2), 44.1kHz (frequency index 4), 2 channels
+    audio_specific_config = bytes([(2 << 3) | (4 >> 1), ((4 & 1) << 7) | (2 << 3)])
+    decoder_config = struct.pack(">BBBHII", 0x40, 0x15, 0, 0, bitrate * 1000, bitrate * 1000) + _descriptor(0x05, audio_specific_config)
+    esds = _full_box(b"esds", 0, 0, _descriptor(0x03, struct.pack(">HB", 1, 0) + _descriptor(0x04, decoder_config) + _descriptor(0x06, b"\x02")))
+    mp4a = _box(b"mp4a", bytes(6), struct.pack(">H", 1), bytes(8), struct.pack(">HHHHI", 2, 16, 0, 0, sample_rate << 16), esds)
+    stbl = _box(
+        b"stbl",
+        _full_box(b"stsd", 0, 0, struct.pack(">I", 1), mp4a),
+        _full_box(b"stts", 0, 0, struct.pack(">III", 1, frame_count, 1024)),
+        _full_box(b"stsc", 0, 0, struct.pack(">IIII", 1, 1, frame_count, 1)),
+        _full_box(b"stsz", 0, 0, struct.pack(">II", frame_size, frame_count)),
+        # The single chunk is the whole of `mdat`, which directly follows `ftyp`
+        _full_box(b"stco", 0, 0, struct.pack(">II", 1, len(ftyp) + 8)),
+    )
+    minf = _box(
+        b"minf",
+        _full_box(b"smhd", 0, 0, bytes(4)),
+        _box(b"dinf", _full_box(b"dref", 0, 0, struct.pack(">I", 1), _full_box(b"url ", 0, 1))),
+        stbl,
+    )
+    mdia = _box(
+        b"mdia",
+        _full_box(b"mdhd", 0, 0, struct.pack(">IIIIHH", 0, 0, sample_rate, media_duration, 0x55c4, 0)),
+        _full_box(b"hdlr", 0, 0, bytes(4), b"soun", bytes(12), b"SoundHandler\x00"),
+        minf,
+    )
+    tkhd = _full_box(b"tkhd", 0, 3, struct.pack(">IIIII", 0, 0, 1, 0, movie_duration), bytes(8), struct.pack(">HHHH", 0, 0, 0x0100, 0), identity_matrix, bytes(8))
+    mvhd = _full_box(b"mvhd", 0, 0, struct.pack(">IIII", 0, 0, 1000, movie_duration), struct.pack(">IH", 0x10000, 0x0100), bytes(10), identity_matrix, bytes(24), struct.pack(">I", 2))
+    moov = _box(b"moov", mvhd, _box(b"trak", tkhd, mdia))
+    return ftyp + mdat + moov
+
+class FakeAudioDownloader:
+    """Stands in for spotdl's `Downloader`, "matching" every song and writing a short silent m4a for it
+
+    Whether a song fails to match, fails to download or comes out below `bitrate` is decided from the seed and
+    the song's ID, so reruns fail the same songs no matter what order the worker threads pick them up in.
+    """
+
+    def __init__(
+        self,
+        output_directory: str | Path,
+        threads: int = 4,
+        search_latency: float = 0,
+        download_latency: float = 0,
+        search_failure_rate: float = 0,
+        download_failure_rate: float = 0,
+        bitrate: int = 256,
+        low_bitrate_rate: float = 0,
+        low_bitrate: int = 96,
+        duration: float = 0.5,
+        seed: int = 0,
+    ):
+        self.output_directory = Path(output_directory)
+        self.search_latency = search_latency
+        self.download_latency = download_latency
+        self.search_failure_rate = search_failure_rate
+        self.download_failure_rate = download_failure_rate
+        self.bitrate = bitrate
+        self.low_bitrate_rate = low_bitrate_rate
+        self.low_bitrate = low_bitrate
+        self.duration = duration
+        self.seed = seed
+        self.errors: list[str] = []
+        self.executor = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix="fake_download")
+
+    def _roll(self, song: SpotdlSong, purpose: str) -> float:
+        return random.Random(f"{self.seed}:{song.song_id}:{purpose}").random()
+
+    def search(self, song: SpotdlSong) -> str:
+        if self.search_latency > 0:
+            time.sleep(self.search_latency)
+        if self._roll(song, 'search') < self.search_failure_rate:
+            raise LookupError(f"No results found for song: {song.display_name}")
+        return f"https://music.youtube.com/watch?v={song.song_id[:11]}"
+
+    def download_song(self, song: SpotdlSong) -> tuple[SpotdlSong, Path | None]:
+        if song.download_url is None:
+            try:
+                song.download_url = self.search(song)
+            except LookupError as exception:
+                self.errors.append(f"{song.url} - {exception}")
+                return song, None
+
+        # Timed like spotdl's own (monkeypatched) `search_and_download`
+        with time_stage('download'):
+            if self.download_latency > 0:
+                time.sleep(self.download_latency)
+            if self._roll(song, 'download') < self.download_failure_rate:
+                self.errors.append(f"{song.url} - Failed to download")
+                return song, None
+
+            bitrate = self.low_bitrate if self._roll(song, 'bitrate') < self.low_bitrate_rate else self.bitrate
+            output_path = self.output_directory / self._safe_name(song.artist) / self._safe_name(song.album_name) / f"{self._safe_name(song.display_name)}.m4a"
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            output_path.write_bytes(m4a_bytes(self.duration, bitrate))
+        return song, output_path
+
+    def download_songs(self, songs: list[SpotdlSong]) -> list[tuple[SpotdlSong, Path | None]]:
+        return list(self.executor.map(self.download_song, songs))
+
+    @staticmethod
+    def _safe_name(name: str) -> str:
+        return re.sub(r'[/\\:*?"<>|]', "_", name)
+
+class FakeSpotdl:
+    """Stands in for `spotdl.Spotdl`, of which only `downloader` and `download` are used"""
+
+    def __init__(self, downloader: FakeAudioDownloader):
+        self.downloader = downloader
+
+    def download(self, song: SpotdlSong) -> tuple[SpotdlSong, Path | None]:
+        return self.downloader.download_song(song)
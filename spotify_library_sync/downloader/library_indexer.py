@@ -0,0 +1,171 @@
+import logging
+import os
+import re
+from pathlib import Path
+
+from django.db.models import Exists, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from library_manager.models import LibraryDirectory, LibraryFile, Song
+from . import utils
+from .audio_probe import AudioProber
+from .default_download_settings import DEFAULT_DOWNLOAD_SETTINGS
+
+from spotdl.utils.ffmpeg import FFMPEG_FORMATS
+from spotdl.utils.metadata import get_file_metadata
+
+AUDIO_FILE_EXTENSIONS = {f".{file_format}" for file_format in FFMPEG_FORMATS.keys()}
+
+class LibraryIndexer:
+    """Index the audio files in the download output tree, and map each of them back to a `Song.gid`
+
+    Files are keyed by path, with their size and mtime, so a rescan only reads the tags of new or changed files.
+    Directories whose mtime hasn't changed are not re-examined at all, besides looking for sub-directories.
+    """
+
+    def __init__(self, root: str | None = None, logger: logging.Logger | None = None):
+        self.root = root if root is not None else utils.get_output_root(DEFAULT_DOWNLOAD_SETTINGS["output"])
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+
+    def scan(self, full: bool = False) -> dict[str, int]:
+        """Walk the library and update the index
+
+        Args:
+            full (bool): Re-examine every directory, even if its mtime hasn't changed
+
+        Raises:
+            FileNotFoundError: If the library root doesn't exist (ie. the mount is missing), rather than emptying the index
+
+        Returns:
+            dict[str, int]: counts of the directories and files that were examined or changed
+        """
+        if not os.path.isdir(self.root):
+            raise FileNotFoundError(f"Library root {self.root} does not exist")
+
+        stats = {'directories': 0, 'directories_changed': 0, 'files_indexed': 0, 'files_removed': 0}
+        known_directories: dict[str, float] = dict(LibraryDirectory.objects.values_list('path', 'mtime'))
+        seen_directories: set[str] = set()
+        directories_to_scan = [self.root]
+
+        while directories_to_scan:
+            directory = directories_to_scan.pop()
+            try:
+                directory_mtime = os.stat(directory).st_mtime
+                with os.scandir(directory) as directory_iterator:
+                    entries = list(directory_iterator)
+            except OSError as exception:
+                self.logger.warning(f"Unable to read {directory}: {exception}")
+                continue
+
+            seen_directories.add(directory)
+            stats['directories'] += 1
+            directories_to_scan.extend(entry.path for entry in entries if entry.is_dir(follow_symlinks=False))
+
+            # Adding, removing or replacing a file always changes the directory's mtime
+            if not full and known_directories.get(directory) == directory_mtime:
+                continue
+
+            stats['directories_changed'] += 1
+            audio_files = [
+                entry for entry in entries
+                if entry.is_file(follow_symlinks=False) and os.path.splitext(entry.name)[1].lower() in AUDIO_FILE_EXTENSIONS
+            ]
+            indexed, removed = self.index_directory(directory, audio_files)
+            stats['files_indexed'] += indexed
+            stats['files_removed'] += removed
+            LibraryDirectory.objects.update_or_create(path=directory, defaults={'mtime': directory_mtime})
+
+        removed_directories = [directory for directory in known_directories if directory not in seen_directories]
+        for directory_batch in utils.chunked(removed_directories, utils.SQLITE_IN_BATCH_SIZE):
+            stats['files_removed'] += LibraryFile.objects.filter(directory__in=directory_batch).delete()[0]
+            LibraryDirectory.objects.filter(path__in=directory_batch).delete()
+
+        self.logger.info(f"Indexed library at {self.root}: {stats}")
+        return stats
+
+    def index_directory(self, directory: str, audio_files: list[os.DirEntry]) -> tuple[int, int]:
+        existing_files: dict[str, LibraryFile] = {
+            library_file.path: library_file for library_file in LibraryFile.objects.filter(directory=directory)
+        }
+
+        files_to_create_or_update: list[LibraryFile] = []
+        for audio_file in audio_files:
+            try:
+                file_stat = audio_file.stat()
+            except OSError:
+                continue
+            library_file = existing_files.pop(audio_file.path, None)
+            if library_file is not None and library_file.size == file_stat.st_size and library_file.mtime == file_stat.st_mtime:
+                continue
+
+            files_to_create_or_update.append(LibraryFile(
+                path=audio_file.path,
+                directory=directory,
+                size=file_stat.st_size,
+                mtime=file_stat.st_mtime,
+                song_gid=self.read_song_gid(audio_file.path),
+                # The file changed, so any cached probe result no longer applies
+                bitrate=None,
+            ))
+
+        removed_file_ids = [library_file.id for library_file in existing_files.values()]
+        for file_id_batch in utils.chunked(removed_file_ids, utils.SQLITE_IN_BATCH_SIZE):
+            LibraryFile.objects.filter(id__in=file_id_batch).delete()
+
+        LibraryFile.objects.bulk_create(
+            files_to_create_or_update,
+            update_conflicts=True,
+            unique_fields=["path"],
+            update_fields=["directory", "size", "mtime", "song_gid", "bitrate", "indexed_at"],
+        )
+        return len(files_to_create_or_update), len(removed_file_ids)
+
+    def read_song_gid(self, path: str) -> str | None:
+        # spotdl embeds the Spotify track URL in every file it writes
+        try:
+            metadata = get_file_metadata(Path(path))
+        except Exception as exception:
+            self.logger.debug(f"Unable to read tags from {path}: {exception}")
+            return None
+        if not metadata or not metadata.get('url'):
+            return None
+        track_id = re.search(r"track[/:](\w{22})", metadata['url'])
+        return utils.uri_to_gid(track_id.group(1)) if track_id is not None else None
+
+    def probe_missing_bitrates(self, audio_prober: AudioProber) -> int:
+        """Probe the indexed files of songs with no known bitrate; files that were probed before are never re-parsed"""
+        paths = LibraryFile.objects.filter(
+            bitrate=None,
+            song_gid__isnull=False,
+        ).filter(Exists(Song.objects.filter(gid=OuterRef('song_gid'), bitrate=0))).values_list('path', flat=True)
+        return len(audio_prober.probe_many(paths))
+
+    def reconcile(self) -> dict[str, int]:
+        """Update `Song.downloaded`, `Song.file_path` and any unknown `Song.bitrate` to match the index
+
+        Returns:
+            dict[str, int]: the number of songs marked as downloaded and as not downloaded
+        """
+        # Files without usable tags can still be matched on the path they were downloaded to
+        LibraryFile.objects.filter(song_gid=None).update(
+            song_gid=Subquery(Song.objects.filter(file_path=OuterRef('path')).values('gid')[:1])
+        )
+
+        indexed_by_gid = LibraryFile.objects.filter(song_gid=OuterRef('gid'))
+        indexed_by_path = LibraryFile.objects.filter(path=OuterRef('file_path'))
+
+        marked_downloaded = Song.objects.filter(
+            Q(downloaded=False) | ~Exists(indexed_by_path),
+            Exists(indexed_by_gid),
+        ).update(
+            downloaded=True,
+            file_path=Subquery(indexed_by_gid.order_by('-mtime').values('path')[:1]),
+        )
+        Song.objects.filter(bitrate=0).filter(Exists(indexed_by_gid.filter(bitrate__gt=0))).update(
+            bitrate=Coalesce(Subquery(indexed_by_gid.filter(bitrate__gt=0).order_by('-mtime').values('bitrate')[:1]), 0),
+        )
+        marked_not_downloaded = Song.objects.filter(downloaded=True).exclude(Exists(indexed_by_gid)).exclude(Exists(indexed_by_path)).update(downloaded=False)
+
+        stats = {'marked_downloaded': marked_downloaded, 'marked_not_downloaded': marked_not_downloaded}
+        self.logger.info(f"Reconciled songs with the library index: {stats}")
+        return stats
@@ -0,0 +1,213 @@
+import logging
+import math
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import cache
+from typing import Iterator
+
+from django.conf import settings
+
+from lib.sqlite_store import SqliteStore
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (in seconds) of the stage duration buckets, from a cached lookup up to a slow download
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, math.inf)
+
+# Every metric recorded through the store, with its Prometheus type and help text
+METRICS = {
+    'spotify_sync_stage_seconds': ('histogram', "Time spent in each stage of the download pipeline"),
+    'spotify_sync_tracks_total': ('counter', "Tracks processed by the download pipeline, by result"),
+}
+
+class MetricsStore(SqliteStore):
+    """Counters and histograms shared by the web and huey worker processes, exposed in the Prometheus text format
+
+    Each process buffers its updates in memory and adds them to the store in a single transaction at most every
+    `flush_interval` seconds (and when `flush` is called), so recording a sample doesn't touch the disk.
+    """
+    schema = [
+        """CREATE TABLE IF NOT EXISTS counter (
+            name TEXT NOT NULL,
+            labels TEXT NOT NULL,
+            value REAL NOT NULL,
+            PRIMARY KEY (name, labels)
+        );""",
+        """CREATE TABLE IF NOT EXISTS histogram (
+            name TEXT NOT NULL,
+            labels TEXT NOT NULL,
+            sum REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (name, labels)
+        );""",
+        # Per bucket (not cumulative) counts, so concurrent flushes can just add to them
+        """CREATE TABLE IF NOT EXISTS histogram_bucket (
+            name TEXT NOT NULL,
+            labels TEXT NOT NULL,
+            le REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (name, labels, le)
+        );""",
+    ]
+
+    def __init__(self, path: str, flush_interval: float = 5, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(path)
+        self.flush_interval = flush_interval
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._pending_counters: dict[tuple[str, str], float] = {}
+        self._pending_histograms: dict[tuple[str, str], list] = {}
+        self._last_flush = time.monotonic()
+
+    @classmethod
+    def from_settings(cls) -> "MetricsStore":
+        return cls(settings.metrics_location, flush_interval=settings.get('metrics_flush_interval', 5))
+
+    @staticmethod
+    def format_labels(labels: dict[str, str]) -> str:
+        escaped_labels = (
+            (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+            for name, value in sorted(labels.items())
+        )
+        return ",".join(f'{name}="{value}"' for name, value in escaped_labels)
+
+    def increment(self, name: str, amount: float = 1, **labels: str):
+        key = (name, self.format_labels(labels))
+        with self._lock:
+            self._pending_counters[key] = self._pending_counters.get(key, 0) + amount
+        self._flush_if_due()
+
+    def observe(self, name: str, value: float, **labels: str):
+        key = (name, self.format_labels(labels))
+        with self._lock:
+            # [count per bucket, sum, count]
+            histogram = self._pending_histograms.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            histogram[0][next(index for index, upper_bound in enumerate(self.buckets) if value <= upper_bound)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+        self._flush_if_due()
+
+    @contextmanager
+    def time_stage(self, stage: str) -> Iterator[None]:
+        """Time a stage of the download pipeline, also usable as a decorator"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('spotify_sync_stage_seconds', time.perf_counter() - start, stage=stage)
+
+    def count_tracks(self, result: str, amount: int = 1):
+        if amount > 0:
+            self.increment('spotify_sync_tracks_total', amount, result=result)
+
+    def _flush_if_due(self):
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending_counters, self._pending_counters = self._pending_counters, {}
+            pending_histograms, self._pending_histograms = self._pending_histograms, {}
+            self._last_flush = time.monotonic()
+        if len(pending_counters) == 0 and len(pending_histograms) == 0:
+            return
+
+        try:
+            self._write(pending_counters, pending_histograms)
+        except (sqlite3.Error, OSError) as exception:
+            # Metrics must never fail a download (ie. the store is locked, or its directory isn't writable),
+            # so keep the samples for the next flush instead
+            logger.warning(f"Failed to flush metrics, retrying on the next flush: {exception}")
+            with self._lock:
+                for key, value in pending_counters.items():
+                    self._pending_counters[key] = self._pending_counters.get(key, 0) + value
+                for key, (bucket_counts, histogram_sum, count) in pending_histograms.items():
+                    histogram = self._pending_histograms.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+                    histogram[0] = [pending + failed for pending, failed in zip(histogram[0], bucket_counts)]
+                    histogram[1] += histogram_sum
+                    histogram[2] += count
+
+    def _write(self, pending_counters: dict[tuple[str, str], float], pending_histograms: dict[tuple[str, str], list]):
+        with self.transaction() as connection:
+            connection.executemany(
+                "INSERT INTO counter (name, labels, value) VALUES (?, ?, ?) ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value;",
+                [(name, labels, value) for (name, labels), value in pending_counters.items()],
+            )
+            connection.executemany(
+                "INSERT INTO histogram (name, labels, sum, count) VALUES (?, ?, ?, ?) ON CONFLICT (name, labels) DO UPDATE SET sum = sum + excluded.sum, count = count + excluded.count;",
+                [(name, labels, histogram_sum, count) for (name, labels), (_, histogram_sum, count) in pending_histograms.items()],
+            )
+            connection.executemany(
+                "INSERT INTO histogram_bucket (name, labels, le, count) VALUES (?, ?, ?, ?) ON CONFLICT (name, labels, le) DO UPDATE SET count = count + excluded.count;",
+                [
+                    (name, labels, upper_bound, bucket_count)
+                    for (name, labels), (bucket_counts, _, _) in pending_histograms.items()
+                    for upper_bound, bucket_count in zip(self.buckets, bucket_counts)
+                    if bucket_count > 0
+                ],
+            )
+
+    def render(self) -> str:
+        """Every recorded metric (including this process' unflushed samples) in the Prometheus text format"""
+        self.flush()
+        lines: list[str] = []
+        counters: dict[str, list[tuple[str, float]]] = {}
+        for name, labels, value in self.execute("SELECT name, labels, value FROM counter ORDER BY name, labels;"):
+            counters.setdefault(name, []).append((labels, value))
+        for name, samples in counters.items():
+            lines.extend(self._header(name))
+            lines.extend(self.format_sample(name, labels, value) for labels, value in samples)
+
+        bucket_counts: dict[tuple[str, str], list[tuple[float, int]]] = {}
+        for name, labels, upper_bound, count in self.execute("SELECT name, labels, le, count FROM histogram_bucket ORDER BY name, labels, le;"):
+            bucket_counts.setdefault((name, labels), []).append((upper_bound, count))
+        rendered_names: set[str] = set()
+        for name, labels, histogram_sum, count in self.execute("SELECT name, labels, sum, count FROM histogram ORDER BY name, labels;").fetchall():
+            if name not in rendered_names:
+                lines.extend(self._header(name))
+                rendered_names.add(name)
+            recorded_buckets = dict(bucket_counts.get((name, labels), []))
+            cumulative_count = 0
+            for upper_bound in self.buckets:
+                cumulative_count += recorded_buckets.get(upper_bound, 0)
+                bucket_labels = self.format_labels({'le': "+Inf" if math.isinf(upper_bound) else self.format_value(upper_bound)})
+                lines.append(self.format_sample(f"{name}_bucket", ",".join(filter(None, [labels, bucket_labels])), cumulative_count))
+            lines.append(self.format_sample(f"{name}_sum", labels, histogram_sum))
+            lines.append(self.format_sample(f"{name}_count", labels, count))
+        return "\n".join(lines) + "\n" if lines else ""
+
+    @staticmethod
+    def render_gauge(name: str, help_text: str, samples: dict[str, float]) -> str:
+        """Render a gauge that is computed when scraped (so never stored), `samples` are keyed by formatted labels"""
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        lines.extend(MetricsStore.format_sample(name, labels, value) for labels, value in samples.items())
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _header(name: str) -> list[str]:
+        metric_type, help_text = METRICS.get(name, ('untyped', name))
+        return [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+
+    @staticmethod
+    def format_sample(name: str, labels: str, value: float) -> str:
+        return f"{name}{{{labels}}} {MetricsStore.format_value(value)}" if labels else f"{name} {MetricsStore.format_value(value)}"
+
+    @staticmethod
+    def format_value(value: float) -> str:
+        return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+@cache
+def default_metrics() -> MetricsStore:
+    """The store configured in settings, created the first time a sample is recorded rather than on import
+
+    The huey worker flushes it after each task and on shutdown, see `library_manager.tasks`.
+    """
+    return MetricsStore.from_settings()
+
+@contextmanager
+def time_stage(stage: str) -> Iterator[None]:
+    """`MetricsStore.time_stage` on the default store, which (as a decorator) is only created once the function is called"""
+    with default_metrics().time_stage(stage):
+        yield
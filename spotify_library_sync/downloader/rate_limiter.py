@@ -0,0 +1,115 @@
+import time
+from functools import cache
+from typing import Callable
+
+from django.conf import settings
+
+from lib.sqlite_store import SqliteStore
+
+# Fallback budgets for upstreams not configured in `rate_limits`
+DEFAULT_RATE_LIMITS = {
+    'spotify': {'capacity': 60, 'per_hour': 18000},
+    'audio_search': {'capacity': 20, 'per_hour': 1800},
+    # One token per downloaded URL (album, playlist or track), the same 250 per 12 hours the download history used to be capped at
+    'audio_download': {'capacity': 250, 'per_hour': 250 / 12},
+}
+
+class RateLimited(Exception):
+    """Raised instead of waiting for tokens, so the caller can hand its worker back and retry once the budget has refilled"""
+
+    def __init__(self, upstream: str, wait: float):
+        super().__init__(f"Waiting {round(wait)}s for the {upstream} rate limit")
+        self.upstream = upstream
+        self.wait = wait
+
+class RateLimiter(SqliteStore):
+    """Token buckets (one per upstream) whose state is shared by every web and huey worker process
+
+    A bucket holds up to `capacity` tokens and refills continuously at `per_hour` tokens an hour.
+    Upstreams without a budget, or with a `per_hour` of 0, are never limited.
+    Nothing here sleeps: callers that run out of tokens are told how long to wait, so they can reschedule instead.
+    """
+    schema = [
+        """CREATE TABLE IF NOT EXISTS bucket (
+            name TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );""",
+    ]
+
+    def __init__(self, path: str, budgets: dict[str, dict] | None = None, clock: Callable[[], float] = time.time):
+        super().__init__(path)
+        self.budgets = {**DEFAULT_RATE_LIMITS, **(budgets or {})}
+        self.clock = clock
+
+    @classmethod
+    def from_settings(cls) -> "RateLimiter":
+        return cls(
+            settings.rate_limiter_location,
+            budgets={upstream: dict(budget) for upstream, budget in settings.get('rate_limits', {}).items()},
+        )
+
+    def is_limited(self, upstream: str) -> bool:
+        budget = self.budgets.get(upstream)
+        return budget is not None and budget.get('per_hour', 0) > 0
+
+    def try_acquire(self, upstream: str, tokens: int = 1) -> float:
+        """Take `tokens` from the upstream's bucket, but only if they are all available
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise the number of seconds until they will be available
+        """
+        if not self.is_limited(upstream):
+            return 0
+
+        capacity, refill_rate = self._budget(upstream)
+        # A request larger than the bucket could never be satisfied, so it just has to wait for a full one
+        tokens = min(tokens, capacity)
+        now = self.clock()
+        with self.transaction() as connection:
+            available = self._available_tokens(connection, upstream, capacity, refill_rate, now)
+            wait = 0 if available >= tokens else (tokens - available) / refill_rate
+            if wait == 0:
+                available -= tokens
+            connection.execute(
+                "INSERT OR REPLACE INTO bucket (name, tokens, updated_at) VALUES (?, ?, ?);",
+                (upstream, available, now),
+            )
+        return wait
+
+    def take(self, upstream: str, tokens: int = 1):
+        """Take `tokens` from the upstream's bucket
+
+        Raises:
+            RateLimited: If they aren't all available, with the number of seconds until they will be
+        """
+        wait = self.try_acquire(upstream, tokens)
+        if wait > 0:
+            raise RateLimited(upstream, wait)
+
+    def time_until_available(self, upstream: str, tokens: int = 1) -> float:
+        """Seconds until `tokens` could be taken from the upstream's bucket, without taking them"""
+        if not self.is_limited(upstream):
+            return 0
+
+        capacity, refill_rate = self._budget(upstream)
+        available = self._available_tokens(self.connection, upstream, capacity, refill_rate, self.clock())
+        return max(0, (min(tokens, capacity) - available) / refill_rate)
+
+    def _budget(self, upstream: str) -> tuple[float, float]:
+        budget = self.budgets[upstream]
+        refill_rate = budget['per_hour'] / 3600
+        return budget.get('capacity', budget['per_hour']), refill_rate
+
+    @staticmethod
+    def _available_tokens(connection, upstream: str, capacity: float, refill_rate: float, now: float) -> float:
+        row = connection.execute("SELECT tokens, updated_at FROM bucket WHERE name = ?;", (upstream,)).fetchone()
+        if row is None:
+            return capacity
+        tokens, updated_at = row
+        return min(capacity, tokens + max(0, now - updated_at) * refill_rate)
+
+@cache
+def default_rate_limiter() -> RateLimiter:
+    """The budgets configured in settings, created the first time one is drawn from rather than on import"""
+    return RateLimiter.from_settings()
@@ -1,12 +1,24 @@
 import asyncio
+import threading
+import time
 from pathlib import Path
-from typing import Optional, Union, Tuple
+from typing import List, Optional, Union, Tuple
 
 from spotdl._version import __version__
 from spotdl.download.downloader import Downloader
 from spotdl.types.options import DownloaderOptionalOptions, DownloaderOptions
 from spotdl.types.song import Song
+from spotdl.utils import ffmpeg
 from spotdl.utils.spotify import SpotifyClient
+from spotipy import Spotify
+
+from .metrics import default_metrics
+from .rate_limiter import default_rate_limiter
+
+# The originals wrapped by the timing monkeypatches below
+_search_and_download = Downloader.search_and_download
+# Conversion time spent within the current thread's `search_and_download`, so it isn't counted as download time too
+_conversion = threading.local()
 
 # Class SpotDl
 # Monkeypatch The Spotdl class to only init SpotifyClient if it doesn't already exist
@@ -79,3 +91,53 @@ def download_song(self, song: Song) -> Tuple[Song, Optional[Path]]:
     results = self.download_multiple_songs([song])
 
     return results[0]
+
+# Class Spotdl.download.downloader.Downloader
+# Monkeypatch to download a batch of songs through the worker pool (bounded by the `threads` setting),
+# with the same event loop handling as `download_song`
+def download_songs(self, songs: List[Song]) -> List[Tuple[Song, Optional[Path]]]:
+    """
+    Download multiple songs concurrently.
+
+    ### Arguments
+    - songs: The songs to download.
+
+    ### Returns
+    - list of tuples with the song and the path to the downloaded file if successful,
+      in the same order as `songs`.
+    """
+    try:
+        asyncio.get_event_loop()
+    except RuntimeError:
+        asyncio.set_event_loop(self.loop)
+
+    return self.download_multiple_songs(songs)
+
+# Class Spotdl.utils.spotify.SpotifyClient
+# Monkeypatch to draw every request that actually reaches Spotify (ie. isn't served from a cache) from the shared `spotify` budget,
+# raising `RateLimited` (rather than sleeping on whichever thread made the request) once it's used up
+def _internal_call(self, method, url, payload, params):
+    default_rate_limiter().take('spotify')
+    return Spotify._internal_call(self, method, url, payload, params)
+
+# Class Spotdl.download.downloader.Downloader
+# Monkeypatch to record the time each song spends downloading (from the matched URL to the tagged file, less any conversion)
+def search_and_download(self, song: Song) -> Tuple[Song, Optional[Path]]:
+    _conversion.seconds = 0
+    start = time.perf_counter()
+    try:
+        return _search_and_download(self, song)
+    finally:
+        default_metrics().observe('spotify_sync_stage_seconds', time.perf_counter() - start - _conversion.seconds, stage='download')
+
+# Module spotdl.download.downloader
+# Monkeypatch (the downloader's import of) `convert` to record the time ffmpeg spends converting each song,
+# spotdl skips it entirely when the downloaded file is already in the output format
+def convert(*args, **kwargs):
+    start = time.perf_counter()
+    try:
+        return ffmpeg.convert(*args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - start
+        _conversion.seconds = getattr(_conversion, 'seconds', 0) + elapsed
+        default_metrics().observe('spotify_sync_stage_seconds', elapsed, stage='conversion')
@@ -0,0 +1,47 @@
+from spotdl.types.song import Song as SpotdlSong, SongError
+
+def song_from_metadata(track: dict, album: dict, primary_artist: dict) -> SpotdlSong:
+    """Build a spotdl Song from metadata that was already fetched, mirroring `SpotdlSong.from_url`
+
+    Args:
+        track (dict): The full Spotify track object
+        album (dict): The full Spotify album object the track belongs to (including its track listing)
+        primary_artist (dict): The full Spotify artist object for the track's first artist
+
+    Raises:
+        SongError: If the track no longer exists on Spotify
+        KeyError: If any of the required metadata is missing
+
+    Returns:
+        SpotdlSong: the song, ready to be downloaded
+    """
+    url = track["external_urls"]["spotify"]
+    if track["duration_ms"] == 0 or track["name"].strip() == "":
+        raise SongError(f"Track no longer exists: {url}")
+
+    return SpotdlSong(
+        name=track["name"],
+        artists=[artist["name"] for artist in track["artists"]],
+        artist=track["artists"][0]["name"],
+        artist_id=track["artists"][0]["id"],
+        album_id=album["id"],
+        album_name=album["name"],
+        album_artist=album["artists"][0]["name"],
+        album_type=album.get("album_type"),
+        copyright_text=album["copyrights"][0]["text"] if album["copyrights"] else None,
+        genres=album["genres"] + primary_artist["genres"],
+        disc_number=track["disc_number"],
+        disc_count=int(album["tracks"]["items"][-1]["disc_number"]),
+        duration=int(track["duration_ms"] / 1000),
+        year=int(album["release_date"][:4]),
+        date=album["release_date"],
+        track_number=track["track_number"],
+        tracks_count=album["total_tracks"],
+        isrc=track["external_ids"].get("isrc"),
+        song_id=track["id"],
+        explicit=track["explicit"],
+        publisher=album["label"],
+        url=url,
+        popularity=track["popularity"],
+        cover_url=max(album["images"], key=lambda image: image["width"] * image["height"])["url"] if album["images"] else None,
+    )
@@ -10,22 +10,30 @@ from __future__ import annotations, division
 
 import asyncio
 from argparse import Namespace
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 import logging
 import pathlib
 import traceback
-from pymediainfo import MediaInfo
+from typing import Iterator
 
 from . import __version__
 from . import utils
+from .audio_probe import AudioProber
 from .downloader import Downloader
+from .metrics import default_metrics, time_stage
+from .rate_limiter import RateLimited, default_rate_limiter
+from .spotify_cache import SpotifyResponseCache
 from .default_download_settings import DEFAULT_DOWNLOAD_SETTINGS
 from . import spotdl_override
 from lib.config_class import Config
-from library_manager.models import Album, Artist, ContributingArtist, DownloadHistory, Song, TrackedPlaylist
+from library_manager import stats as library_stats
+from library_manager.models import Album, DownloadHistory, Song, TrackedPlaylist
 
 from django.db.models.functions import Now
 
 from spotdl import Spotdl
+from spotdl.download import downloader as spotdl_downloader_module
 from spotdl.download.downloader import Downloader as SpotdlDownloader
 from spotdl.types.song import Song as SpotdlSong
 from spotdl.utils.config import create_settings
@@ -41,6 +49,10 @@ class SpotdlDownloadError(Exception):
 # See spotdl_override module for more information
 Spotdl.__init__ = spotdl_override.__init__
 SpotdlDownloader.download_song = spotdl_override.download_song
+SpotdlDownloader.download_songs = spotdl_override.download_songs
+SpotdlDownloader.search_and_download = spotdl_override.search_and_download
+spotdl_downloader_module.convert = spotdl_override.convert
+SpotifyClient._internal_call = spotdl_override._internal_call
 
 def update_process_info(config: Config, progress: int):
     if config.process_info is None:
@@ -85,25 +97,180 @@ def initiate_logger(log_level: str):
     return logger
 
 class SpotdlWrapper:
-    def __init__(self, config: Config):
+    def __init__(
+        self,
+        config: Config,
+        spotdl: Spotdl | None = None,
+        spotipy_client: SpotifyClient | None = None,
+        response_cache: SpotifyResponseCache | None = None,
+    ):
         self.logger = initiate_logger(config.log_level)
         self.logger.info(f"SpotdlWrapper Version: {__version__}")
 
-        spotdl_settings = generate_spotdl_settings(config)
-
-        self.spotdl = Spotdl(**spotdl_settings)
+        # spotdl and the Spotify client can be swapped out (ie. for the fakes in `downloader.fakes` when benchmarking)
+        self.spotdl = spotdl if spotdl is not None else Spotdl(**generate_spotdl_settings(config))
 
-        self.spotipy_client = SpotifyClient()
+        self.spotipy_client = spotipy_client if spotipy_client is not None else SpotifyClient()
         
-        self.downloader = Downloader(self.spotipy_client)
+        self.downloader = Downloader(self.spotipy_client, response_cache=response_cache)
+        self.audio_prober = AudioProber()
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=max(1, config.download_lookahead), thread_name_prefix="prefetch")
         self.logger.debug("Completed SpotdlWrapper Initialization")
 
+    def skip_downloaded_tracks(self, tracks: list[dict], db_songs: dict[str, Song]) -> list[dict]:
+        downloaded_file_paths = utils.existing_file_paths(
+            db_song.file_path for db_song in db_songs.values() if db_song.downloaded and db_song.file_path
+        )
+
+        remaining_tracks: list[dict] = []
+        for track in tracks:
+            db_song = db_songs.get(utils.uri_to_gid(track['id'])) if track is not None and track.get('id') is not None else None
+            if db_song is not None and db_song.downloaded and db_song.file_path in downloaded_file_paths:
+                continue
+            remaining_tracks.append(track)
+
+        default_metrics().count_tracks('skipped', len(tracks) - len(remaining_tracks))
+        if len(remaining_tracks) < len(tracks):
+            self.logger.info(f"Skipping {len(tracks) - len(remaining_tracks)} track(s) that are already downloaded")
+        return remaining_tracks
+
+    def prepare_spotdl_song(self, track: dict, spotdl_song: SpotdlSong | None) -> SpotdlSong:
+        """Resolve the spotdl song for a track and match it with the audio providers, so spotdl can go straight to downloading it"""
+        if spotdl_song is None:
+            with time_stage('queue_resolution'):
+                spotdl_song = SpotdlSong.from_url(track['external_urls']['spotify'])
+        if spotdl_song.download_url is None:
+            default_rate_limiter().take('audio_search')
+            try:
+                with time_stage('provider_search'):
+                    spotdl_song.download_url = self.spotdl.downloader.search(spotdl_song)
+            except LookupError as exception:
+                # Matches how spotdl itself reports a song it couldn't find
+                raise SpotdlDownloadError(f"Failed to find a match: {exception}") from exception
+        return spotdl_song
+
+    def prefetch_spotdl_songs(
+        self,
+        downloadable_tracks: list[tuple[str, dict, Song]],
+        spotdl_songs: dict[str, SpotdlSong],
+        lookahead: int,
+    ) -> Iterator[tuple[str, dict, Song, Future]]:
+        """Yield each track with a future for its prepared spotdl song, keeping up to `lookahead` tracks ahead of the consumer in flight
+
+        The Spotify and search budgets are checked before submitting each track, so the prefetch threads are never left
+        waiting on them. Once either is used up, the tracks already in flight are yielded, followed by one whose future
+        raises `RateLimited`, and no more tracks are prepared.
+        """
+        in_flight: deque[tuple[str, dict, Song, Future]] = deque()
+        for current_track, track, db_song in downloadable_tracks:
+            wait, upstream = max((default_rate_limiter().time_until_available(upstream), upstream) for upstream in ('spotify', 'audio_search'))
+            if wait > 0:
+                rate_limited: Future = Future()
+                rate_limited.set_exception(RateLimited(upstream, wait))
+                in_flight.append((current_track, track, db_song, rate_limited))
+                break
+            in_flight.append((current_track, track, db_song, self.prefetch_executor.submit(self.prepare_spotdl_song, track, spotdl_songs.get(track['id']))))
+            if len(in_flight) > lookahead:
+                yield in_flight.popleft()
+        while in_flight:
+            yield in_flight.popleft()
+
+    def download_prepared_songs(self, config: Config, pending_downloads: list[tuple[str, Song, SpotdlSong]], pending_probes: list[tuple[str, Song, str, Future]]) -> int:
+        error_count = 0
+        try:
+            if len(pending_downloads) == 1:
+                download_results = [self.spotdl.download(pending_downloads[0][2])]
+            else:
+                # Results are returned in the same order as the songs were supplied
+                download_results = self.spotdl.downloader.download_songs([spotdl_song for _, _, spotdl_song in pending_downloads])
+        except Exception as exception:
+            download_results = [exception] * len(pending_downloads)
+
+        for (current_track, db_song, _), download_result in zip(pending_downloads, download_results):
+            try:
+                if isinstance(download_result, Exception):
+                    raise download_result
+                song_success, output_path = download_result
+                pending_probes.append((current_track, db_song, str(output_path), self.record_download_result(song_success, output_path, db_song)))
+            except Exception as exception:
+                error_count += 1
+                self.handle_download_exception(config, current_track, db_song, exception)
+        return error_count
+
+    def record_download_result(self, song_success: SpotdlSong | None, output_path: pathlib.Path | None, db_song: Song) -> Future:
+        if (song_success is None or output_path is None):
+            self.logger.debug(song_success)
+            self.logger.debug(f"output_path: {output_path}")
+            raise SpotdlDownloadError("Failed to download correctly")
+
+        # Probing reads the whole file, so hand it off and let the next download start straight away
+        return self.audio_prober.submit(output_path, song_gid=db_song.gid)
+
+    def record_probe_result(self, config: Config, db_song: Song, output_path: str, bit_rate: float):
+        # Validate the song is in the correct audio bitrate
+        # Validate premium successfully applied, for example
+        expected_bitrate = 255 if config.cookies_location is not None and config.po_token is not None else 127
+
+        if (bit_rate > 0):
+            db_song.bitrate = bit_rate
+            db_song.file_path = output_path
+            db_song.downloaded = True
+            db_song.save()
+        if (bit_rate < expected_bitrate):
+            # pathlib.Path.unlink(output_path)
+            if bit_rate == 0:
+                raise BitrateException(f"File was downloaded successfully, but no audio track existed | output_path: {output_path}")
+            default_metrics().count_tracks('bitrate_below_expected')
+            self.logger.error(f"File was downloaded successfully but not in the correct bitrate ({bit_rate} found, but {expected_bitrate} is minimum expected) | output_path: {output_path}")
+        else:
+            default_metrics().count_tracks('ok')
+
+    def record_finished_probes(self, config: Config, pending_probes: list[tuple[str, Song, str, Future]], wait: bool = False) -> int:
+        finished_probes = [pending_probe for pending_probe in pending_probes if wait or pending_probe[3].done()]
+        for finished_probe in finished_probes:
+            pending_probes.remove(finished_probe)
+        if len(finished_probes) == 0:
+            return 0
+
+        # Cache every finished probe's result in one go, from this thread rather than the probe threads
+        self.audio_prober.save([
+            (output_path, db_song.gid, probe.result())
+            for _, db_song, output_path, probe in finished_probes
+            if probe.exception() is None
+        ])
+
+        error_count = 0
+        for current_track, db_song, output_path, probe in finished_probes:
+            try:
+                self.record_probe_result(config, db_song, output_path, probe.result())
+            except Exception as exception:
+                error_count += 1
+                self.handle_download_exception(config, current_track, db_song, exception)
+        return error_count
+
+    def handle_download_exception(self, config: Config, current_track: str, db_song: Song, exception: Exception):
+        default_metrics().count_tracks('failed')
+        self.logger.error(f'({current_track}) Failed to download "{db_song.name}"')
+        if isinstance(exception, SpotdlDownloadError):
+            self.logger.error(f"Exception: {exception}")
+            self.logger.error("This track is possibly not available in your region")
+            # Don't infinitely retry missing songs
+            db_song.increment_failed_count()
+            return
+
+        self.logger.error(f"General Exception: {exception}")
+        db_song.failed_count += 1
+        db_song.save()
+        if (config.print_exceptions):
+            self.logger.error("".join(traceback.format_exception(exception)))
+
     def execute(
         self,
         config: Config
     ) -> int:
         download_queue = []
         download_queue_urls: list[str] = []
+        playlist_snapshot_ids: dict[str, str] = {}
         error_count = 0
 
         if config.artist_to_fetch is not None:
@@ -111,12 +278,37 @@ class SpotdlWrapper:
             albums = self.downloader.get_artist_albums(config.artist_to_fetch)
             self.logger.info(f"Fetched latest {len(albums)} album(s) for this artist")
             return
+
+        # Albums and tracks are resolved 20 and 50 at a time, rather than with a request (or more) each
+        try:
+            resolved_download_queues = self.downloader.get_download_queues(config.urls)
+        except RateLimited:
+            raise
+        except Exception as exception:
+            self.logger.warning(f"Failed to resolve URLs in batches, falling back to resolving each one: {exception}")
+            resolved_download_queues = {}
+
         for url_index, url in enumerate(config.urls, start=1):
             current_url = f"URL {url_index}/{len(config.urls)}"
             try:
                 self.logger.info(f'({current_url}) Checking "{url}"')
-                download_queue.append(self.downloader.get_download_queue(url=url))
+                playlist_changed = False
+                tracked_playlist = TrackedPlaylist.objects.filter(url=url).first()
+                if tracked_playlist is not None:
+                    snapshot_id = self.downloader.get_playlist_snapshot_id(url)
+                    if not config.force_playlist_resync and tracked_playlist.last_synced_at is not None and tracked_playlist.snapshot_id == snapshot_id:
+                        self.logger.info(f'({current_url}) Playlist is unchanged since it last synced at {tracked_playlist.last_synced_at}, skipping')
+                        continue
+                    playlist_snapshot_ids[url] = snapshot_id
+                    playlist_changed = True
+                if url in resolved_download_queues:
+                    download_queue.append(resolved_download_queues[url])
+                else:
+                    # A changed playlist must not be served from the response cache
+                    download_queue.append(self.downloader.get_download_queue(url=url, force_refresh=config.force_playlist_resync or playlist_changed))
                 download_queue_urls.append(url)
+            except RateLimited:
+                raise
             except Exception as exception:
                 error_count += 1
                 self.logger.error(f'({current_url}) Failed to check "{url}"')
@@ -137,159 +329,142 @@ class SpotdlWrapper:
 
         for queue_item_index, queue_item in enumerate(download_queue, start=1):
             download_queue_url = download_queue_urls[queue_item_index - 1]
-            download_queue_item = DownloadHistory.objects.get_or_create(
-                url=download_queue_url,
-                completed_at=None,
-                defaults={
-                    'url': download_queue_url,
-                }
-            )[0]
+            download_queue_item = DownloadHistory.objects.filter(url=download_queue_url, completed_at=None).first()
+            if download_queue_item is None:
+                # Each download history entry costs one token, so resuming an unfinished one (ie. after being rate limited) is free
+                default_rate_limiter().take('audio_download')
+                download_queue_item = DownloadHistory.objects.create(url=download_queue_url)
 
             try:
                 tracked_playlist = TrackedPlaylist.objects.get(url=download_queue_url)
-                
-                if config.force_playlist_resync:
-                    tracked_playlist.last_synced_at = None
-                    tracked_playlist.save()
-                # Check if this playlist has ever been synced
-                if tracked_playlist.last_synced_at is not None:
-                    playlist_needs_update = False
-                    for track_index, track in enumerate(queue_item, start=1):
-                        track_added_at = utils.convert_date_string_to_datetime(track['added_at'])
-                        if track_added_at > tracked_playlist.last_synced_at:
-                            playlist_needs_update = True
-                    if not playlist_needs_update:
-                        self.logger.info(f"Playlist has no newer tracks than the last time it synced at {tracked_playlist.last_synced_at}, skipping")
-                        continue
-                    else:
-                        self.logger.info(f"Playlist has newer tracks than the last time it synced at {tracked_playlist.last_synced_at}, resyncing")
             except TrackedPlaylist.DoesNotExist:
                 tracked_playlist = None
 
             main_queue_progress = ((queue_item_index - 1) / len(download_queue)) * 1000
 
-            for track_index, track in enumerate(queue_item, start=1):
+            tracks_to_persist: list[dict] = queue_item
+            tracks_to_download: list[dict] = queue_item
+            if tracked_playlist is not None:
+                if config.force_playlist_resync:
+                    tracked_playlist.last_synced_at = None
+                    tracked_playlist.save()
 
-                # Check if this is a tracked playlist, and if so let's only sync if the track is newer than the last sync
-                if tracked_playlist is not None and tracked_playlist.last_synced_at is not None:
-                    track_added_at = utils.convert_date_string_to_datetime(track['added_at'])
-                    if track_added_at < tracked_playlist.last_synced_at:
-                        self.logger.debug('track older than last playlist sync, skipping')
-                        continue
+                # Diff against the stored playlist membership, so only added tracks need to be persisted and downloaded
+                has_recorded_membership = tracked_playlist.tracks.exists()
+                added_tracks, removed_playlist_track_ids = self.downloader.diff_playlist_tracks(tracked_playlist, queue_item)
+                self.logger.info(f"Playlist has {len(added_tracks)} added and {len(removed_playlist_track_ids)} removed track(s) since it last synced at {tracked_playlist.last_synced_at}")
 
-                current_track = f"Track {track_index}/{len(queue_item)} from URL {queue_item_index}/{len(download_queue)}"
-                download_queue_item.progress = round(track_index / len(queue_item) * 1000, 1)
-                download_queue_item.save()
+                # Playlists that have never been synced (or are forced to resync) download everything
+                if tracked_playlist.last_synced_at is not None:
+                    tracks_to_persist = added_tracks
+                    tracks_to_download = added_tracks
+                    if not has_recorded_membership:
+                        # Playlists synced before membership was recorded have all their tracks "added",
+                        # but only the ones newer than the last sync still need downloading
+                        tracks_to_download = [
+                            track for track in added_tracks
+                            if utils.convert_date_string_to_datetime(track['added_at']) >= tracked_playlist.last_synced_at
+                        ]
+
+            # Persist every artist, song and contributing artist for this queue item up front in a handful of bulk statements
+            db_songs = self.downloader.upsert_tracks(tracks_to_persist, track_artists=config.track_artists)
+
+            # Drop tracks that are already downloaded (and still on disk) before doing any network work for them
+            if DEFAULT_DOWNLOAD_SETTINGS["overwrite"] == "skip":
+                tracks_to_download = self.skip_downloaded_tracks(tracks_to_download, db_songs)
+
+            # Build the spotdl songs from the metadata we already have, rather than re-fetching each track, album and artist
+            try:
+                spotdl_songs = self.downloader.get_spotdl_songs(tracks_to_download)
+            except RateLimited:
+                raise
+            except Exception as exception:
+                self.logger.warning(f"Failed to build songs from the fetched metadata, falling back to fetching each track: {exception}")
+                spotdl_songs = {}
 
-                update_process_info(config, main_queue_progress + round(track_index / len(queue_item), 3) * one_queue_increment)
-                try:
-                    self.logger.info(f'({current_track}) Downloading "{track["name"]}"')
-                    primary_artist = track['artists'][0]
-                    other_artists = track['artists'][1:]
-                    song = self.downloader.get_song_core_info(track)
-
-                    primary_artist_gid = utils.uri_to_gid(primary_artist['id'])
-                    primary_artist_defaults = {
-                        'name': primary_artist['name'],
-                        'gid': primary_artist_gid,
-                    }
-                    if config.track_artists:
-                        primary_artist_defaults['tracked'] = True
-                    
-                    db_artist = Artist.objects.update_or_create(
-                        gid=primary_artist_gid,
-                        defaults=primary_artist_defaults
-                    )[0]
-
-                    db_extra_artists = [db_artist]
-                    
-                    for artist in other_artists:
-                        artist_gid = utils.uri_to_gid(artist['id'])
-                        db_extra_artists.append(Artist.objects.update_or_create(
-                            gid=artist_gid,
-                            defaults={
-                                'name': artist['name'],
-                                'gid': artist_gid,
-                            })[0])
-
-                    db_song = Song.objects.update_or_create(
-                        gid=song['song_gid'],
-                        defaults={
-                            'primary_artist': db_artist,
-                            'name': song['song_name'],
-                            'gid': song['song_gid'],
-                        })[0]
-
-                    for artist in db_extra_artists:
-                        ContributingArtist.objects.get_or_create(artist=artist, song=db_song)
-
-                    song_success, output_path = self.spotdl.download(SpotdlSong.from_url(track['external_urls']['spotify']))
-                    if (song_success is None or output_path is None):
-                        self.logger.debug(song_success)
-                        self.logger.debug(f"output_path: {output_path}")
-                        raise SpotdlDownloadError("Failed to download correctly")
-                    
-                    # Validate the song is in the correct audio bitrate
-                    # Validate premium successfully applied, for example
-                    expected_bitrate = 255 if config.cookies_location is not None and config.po_token is not None else 127
-
-                    media_info = MediaInfo.parse(output_path)
-                    for track in media_info.tracks:
-                        if track.track_type == "Audio":
-                            audio_track = track
-                            bit_rate = audio_track.bit_rate / 1000
-                            break
-                    
-                    if (audio_track is not None and bit_rate > 0):
-                        db_song.bitrate = bit_rate
-                        db_song.file_path = output_path
-                        db_song.downloaded = True
-                        db_song.save()
-                    if (audio_track is None or bit_rate < expected_bitrate):
-                        # pathlib.Path.unlink(output_path)
-                        if audio_track is None:
-                            raise BitrateException(f"File was downloaded successfully, but no audio track existed | output_path: {output_path}")
-                        self.logger.error(f"File was downloaded successfully but not in the correct bitrate ({bit_rate} found, but {expected_bitrate} is minimum expected) | output_path: {output_path}")
-                except SpotdlDownloadError as exception:
-                    error_count += 1
-                    self.logger.error(f'({current_track}) Failed to download "{db_song.name}"')
-                    self.logger.error(f"Exception: {exception}")
-                    self.logger.error("This track is possibly not available in your region")
-                    # Don't infinitely retry missing songs
-                    db_song.increment_failed_count()
-                except Exception as exception:
+            downloadable_tracks: list[tuple[str, dict, Song]] = []
+            for track_index, track in enumerate(tracks_to_download, start=1):
+                current_track = f"Track {track_index}/{len(tracks_to_download)} from URL {queue_item_index}/{len(download_queue)}"
+
+                db_song = db_songs.get(self.downloader.get_song_core_info(track)['song_gid']) if track.get('id') is not None else None
+                if db_song is None:
                     error_count += 1
-                    self.logger.error(f'({current_track}) Failed to download "{db_song.name}"')
-                    self.logger.error(f"General Exception: {exception}")
-                    db_song.failed_count += 1
-                    db_song.save()
-                    if (config.print_exceptions):
-                        self.logger.error(traceback.format_exc())
-                finally:
+                    default_metrics().count_tracks('failed')
+                    self.logger.error(f'({current_track}) Skipping "{track.get("name")}" since it cannot be linked to a Spotify song and artist')
+                    continue
+                downloadable_tracks.append((current_track, track, db_song))
+
+            # Hand spotdl a bounded window of tracks at a time so its `threads` worker pool is actually used,
+            # while the upcoming tracks are resolved and matched in the background
+            download_window = max(1, DEFAULT_DOWNLOAD_SETTINGS["threads"]) if config.concurrent_downloads else 1
+            prefetched_tracks = self.prefetch_spotdl_songs(downloadable_tracks, spotdl_songs, max(0, config.download_lookahead))
+            downloads_started = 0
+            pending_probes: list[tuple[str, Song, str, Future]] = []
+
+            try:
+                for track_window in utils.chunked(prefetched_tracks, download_window):
+                    downloads_started += len(track_window)
+                    with time_stage('progress_write'):
+                        download_queue_item.progress = round(downloads_started / len(downloadable_tracks) * 1000, 1)
+                        download_queue_item.save()
+
+                        update_process_info(config, main_queue_progress + round(downloads_started / len(downloadable_tracks), 3) * one_queue_increment)
+
+                    pending_downloads: list[tuple[str, Song, SpotdlSong]] = []
+                    rate_limited: RateLimited | None = None
+                    for current_track, track, db_song, prepared_song in track_window:
+                        try:
+                            self.logger.info(f'({current_track}) Downloading "{track["name"]}"')
+                            pending_downloads.append((current_track, db_song, prepared_song.result()))
+                        except RateLimited as exception:
+                            rate_limited = exception
+                        except Exception as exception:
+                            error_count += 1
+                            self.handle_download_exception(config, current_track, db_song, exception)
+
+                    if len(pending_downloads) > 0:
+                        error_count += self.download_prepared_songs(config, pending_downloads, pending_probes)
+                    error_count += self.record_finished_probes(config, pending_probes)
+
                     # Clear any errors from the persisted object, otherwise it will continue printing old failures
                     if len(self.spotdl.downloader.errors) > 0:
                         self.spotdl.downloader.errors.clear()
 
-                if track_index == len(queue_item):
-                    download_queue_item.completed_at = Now()
-                    download_queue_item.save()
+                    if rate_limited is not None:
+                        # Only stop once the songs prepared before the budget ran out are downloaded
+                        raise rate_limited
+            finally:
+                # Running out of budget stops the queue item part way through, the tracks downloaded until then are still recorded
+                error_count += self.record_finished_probes(config, pending_probes, wait=True)
 
-                    if download_queue_url.startswith('spotify:album:'):
-                        try:
-                            album = Album.objects.get(spotify_uri=download_queue_url)
-                        except Album.DoesNotExist:
-                            # album = self.downloader.create_album(download_queue_url, artist)
-                            pass
-                        if (album is not None):
-                            album.downloaded = True
-                            album.save()
-                        else:
-                            self.logger.warning("Spotify album downloaded but was not expected and could not be created")
-
-                    if tracked_playlist is not None:
-                        tracked_playlist.last_synced_at = Now()
-                        tracked_playlist.save()
+            if tracked_playlist is not None:
+                # Recorded once the tracks are downloaded, so a sync that's cut short (ie. rate limited) retries the same added tracks
+                self.downloader.update_playlist_tracks(tracked_playlist, added_tracks, removed_playlist_track_ids, db_songs)
 
+            with time_stage('progress_write'):
+                download_queue_item.completed_at = Now()
+                download_queue_item.save()
+
+            if download_queue_url.startswith('spotify:album:'):
+                try:
+                    album = Album.objects.get(spotify_uri=download_queue_url)
+                except Album.DoesNotExist:
+                    # album = self.downloader.create_album(download_queue_url, artist)
+                    album = None
+                if (album is not None):
+                    album.downloaded = True
+                    album.save()
+                else:
+                    self.logger.warning("Spotify album downloaded but was not expected and could not be created")
+
+            if tracked_playlist is not None:
+                tracked_playlist.last_synced_at = Now()
+                tracked_playlist.snapshot_id = playlist_snapshot_ids.get(download_queue_url, tracked_playlist.snapshot_id)
+                tracked_playlist.save()
+
+        library_stats.refresh_library_stats()
         update_process_info(config, 1000)
+        # Make this job's samples visible at /metrics now, rather than after the next flush interval
+        default_metrics().flush()
         self.logger.info(f"Done ({error_count} error(s))")
         return error_count
@@ -0,0 +1,169 @@
+import json
+import threading
+import time
+from collections import Counter
+from functools import cache
+from typing import Callable
+
+from django.conf import settings
+
+from lib.sqlite_store import SqliteStore
+
+# Fallback TTLs (in seconds) for resource types not configured in `spotify_cache_ttls`
+DEFAULT_CACHE_TTLS = {
+    # Album track listings effectively never change once released
+    'album': 30 * 24 * 60 * 60,
+    'track': 7 * 24 * 60 * 60,
+    'artist': 7 * 24 * 60 * 60,
+    'playlist': 15 * 60,
+    'artist_albums': 6 * 60 * 60,
+}
+
+class SpotifyResponseCache(SqliteStore):
+    """Disk-backed cache of Spotify Web API responses with a per resource type TTL and LRU size eviction
+
+    Reads don't write: the last access times (used for LRU eviction) and hit/miss counters are kept in memory and
+    written in one transaction at most every `access_flush_interval` seconds (and before evicting or reporting stats),
+    so readers never wait on the write lock. LRU order is therefore only as recent as the last flush.
+    """
+    schema = [
+        """CREATE TABLE IF NOT EXISTS response (
+            key TEXT PRIMARY KEY,
+            resource_type TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            last_accessed_at REAL NOT NULL
+        );""",
+        "CREATE INDEX IF NOT EXISTS response_last_accessed_at ON response (last_accessed_at);",
+        """CREATE TABLE IF NOT EXISTS counter (
+            resource_type TEXT NOT NULL,
+            name TEXT NOT NULL,
+            value INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (resource_type, name)
+        );""",
+    ]
+    # Only check the size limit every so often, since counting the entries is a full scan
+    EVICTION_CHECK_INTERVAL = 100
+    INCREMENT_COUNTER_SQL = "INSERT INTO counter (resource_type, name, value) VALUES (?, ?, ?) ON CONFLICT (resource_type, name) DO UPDATE SET value = value + excluded.value;"
+
+    def __init__(self, path: str, ttls: dict[str, int] | None = None, max_entries: int = 100000, access_flush_interval: float = 30):
+        super().__init__(path)
+        self.ttls = {**DEFAULT_CACHE_TTLS, **(ttls or {})}
+        self.max_entries = max_entries
+        self.access_flush_interval = access_flush_interval
+        self._writes_since_eviction = 0
+        self._lock = threading.Lock()
+        self._pending_accesses: dict[str, float] = {}
+        self._pending_counters: Counter[tuple[str, str]] = Counter()
+        self._last_access_flush = time.monotonic()
+
+    @classmethod
+    def from_settings(cls) -> "SpotifyResponseCache":
+        return cls(
+            settings.spotify_cache_location,
+            ttls=dict(settings.get('spotify_cache_ttls', {})),
+            max_entries=settings.get('spotify_cache_max_entries', 100000),
+            access_flush_interval=settings.get('spotify_cache_access_flush_interval', 30),
+        )
+
+    def is_enabled(self, resource_type: str) -> bool:
+        return self.ttls.get(resource_type, 0) > 0
+
+    def get(self, resource_type: str, resource_id: str) -> dict | None:
+        if not self.is_enabled(resource_type):
+            return None
+
+        now = time.time()
+        row = self.execute(
+            "SELECT payload FROM response WHERE key = ? AND expires_at > ?;",
+            (self._key(resource_type, resource_id), now),
+        ).fetchone()
+        with self._lock:
+            if row is not None:
+                self._pending_accesses[self._key(resource_type, resource_id)] = now
+            self._pending_counters[(resource_type, 'hits' if row is not None else 'misses')] += 1
+        if time.monotonic() - self._last_access_flush >= self.access_flush_interval:
+            self.flush_accesses()
+        return json.loads(row[0]) if row is not None else None
+
+    def set(self, resource_type: str, resource_id: str, payload: dict):
+        if not self.is_enabled(resource_type):
+            return
+
+        now = time.time()
+        self.execute(
+            "INSERT OR REPLACE INTO response (key, resource_type, payload, expires_at, last_accessed_at) VALUES (?, ?, ?, ?, ?);",
+            (self._key(resource_type, resource_id), resource_type, json.dumps(payload), now + self.ttls[resource_type], now),
+        )
+
+        self._writes_since_eviction += 1
+        if self._writes_since_eviction >= self.EVICTION_CHECK_INTERVAL:
+            self.evict()
+
+    def get_or_fetch(self, resource_type: str, resource_id: str, fetch: Callable[[], dict], force_refresh: bool = False) -> dict:
+        if not force_refresh:
+            payload = self.get(resource_type, resource_id)
+            if payload is not None:
+                return payload
+
+        payload = fetch()
+        self.set(resource_type, resource_id, payload)
+        return payload
+
+    def invalidate(self, resource_type: str, resource_id: str):
+        self.execute("DELETE FROM response WHERE key = ?;", (self._key(resource_type, resource_id),))
+
+    def flush_accesses(self):
+        """Write the buffered last access times and hit/miss counters"""
+        with self._lock:
+            pending_accesses, self._pending_accesses = self._pending_accesses, {}
+            pending_counters, self._pending_counters = self._pending_counters, Counter()
+            self._last_access_flush = time.monotonic()
+        if len(pending_accesses) == 0 and len(pending_counters) == 0:
+            return
+
+        with self.transaction() as connection:
+            connection.executemany(
+                "UPDATE response SET last_accessed_at = MAX(last_accessed_at, ?) WHERE key = ?;",
+                [(accessed_at, key) for key, accessed_at in pending_accesses.items()],
+            )
+            connection.executemany(
+                self.INCREMENT_COUNTER_SQL,
+                [(resource_type, name, amount) for (resource_type, name), amount in pending_counters.items()],
+            )
+
+    def evict(self) -> int:
+        """Drop expired entries, then the least recently used ones until the cache fits in `max_entries`"""
+        self._writes_since_eviction = 0
+        self.flush_accesses()
+        with self.transaction() as connection:
+            evicted = connection.execute("DELETE FROM response WHERE expires_at <= ?;", (time.time(),)).rowcount
+            excess = connection.execute("SELECT COUNT(*) FROM response;").fetchone()[0] - self.max_entries
+            if excess > 0:
+                evicted += connection.execute(
+                    "DELETE FROM response WHERE key IN (SELECT key FROM response ORDER BY last_accessed_at LIMIT ?);",
+                    (excess,),
+                ).rowcount
+        if evicted > 0:
+            self._increment('all', 'evictions', evicted)
+        return evicted
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        self.flush_accesses()
+        stats: dict[str, dict[str, int]] = {}
+        for resource_type, name, value in self.execute("SELECT resource_type, name, value FROM counter ORDER BY resource_type, name;"):
+            stats.setdefault(resource_type, {})[name] = value
+        stats.setdefault('all', {})['entries'] = self.execute("SELECT COUNT(*) FROM response;").fetchone()[0]
+        return stats
+
+    def _increment(self, resource_type: str, name: str, amount: int = 1):
+        self.execute(self.INCREMENT_COUNTER_SQL, (resource_type, name, amount))
+
+    @staticmethod
+    def _key(resource_type: str, resource_id: str) -> str:
+        return f"{resource_type}:{resource_id}"
+
+@cache
+def default_response_cache() -> SpotifyResponseCache:
+    """The cache configured in settings, created the first time a Spotify response is looked up rather than on import"""
+    return SpotifyResponseCache.from_settings()
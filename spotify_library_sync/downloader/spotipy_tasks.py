@@ -9,6 +9,7 @@ from .downloader import Downloader
 from .spotdl_wrapper import generate_spotdl_settings
 from lib.config_class import Config
 
+from library_manager import stats
 from library_manager.models import Artist
 
 Spotdl.__init__ = spotdl_override.__init__
@@ -19,7 +20,7 @@ spotdl = Spotdl(**spotdl_settings)
 spotipy_client = SpotifyClient()
 downloader = Downloader(spotipy_client)
 
-def track_artists_in_playlist(playlist_url: str, task: Task):
+def track_artists_in_playlist(playlist_url: str, task: Task, downloader: Downloader = downloader):
     # TODO
     playlist = downloader.get_playlist(playlist_url)
     # pp(playlist)
@@ -48,5 +49,6 @@ def track_artists_in_playlist(playlist_url: str, task: Task):
             gid=artist_info['gid'],
             defaults=artist_info
         )[0]
+    stats.refresh_library_stats()
 
     print(f"ensured {len(artists_to_track)} artists were tracked")
\ No newline at end of file
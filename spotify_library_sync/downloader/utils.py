@@ -1,9 +1,16 @@
+from collections import defaultdict
+from itertools import islice
+import os
+from typing import Iterable, Iterator
 from urllib.parse import urljoin, urlparse
 import base62
 from datetime import datetime
 
 from lib.config_class import Config
 
+# Keep `IN (...)` lookups comfortably below SQLite's bound parameter limit
+SQLITE_IN_BATCH_SIZE = 500
+
 def convert_date_string_to_datetime(string):
     added_at: str = string
     # Convert from Zulu UTC to datetime UTC
@@ -16,6 +23,31 @@ def update_process_info(config: Config, progress: int):
     config.process_info.total_progress = progress
     config.process_info.update(n=0)
 
+def chunked(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+def existing_file_paths(file_paths: Iterable[str]) -> set[str]:
+    # List each directory once rather than stat-ing every file, which is much cheaper on network mounts
+    file_names_by_directory: dict[str, set[str]] = defaultdict(set)
+    for file_path in file_paths:
+        directory, file_name = os.path.split(str(file_path))
+        file_names_by_directory[directory].add(file_name)
+
+    existing_paths: set[str] = set()
+    for directory, file_names in file_names_by_directory.items():
+        try:
+            directory_entries = set(os.listdir(directory))
+        except OSError:
+            continue
+        existing_paths.update(os.path.join(directory, file_name) for file_name in file_names & directory_entries)
+    return existing_paths
+
+def get_output_root(output_template: str) -> str:
+    # The library root is everything before the first templated path segment
+    return os.path.dirname(output_template.split('{', 1)[0]) or '/'
+
 def uri_to_gid(uri: str) -> str:
     return hex(base62.decode(uri, base62.CHARSET_INVERTED))[2:].zfill(32)
 
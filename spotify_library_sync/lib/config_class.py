@@ -17,6 +17,8 @@ class Config:
         print_exceptions: bool = True,
         process_info: ProcessInfo = None,
         force_playlist_resync: bool = False,
+        concurrent_downloads: bool = settings.concurrent_downloads,
+        download_lookahead: int = settings.download_lookahead,
 
     ):
         self.urls = urls
@@ -30,3 +32,5 @@ class Config:
         self.print_exceptions = print_exceptions
         self.process_info = process_info
         self.force_playlist_resync = force_playlist_resync
+        self.concurrent_downloads = concurrent_downloads
+        self.download_lookahead = download_lookahead
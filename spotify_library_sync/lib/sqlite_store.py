@@ -0,0 +1,49 @@
+import sqlite3
+import threading
+from pathlib import Path
+
+class SqliteStore:
+    """Small standalone SQLite database shared between the web and huey worker processes.
+
+    Each thread gets its own connection, in autocommit mode with WAL enabled so readers never block the writer.
+    Subclasses list the statements needed to create their tables in `schema`.
+    """
+    schema: list[str] = []
+
+    def __init__(self, path: str | Path, timeout: float = 20):
+        self.path = str(path)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            if self.path != ':memory:':
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL;")
+            connection.execute("PRAGMA synchronous=NORMAL;")
+            for statement in self.schema:
+                connection.execute(statement)
+            self._local.connection = connection
+        return connection
+
+    def execute(self, sql: str, parameters: tuple | dict = ()) -> sqlite3.Cursor:
+        return self.connection.execute(sql, parameters)
+
+    def transaction(self) -> "_ImmediateTransaction":
+        """Take the write lock up front, so read-modify-write sequences are atomic across processes"""
+        return _ImmediateTransaction(self.connection)
+
+class _ImmediateTransaction:
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.connection.execute("BEGIN IMMEDIATE;")
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.connection.execute("ROLLBACK;" if exc_type is not None else "COMMIT;")
+        return False
@@ -1,71 +1,68 @@
-from .models import Artist, TrackedPlaylist
+from .models import Artist, EnqueuedTask, PendingArtistRefresh, TrackedPlaylist
 from . import tasks
 
 from huey.contrib.djhuey import HUEY as rawHuey
-from huey.api import Task
-
-from django.db import connection
-
-def get_all_tasks_with_name(task_name: str):
-    potential_tasks: list[Task] = rawHuey.pending()
-
-    found_tasks: list[int] = []
-
-    for potential_task in potential_tasks:
-        if potential_task.name == task_name:
-            found_tasks.append(potential_task)
-
-    return found_tasks
-
-def convert_first_task_args_to_list(pending_tasks: list[Task]) -> list[int] | list[str]:
-    pending_args: list[int] | list[str] = []
-
-    for pending_task in pending_tasks:
-        pending_args.append(pending_task.args[0])
-
-    return pending_args
-
-def update_tracked_artists_albums(already_enqueued_artists: list[int], artists_to_enqueue: list[Artist], priority: int | None = None):
+from huey.api import TaskWrapper
+
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+def enqueue_unique(task_wrapper: TaskWrapper, key: str | int, *args, **kwargs) -> bool:
+    """Enqueue a task, unless one with the same name and key is already queued (or running)
+
+    The registration is removed by `tasks.release_enqueued_task` once the task finishes.
+
+    Returns:
+        bool: whether the task was enqueued
+    """
+    task = task_wrapper.s(*args, **kwargs)
+    try:
+        with transaction.atomic():
+            EnqueuedTask.objects.create(task_name=task.name, key=str(key), task_id=task.id)
+    except IntegrityError:
+        return False
+
+    try:
+        rawHuey.enqueue(task)
+    except Exception:
+        EnqueuedTask.objects.filter(task_id=task.id).delete()
+        raise
+    return True
+
+def enqueue_pending_artist_refresh(priority: int | None = None):
+    extra_args = {}
+    if priority is not None:
+        extra_args['priority'] = priority
+    # A single task drains the whole pending set, so there's never a reason to queue a second one
+    enqueue_unique(tasks.refresh_pending_artists, 'all', **extra_args)
+
+def refresh_all_tracked_artists(priority: int | None = None):
+    # Unlike the periodic `update_tracked_artists` (which only refreshes the artists that are due), every tracked artist
+    # is refreshed. They go through the pending set, so it's drained in batches that stop when the `spotify` budget is used up
+    PendingArtistRefresh.objects.bulk_create(
+        [PendingArtistRefresh(artist_id=artist_id) for artist_id in Artist.objects.filter(tracked=True).values_list('id', flat=True)],
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+    enqueue_pending_artist_refresh(priority=priority)
+
+def download_missing_tracked_artists(artists_to_enqueue: list[Artist], priority: int | None = None):
     for artist in artists_to_enqueue:
-        if artist.id in already_enqueued_artists:
-            continue
-
         extra_args = {}
         if priority is not None:
             extra_args['priority'] = priority
-        tasks.fetch_all_albums_for_artist(artist.id, **extra_args)
+        enqueue_unique(tasks.download_missing_albums_for_artist, artist.id, artist.id, **extra_args)
 
-def download_missing_tracked_artists(already_enqueued_artists: list[int], artists_to_enqueue: list[Artist], priority: int | None = None):
-    for artist in artists_to_enqueue:
-        if artist.id in already_enqueued_artists:
-            continue
-
-        extra_args = {
-            # Delay album downloads for the artists for 5 seconds (once they begin)
-            'delay': 5
-        }
-
-        if priority is not None:
-            extra_args['priority'] = priority
-        tasks.download_missing_albums_for_artist(artist.id, **extra_args)
-
-
-def download_non_enqueued_playlists(already_enqueued_playlists: list[str], playlists_to_enqueue: list[TrackedPlaylist], priority: int | None = None):
+def enqueue_playlists(playlists_to_enqueue: list[TrackedPlaylist], priority=None):
     for playlist in playlists_to_enqueue:
-        if playlist.url in already_enqueued_playlists:
-            continue
-
         extra_args = {}
         if priority is not None:
             extra_args['priority'] = priority
-        tasks.download_playlist(playlist_url=playlist.url, tracked=playlist.auto_track_artists, **extra_args)
-
-def enqueue_playlists(playlists_to_enqueue: list[TrackedPlaylist], priority=None):
-    existing_tasks = get_all_tasks_with_name('download_playlist')
-    already_enqueued_playlists = convert_first_task_args_to_list(existing_tasks)
-    download_non_enqueued_playlists(already_enqueued_playlists, playlists_to_enqueue, priority=priority)
+        enqueue_unique(tasks.download_playlist, playlist.url, playlist_url=playlist.url, tracked=playlist.auto_track_artists, **extra_args)
 
 def cleanup_huey_history():
+    # Registrations of tasks that never reported finishing (ie. the queue was flushed) would otherwise block them forever
+    EnqueuedTask.objects.filter(enqueued_at__lt=timezone.now() - timezone.timedelta(days=4)).delete()
     with connection.cursor() as cursor:
         cursor.execute("UPDATE huey_monitor_taskmodel SET parent_task_id = NULL, state_id = NULL WHERE create_dt < DATETIME('now', '-3 day');")
         cursor.execute("DELETE FROM huey_monitor_signalinfomodel WHERE create_dt < DATETIME('now', '-4 day');")
@@ -0,0 +1,163 @@
+import json
+import sqlite3
+import statistics
+import threading
+import time
+from typing import Any, Callable
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models.functions import Lower
+from django.test import RequestFactory
+from django.utils import timezone
+
+from library_manager import search, stats, tasks, views
+from library_manager.models import Album, Artist, ContributingArtist, DownloadHistory, Song, SongState
+from library_manager.pagination import KeysetPaginator
+
+# How many pages deep the "deep page" index benchmark starts, keyset pagination should make it cost the same as page 1
+INDEX_DEEP_PAGE = 20
+
+class QueryCounter:
+    # Unlike `CaptureQueriesContext`, this doesn't need DEBUG and isn't capped at the 9000 most recent queries.
+    # It can be installed on several threads' connections at once
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+class Command(BaseCommand):
+    help = "Time and count the queries of the library views and task selection queries, optionally comparing against a previous run"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", default="benchmark.json", help="Where to write the JSON results")
+        parser.add_argument("--repeat", type=int, default=5, help="Timed runs per benchmark (after one warm up run)")
+        parser.add_argument("--baseline", default=None, help="Results of a previous run to compare against")
+        parser.add_argument("--tolerance", type=float, default=1.5, help="Slowdown (best time ratio) over the baseline that counts as a regression")
+        parser.add_argument("--min-slowdown-ms", type=float, default=5, help="Ignore slowdowns smaller than this, which are mostly noise")
+
+    def handle(self, *args, **options):
+        if not Artist.objects.exists():
+            raise CommandError("The library is empty, run `generate_synthetic_library` first")
+
+        results = {}
+        for name, benchmark in self.benchmarks().items():
+            results[name] = self.run_benchmark(benchmark, options["repeat"])
+            self.stdout.write(f"{name}: {results[name]['median_ms']}ms median | {results[name]['queries']} queries")
+
+        report = {
+            'generated_at': timezone.now().isoformat(),
+            'django_version': django.get_version(),
+            'sqlite_version': sqlite3.sqlite_version,
+            'library': {
+                'artists': Artist.objects.count(),
+                'albums': Album.objects.count(),
+                'songs': Song.objects.count(),
+                'contributing_artists': ContributingArtist.objects.count(),
+                'download_history': DownloadHistory.objects.count(),
+            },
+            'results': results,
+        }
+        with open(options["output"], "w") as output_file:
+            json.dump(report, output_file, indent=2)
+        self.stdout.write(f"Wrote results to {options['output']}")
+
+        if options["baseline"] is not None:
+            with open(options["baseline"]) as baseline_file:
+                baseline = json.load(baseline_file)
+            regressions = self.compare(baseline['results'], results, options["tolerance"], options["min_slowdown_ms"])
+            for regression in regressions:
+                self.stderr.write(regression)
+            if len(regressions) > 0:
+                raise CommandError(f"{len(regressions)} benchmark(s) regressed against {options['baseline']}")
+            self.stdout.write(f"No regressions against {options['baseline']}")
+
+    @staticmethod
+    def run_benchmark(benchmark: Callable[[], Any], repeat: int) -> dict:
+        # Warm up the page cache (and any Python level caches) so the timed runs are comparable
+        benchmark()
+        timings: list[float] = []
+        for _ in range(repeat):
+            query_counter = QueryCounter()
+            with connection.execute_wrapper(query_counter):
+                start = time.perf_counter()
+                benchmark()
+                timings.append((time.perf_counter() - start) * 1000)
+        return {
+            'median_ms': round(statistics.median(timings), 3),
+            'min_ms': round(min(timings), 3),
+            'max_ms': round(max(timings), 3),
+            'queries': query_counter.count,
+        }
+
+    @staticmethod
+    def compare(baseline_results: dict, results: dict, tolerance: float, min_slowdown_ms: float) -> list[str]:
+        regressions: list[str] = []
+        for name, result in results.items():
+            baseline_result = baseline_results.get(name)
+            if baseline_result is None:
+                continue
+            if result['queries'] > baseline_result['queries']:
+                regressions.append(f"{name}: {result['queries']} queries (was {baseline_result['queries']})")
+            # The best run is the least affected by whatever else the machine is doing
+            slowdown_ms = result['min_ms'] - baseline_result['min_ms']
+            if result['min_ms'] > baseline_result['min_ms'] * tolerance and slowdown_ms > min_slowdown_ms:
+                regressions.append(f"{name}: {result['min_ms']}ms best run (was {baseline_result['min_ms']}ms)")
+        return regressions
+
+    def benchmarks(self) -> dict[str, Callable[[], Any]]:
+        request_factory = RequestFactory()
+        # The artist with the most albums and songs is the worst case for the artist pages
+        artist = Artist.objects.order_by('-known_album_count', '-song_count', 'id').first()
+
+        # Walk to a deep page up front, so only loading that page is timed
+        index_paginator = KeysetPaginator(Artist.objects.annotate(name_lower=Lower("name")), 50, ["name_lower", "id"])
+        deep_page_cursor = ""
+        index_page = index_paginator.get_page(None)
+        for _ in range(INDEX_DEEP_PAGE):
+            if not index_page.has_next:
+                break
+            deep_page_cursor = index_page.next_cursor
+            index_page = index_paginator.get_page(deep_page_cursor)
+
+        def render(view: Callable, path: str, **kwargs) -> Callable[[], Any]:
+            def render_view():
+                response = view(request_factory.get(path), **kwargs)
+                assert response.status_code == 200, f"{path} returned {response.status_code}"
+                return response
+            return render_view
+
+        # Mirror the selection queries in tasks.py, keep them in sync when those change
+        return {
+            'views.index': render(views.index, "/library_manager/"),
+            'views.index (deep page)': render(views.index, f"/library_manager/?cursor={deep_page_cursor}"),
+            'views.index (search)': render(views.index, "/library_manager/?search_artist=night"),
+            'views.index (tracked)': render(views.index, "/library_manager/?tracked=true"),
+            'views.artist': render(views.artist, f"/library_manager/artist/{artist.id}/", artist_id=artist.id),
+            'views.albums': render(views.albums, f"/library_manager/artist/{artist.id}/albums", artist_id=artist.id),
+            'views.missing_known_songs': render(views.missing_known_songs, "/library_manager/missing_known_songs"),
+            'views.undownloaded_songs': render(views.undownloaded_songs, "/library_manager/undownloaded_songs"),
+            'views.download_history': render(views.download_history, "/library_manager/download_history"),
+            'views.search_library': render(views.search_library, "/library_manager/search?q=love"),
+            'tasks.download_missing_albums_for_artist': lambda: list(
+                Album.objects.filter(artist=artist, desired=True, downloaded=False, wanted=True)
+            ),
+            'tasks.retry_all_missing_known_songs': lambda: list(
+                Song.objects.filter(state=SongState.PENDING, primary_artist__tracked=True).order_by("created_at")[:100]
+            ) + list(Song.objects.filter(state=SongState.FAILED).order_by("created_at")[:100]),
+            'tasks.validate_undownloaded_songs': lambda: list(
+                Song.objects.filter(state=SongState.ON_DISK_UNVERIFIED, unavailable=False).order_by("created_at")[:50]
+            ) + list(Song.objects.filter(state=SongState.ON_DISK_UNVERIFIED, unavailable=True).order_by("created_at")[:50]),
+            'tasks.download_missing_tracked_artists': lambda: list(
+                Artist.objects.filter(tracked=True, album__desired=True, album__downloaded=False, album__wanted=True).distinct().order_by("last_synced_at", "added_at", "id")[:150]
+            ),
+            'tasks.update_tracked_artists': lambda: tasks.discography_refresher.due_artists(settings.artist_refresh_request_budget),
+            'stats.refresh_library_stats': stats.refresh_library_stats,
+            'search.search_library': lambda: search.search_library("night love"),
+        }
@@ -0,0 +1,225 @@
+import json
+import os
+import resource
+import sqlite3
+import tempfile
+import time
+from typing import Callable
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+
+from downloader import utils
+from downloader.default_download_settings import DEFAULT_DOWNLOAD_SETTINGS
+from downloader.fakes import FakeAudioDownloader, FakeSpotdl, FakeSpotifyCatalog, FakeSpotifyClient
+from downloader.rate_limiter import default_rate_limiter
+from downloader.spotdl_wrapper import SpotdlWrapper
+from downloader.spotify_cache import SpotifyResponseCache
+from downloader.spotipy_tasks import track_artists_in_playlist
+from lib.config_class import Config
+from library_manager.models import Album, Artist, TrackedPlaylist
+from .benchmark_library import QueryCounter
+
+class Command(BaseCommand):
+    help = (
+        "Run whole-album and playlist download jobs end to end against a fake Spotify API and audio provider, "
+        "measuring tracks per minute, queries per track and peak memory. Adds fake artists, songs and playlists to the database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", default="benchmark_pipeline.json", help="Where to write the JSON results")
+        parser.add_argument("--baseline", default=None, help="Results of a previous run to compare against")
+        parser.add_argument("--tolerance", type=float, default=1.5, help="Throughput drop (ratio) below the baseline that counts as a regression")
+        parser.add_argument("--album-artists", type=int, default=4, help="Artists whose discography is fetched and downloaded album by album")
+        parser.add_argument("--playlist-tracks", type=int, default=5000)
+        parser.add_argument("--playlist-added-tracks", type=int, default=100, help="Tracks added to the playlist before it is synced again")
+        parser.add_argument("--spotify-latency", type=float, default=0, help="Seconds each fake Spotify request takes")
+        parser.add_argument("--search-latency", type=float, default=0.01, help="Seconds each fake audio provider search takes")
+        parser.add_argument("--download-latency", type=float, default=0.05, help="Seconds each fake download takes")
+        parser.add_argument("--search-failure-rate", type=float, default=0.02)
+        parser.add_argument("--download-failure-rate", type=float, default=0.02)
+        parser.add_argument("--low-bitrate-rate", type=float, default=0.02, help="Fraction of downloads that come out below the expected bitrate")
+        parser.add_argument("--threads", type=int, default=DEFAULT_DOWNLOAD_SETTINGS["threads"], help="Concurrent fake downloads, like spotdl's `threads`")
+        parser.add_argument("--seed", type=int, default=0, help="The same seed and sizes always run the same jobs, with the same failures")
+        parser.add_argument("--keep-rate-limits", action="store_true", help="Draw from the configured rate limits, rather than running unthrottled")
+        parser.add_argument("--force", action="store_true", help="Run even if the database already has artists (from another seed)")
+
+    def handle(self, *args, **options):
+        if Artist.objects.exists() and not options["force"]:
+            raise CommandError("The database already has artists, run against an empty database (or pass --force)")
+
+        # Count the queries made from every thread (ie. the audio probes), not just this one
+        query_counter = QueryCounter()
+        connection.ensure_connection()
+        connection.execute_wrappers.append(query_counter)
+        def count_queries(sender, connection, **kwargs):
+            connection.execute_wrappers.append(query_counter)
+        connection_created.connect(count_queries)
+
+        # Only this process' view of the budgets is changed, the shared bucket state is left alone
+        rate_limiter = default_rate_limiter()
+        configured_budgets = rate_limiter.budgets
+        if not options["keep_rate_limits"]:
+            rate_limiter.budgets = {}
+
+        try:
+            with tempfile.TemporaryDirectory(prefix="benchmark_pipeline_") as work_directory:
+                results = self.run_jobs(options, work_directory, query_counter)
+        finally:
+            rate_limiter.budgets = configured_budgets
+            connection_created.disconnect(count_queries)
+            connection.execute_wrappers.remove(query_counter)
+
+        report = {
+            'generated_at': timezone.now().isoformat(),
+            'django_version': django.get_version(),
+            'sqlite_version': sqlite3.sqlite_version,
+            'options': {
+                option: options[option] for option in (
+                    'album_artists', 'playlist_tracks', 'playlist_added_tracks', 'spotify_latency', 'search_latency', 'download_latency',
+                    'search_failure_rate', 'download_failure_rate', 'low_bitrate_rate', 'threads', 'seed', 'keep_rate_limits',
+                )
+            },
+            'results': results,
+        }
+        with open(options["output"], "w") as output_file:
+            json.dump(report, output_file, indent=2)
+        self.stdout.write(f"Wrote results to {options['output']}")
+
+        if options["baseline"] is not None:
+            with open(options["baseline"]) as baseline_file:
+                baseline = json.load(baseline_file)
+            # Job sizes, latencies and failure rates all change the results, so only like for like runs are comparable
+            if baseline['options'] != report['options']:
+                raise CommandError(f"{options['baseline']} was run with different options: {baseline['options']}")
+            regressions = self.compare(baseline['results'], results, options["tolerance"])
+            for regression in regressions:
+                self.stderr.write(regression)
+            if len(regressions) > 0:
+                raise CommandError(f"{len(regressions)} job(s) regressed against {options['baseline']}")
+            self.stdout.write(f"No regressions against {options['baseline']}")
+
+    def run_jobs(self, options: dict, work_directory: str, query_counter: QueryCounter) -> dict[str, dict]:
+        catalog = FakeSpotifyCatalog(seed=options["seed"])
+        spotify_client = FakeSpotifyClient(catalog, latency=options["spotify_latency"])
+        audio_downloader = FakeAudioDownloader(
+            os.path.join(work_directory, "music"),
+            threads=options["threads"],
+            search_latency=options["search_latency"],
+            download_latency=options["download_latency"],
+            search_failure_rate=options["search_failure_rate"],
+            download_failure_rate=options["download_failure_rate"],
+            low_bitrate_rate=options["low_bitrate_rate"],
+            seed=options["seed"],
+        )
+        # A fresh response cache, so every job starts out fetching from (fake) Spotify like it would the first time
+        response_cache = SpotifyResponseCache(
+            os.path.join(work_directory, "spotify_cache.sqlite3"),
+            ttls=dict(settings.get('spotify_cache_ttls', {})),
+        )
+        spotdl_wrapper = SpotdlWrapper(Config(), spotdl=FakeSpotdl(audio_downloader), spotipy_client=spotify_client, response_cache=response_cache)
+
+        def run_job(name: str, job: Callable[[], int | None], tracks: int) -> dict:
+            queries_before = query_counter.count
+            requests_before = sum(spotify_client.request_counts.values())
+            peak_rss_before = self.peak_rss_mb()
+            start = time.perf_counter()
+            errors = job()
+            seconds = time.perf_counter() - start
+            queries = query_counter.count - queries_before
+
+            result = {
+                'seconds': round(seconds, 3),
+                'tracks': tracks,
+                'errors': errors or 0,
+                'tracks_per_minute': round(tracks / seconds * 60, 1) if tracks > 0 else None,
+                'queries': queries,
+                'queries_per_track': round(queries / tracks, 2) if tracks > 0 else None,
+                'spotify_requests': sum(spotify_client.request_counts.values()) - requests_before,
+                # ru_maxrss never goes down, so a job only raises it if it needed more memory than every job before it
+                'peak_rss_mb': self.peak_rss_mb(),
+                'peak_rss_growth_mb': round(self.peak_rss_mb() - peak_rss_before, 1),
+            }
+            self.stdout.write(
+                f"{name}: {result['tracks']} tracks in {result['seconds']}s ({result['tracks_per_minute']}/min) | "
+                f"{result['queries']} queries ({result['queries_per_track']}/track) | {result['spotify_requests']} Spotify requests | "
+                f"{result['errors']} errors | {result['peak_rss_mb']}MB peak RSS"
+            )
+            return result
+
+        results: dict[str, dict] = {}
+        try:
+            # Whole-album jobs, the way `update_tracked_artists` and `download_missing_albums_for_artist` run them
+            album_artists = [catalog.add_artist() for _ in range(options["album_artists"])]
+            if Artist.objects.filter(gid__in=[utils.uri_to_gid(artist['id']) for artist in album_artists]).exists():
+                raise CommandError(f"The database already has the artists for seed {options['seed']}, run with another --seed")
+            db_artists = Artist.objects.bulk_create([
+                Artist(name=artist['name'], gid=utils.uri_to_gid(artist['id']), tracked=True) for artist in album_artists
+            ])
+
+            def fetch_discographies():
+                for db_artist in db_artists:
+                    spotdl_wrapper.execute(Config(urls=[], artist_to_fetch=db_artist.gid))
+            results['discography'] = run_job('discography', fetch_discographies, 0)
+
+            missing_albums = {
+                db_artist: list(Album.objects.filter(artist=db_artist, desired=True, downloaded=False, wanted=True).values_list('spotify_uri', flat=True))
+                for db_artist in db_artists
+            }
+            album_tracks = sum(catalog.albums[album_uri.rsplit(':', 1)[1]]['total_tracks'] for album_uris in missing_albums.values() for album_uri in album_uris)
+            results['album'] = run_job(
+                'album',
+                lambda: sum(spotdl_wrapper.execute(Config(urls=album_uris)) for album_uris in missing_albums.values() if len(album_uris) > 0),
+                album_tracks,
+            )
+
+            # A tracked playlist, the way `download_playlist` first syncs it and then `sync_tracked_playlists` keeps it up to date
+            playlist = catalog.add_playlist(options["playlist_tracks"])
+            playlist_url = playlist['external_urls']['spotify']
+            TrackedPlaylist.objects.create(name=playlist['name'], url=playlist_url, auto_track_artists=True)
+            results['playlist'] = run_job(
+                'playlist',
+                lambda: spotdl_wrapper.execute(Config(urls=[playlist_url], track_artists=True)),
+                options["playlist_tracks"],
+            )
+
+            catalog.add_playlist_tracks(playlist['id'], options["playlist_added_tracks"])
+            results['playlist_resync'] = run_job(
+                'playlist_resync',
+                lambda: spotdl_wrapper.execute(Config(urls=[playlist_url], track_artists=True)),
+                options["playlist_added_tracks"],
+            )
+
+            results['track_artists_in_playlist'] = run_job(
+                'track_artists_in_playlist',
+                lambda: track_artists_in_playlist(playlist_url, None, downloader=spotdl_wrapper.downloader),
+                options["playlist_tracks"] + options["playlist_added_tracks"],
+            )
+        finally:
+            spotdl_wrapper.prefetch_executor.shutdown()
+            spotdl_wrapper.audio_prober.executor.shutdown()
+            audio_downloader.executor.shutdown()
+        return results
+
+    @staticmethod
+    def peak_rss_mb() -> float:
+        # Reported in kilobytes on Linux
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    @staticmethod
+    def compare(baseline_results: dict, results: dict, tolerance: float) -> list[str]:
+        regressions: list[str] = []
+        for name, result in results.items():
+            baseline_result = baseline_results.get(name)
+            if baseline_result is None:
+                continue
+            if result['queries'] > baseline_result['queries']:
+                regressions.append(f"{name}: {result['queries']} queries (was {baseline_result['queries']})")
+            if result['tracks_per_minute'] is not None and baseline_result['tracks_per_minute'] is not None \
+                    and result['tracks_per_minute'] * tolerance < baseline_result['tracks_per_minute']:
+                regressions.append(f"{name}: {result['tracks_per_minute']} tracks/min (was {baseline_result['tracks_per_minute']})")
+        return regressions
@@ -0,0 +1,166 @@
+import random
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import DurationField, ExpressionWrapper, F, Value
+
+from downloader import utils
+from library_manager.models import Album, Artist, ContributingArtist, DownloadHistory, Song
+from library_manager.stats import refresh_artist_stats, refresh_library_stats
+
+ARTIST_WORDS = [
+    "black", "blue", "brothers", "city", "crystal", "dead", "electric", "echo", "fever", "fire", "ghost", "glass",
+    "golden", "heart", "iron", "kings", "lights", "lost", "machine", "moon", "neon", "night", "ocean", "paper",
+    "queen", "radio", "red", "rivers", "saints", "shadow", "silver", "sisters", "sonic", "stone", "sun", "velvet",
+    "wild", "wolves", "björk", "sigur", "rós", "mötley", "beyoncé", "the",
+]
+TITLE_WORDS = ARTIST_WORDS + [
+    "after", "all", "away", "baby", "back", "dance", "dream", "forever", "home", "in", "love", "me", "my", "never",
+    "of", "on", "remix", "run", "song", "summer", "tonight", "way", "you", "live", "acoustic", "edit", "version",
+]
+ALBUM_TYPES = [("album", 0.35), ("single", 0.45), ("compilation", 0.05), ("appears_on", 0.15)]
+# (bitrate, unavailable, downloaded, failed_count) for each song state, roughly matching a library that has been running a while
+SONG_STATES = [
+    ((320, False, True, 0), 0.80),
+    ((0, False, False, 0), 0.08),
+    ((0, False, False, 2), 0.04),
+    ((0, True, False, 4), 0.04),
+    ((320, False, False, 0), 0.04),
+]
+
+class Command(BaseCommand):
+    help = "Fill an empty database with a reproducible synthetic library, for benchmarking (see `benchmark_library`)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--artists", type=int, default=20000)
+        parser.add_argument("--albums", type=int, default=300000)
+        parser.add_argument("--songs", type=int, default=2000000)
+        parser.add_argument("--download-history", type=int, default=5000)
+        parser.add_argument("--tracked-ratio", type=float, default=0.3, help="Fraction of artists that are tracked")
+        parser.add_argument("--seed", type=int, default=0, help="The same seed and sizes always generate the same library")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--force", action="store_true", help="Generate even if the database already has artists")
+
+    def handle(self, *args, **options):
+        if Artist.objects.exists() and not options["force"]:
+            raise CommandError("The database already has artists, generate into an empty database (or pass --force)")
+
+        rng = random.Random(options["seed"])
+        batch_size = options["batch_size"]
+        # Timestamps are spread backwards from a fixed point, so reruns don't depend on the current time either
+        created_at_origin = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+
+        artist_ids = self.generate_artists(rng, options["artists"], options["tracked_ratio"], batch_size)
+        self.stdout.write(f"Created {len(artist_ids)} artists")
+        artist_gids = list(Artist.objects.filter(id__in=artist_ids).order_by('id').values_list('gid', flat=True))
+
+        album_count = self.generate_albums(rng, artist_gids, options["albums"], batch_size)
+        self.stdout.write(f"Created {album_count} albums")
+
+        song_count = self.generate_songs(rng, artist_ids, options["songs"], created_at_origin, batch_size)
+        self.stdout.write(f"Created {song_count} songs")
+
+        history_count = self.generate_download_history(rng, options["download_history"], created_at_origin, batch_size)
+        self.stdout.write(f"Created {history_count} download history entries")
+
+        refresh_artist_stats()
+        refresh_library_stats()
+        self.stdout.write("Recomputed library stats")
+
+    @staticmethod
+    def skewed_index(rng: random.Random, size: int) -> int:
+        # Some artists have many more albums and songs than others, like a real library
+        return int(size * rng.random() ** 1.5)
+
+    @staticmethod
+    def random_gid(rng: random.Random) -> str:
+        return f"{rng.getrandbits(128):032x}"
+
+    @staticmethod
+    def random_name(rng: random.Random, words: list[str], length: int) -> str:
+        return " ".join(rng.choice(words) for _ in range(rng.randint(1, length))).title()
+
+    def generate_artists(self, rng: random.Random, count: int, tracked_ratio: float, batch_size: int) -> list[int]:
+        artist_ids: list[int] = []
+        for batch_start in range(0, count, batch_size):
+            artists = [
+                Artist(
+                    name=self.random_name(rng, ARTIST_WORDS, 3),
+                    gid=self.random_gid(rng),
+                    tracked=rng.random() < tracked_ratio,
+                )
+                for _ in range(batch_start, min(batch_start + batch_size, count))
+            ]
+            artist_ids.extend(artist.id for artist in Artist.objects.bulk_create(artists))
+        return artist_ids
+
+    def generate_albums(self, rng: random.Random, artist_gids: list[str], count: int, batch_size: int) -> int:
+        album_types, album_type_weights = zip(*ALBUM_TYPES)
+        for batch_start in range(0, count, batch_size):
+            albums = []
+            for _ in range(batch_start, min(batch_start + batch_size, count)):
+                album_uri = utils.gid_to_uri(self.random_gid(rng))
+                album_type = rng.choices(album_types, album_type_weights)[0]
+                albums.append(Album(
+                    spotify_gid=album_uri,
+                    spotify_uri=f"spotify:album:{album_uri}",
+                    artist_id=artist_gids[self.skewed_index(rng, len(artist_gids))],
+                    name=self.random_name(rng, TITLE_WORDS, 4),
+                    total_tracks=1 if album_type == "single" else rng.randint(6, 20),
+                    downloaded=rng.random() < 0.6,
+                    wanted=rng.random() < 0.9,
+                    # Spotify reports "appears_on" as the group, with the album's own type
+                    album_type="album" if album_type == "appears_on" else album_type,
+                    album_group=album_type,
+                ))
+            Album.objects.bulk_create(albums)
+        return count
+
+    def generate_songs(self, rng: random.Random, artist_ids: list[int], count: int, created_at_origin: datetime, batch_size: int) -> int:
+        song_states, song_state_weights = zip(*SONG_STATES)
+        for batch_start in range(0, count, batch_size):
+            songs = []
+            for song_index in range(batch_start, min(batch_start + batch_size, count)):
+                bitrate, unavailable, downloaded, failed_count = rng.choices(song_states, song_state_weights)[0]
+                songs.append(Song(
+                    name=self.random_name(rng, TITLE_WORDS, 5),
+                    gid=self.random_gid(rng),
+                    primary_artist_id=artist_ids[self.skewed_index(rng, len(artist_ids))],
+                    bitrate=bitrate,
+                    unavailable=unavailable,
+                    downloaded=downloaded,
+                    failed_count=failed_count,
+                    file_path=f"/music/synthetic/{song_index}.mp3" if bitrate > 0 else None,
+                ))
+            with transaction.atomic():
+                songs = Song.objects.bulk_create(songs)
+                # `created_at` is set on insert, spread it out (a minute apart) in a single update so ordering by it looks like a real library
+                minutes_before_origin = count - batch_start + songs[0].id - F('id')
+                Song.objects.filter(id__gte=songs[0].id, id__lte=songs[-1].id).update(
+                    created_at=Value(created_at_origin) - ExpressionWrapper(minutes_before_origin * Value(timedelta(minutes=1)), output_field=DurationField()),
+                )
+
+                contributing_artists = [ContributingArtist(song=song, artist_id=song.primary_artist_id) for song in songs]
+                for song in songs:
+                    # Some songs are features, with a second contributing artist
+                    if rng.random() < 0.2:
+                        featured_artist_id = artist_ids[rng.randrange(len(artist_ids))]
+                        if featured_artist_id != song.primary_artist_id:
+                            contributing_artists.append(ContributingArtist(song=song, artist_id=featured_artist_id))
+                ContributingArtist.objects.bulk_create(contributing_artists)
+        return count
+
+    def generate_download_history(self, rng: random.Random, count: int, completed_at: datetime, batch_size: int) -> int:
+        for batch_start in range(0, count, batch_size):
+            download_history = []
+            for _ in range(batch_start, min(batch_start + batch_size, count)):
+                album_uri = utils.gid_to_uri(self.random_gid(rng))
+                completed = rng.random() < 0.95
+                download_history.append(DownloadHistory(
+                    url=f"https://open.spotify.com/album/{album_uri}",
+                    completed_at=completed_at if completed else None,
+                    progress=1000 if completed else rng.randint(1, 999),
+                ))
+            DownloadHistory.objects.bulk_create(download_history)
+        return count
@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+
+from library_manager.stats import refresh_artist_stats
+
+class Command(BaseCommand):
+    help = "Recompute the stored album and song counts for every artist"
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Recomputed stats for {refresh_artist_stats()} artists")
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from downloader.spotify_cache import SpotifyResponseCache
+
+class Command(BaseCommand):
+    help = "Show hit/miss counters for the persistent Spotify API response cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--evict", action="store_true", help="Evict expired and least recently used entries first")
+
+    def handle(self, *args, **options):
+        response_cache = SpotifyResponseCache.from_settings()
+        if options["evict"]:
+            self.stdout.write(f"Evicted {response_cache.evict()} entries")
+
+        for resource_type, counters in response_cache.stats().items():
+            hits = counters.get('hits', 0)
+            misses = counters.get('misses', 0)
+            hit_rate = f" | hit rate: {round(hits / (hits + misses) * 100, 2)}%" if hits + misses > 0 else ""
+            self.stdout.write(f"{resource_type}: " + ", ".join(f"{name}: {value}" for name, value in counters.items()) + hit_rate)
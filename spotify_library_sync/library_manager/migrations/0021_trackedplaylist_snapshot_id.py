@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_manager', '0020_song_downloaded_song_file_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trackedplaylist',
+            name='snapshot_id',
+            field=models.CharField(default=None, max_length=200, null=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_manager', '0021_trackedplaylist_snapshot_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaylistTrack',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('added_at', models.DateTimeField(default=None, null=True)),
+                ('playlist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tracks', to='library_manager.trackedplaylist')),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='library_manager.song')),
+            ],
+            options={
+                'unique_together': {('playlist', 'song')},
+            },
+        ),
+    ]
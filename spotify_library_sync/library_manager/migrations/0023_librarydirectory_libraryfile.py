@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_manager', '0022_playlisttrack'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LibraryDirectory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=2048, unique=True)),
+                ('mtime', models.FloatField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LibraryFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=2048, unique=True)),
+                ('directory', models.CharField(max_length=2048)),
+                ('size', models.BigIntegerField()),
+                ('mtime', models.FloatField()),
+                ('song_gid', models.CharField(max_length=120, null=True)),
+                ('indexed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['directory'], name='library_man_directo_774ca7_idx'), models.Index(fields=['song_gid'], name='library_man_song_gi_fb8e7f_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_manager', '0023_librarydirectory_libraryfile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='libraryfile',
+            name='bitrate',
+            field=models.FloatField(default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_manager', '0024_libraryfile_bitrate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnqueuedTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_name', models.CharField(max_length=200)),
+                ('key', models.CharField(max_length=2048)),
+                ('task_id', models.CharField(max_length=64, unique=True)),
+                ('enqueued_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('task_name', 'key')},
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_manager', '0025_enqueuedtask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingArtistRefresh',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('added_at', models.DateTimeField(auto_now_add=True)),
+                ('artist', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='pending_refresh', to='library_manager.artist')),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_manager', '0026_pendingartistrefresh'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='artist',
+            name='last_new_album_at',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='artist',
+            name='next_refresh_at',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='artist',
+            index=models.Index(fields=['tracked', 'next_refresh_at'], name='library_man_tracked_4251e6_idx'),
+        ),
+    ]
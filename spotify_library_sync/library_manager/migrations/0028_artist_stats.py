@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:49
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_artist_stats(apps, schema_editor):
+    Album = apps.get_model('library_manager', 'Album')
+    Artist = apps.get_model('library_manager', 'Artist')
+    ContributingArtist = apps.get_model('library_manager', 'ContributingArtist')
+
+    def per_artist_total(queryset, aggregate=None):
+        per_artist = queryset.order_by().values('artist').annotate(value=aggregate or Count('id')).values('value')
+        return Coalesce(Subquery(per_artist, output_field=IntegerField()), Value(0))
+
+    desired_albums = Album.objects.filter(
+        artist=OuterRef('gid'),
+        album_type__in=["single", "album", "compilation"],
+    ).exclude(album_group__in=["appears_on"])
+    missing_albums = desired_albums.filter(wanted=True, downloaded=False)
+
+    Artist.objects.update(
+        known_album_count=per_artist_total(desired_albums),
+        missing_album_count=per_artist_total(missing_albums),
+        downloaded_album_count=per_artist_total(desired_albums.filter(downloaded=True)),
+        missing_track_count=per_artist_total(missing_albums, Sum('total_tracks')),
+        song_count=per_artist_total(ContributingArtist.objects.filter(artist=OuterRef('pk'))),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_manager', '0027_artist_refresh_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='artist',
+            name='downloaded_album_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='artist',
+            name='known_album_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='artist',
+            name='missing_album_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='artist',
+            name='missing_track_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='artist',
+            name='song_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(populate_artist_stats, migrations.RunPython.noop),
+    ]
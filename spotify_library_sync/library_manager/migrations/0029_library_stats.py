@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:50
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_downloaded_stats(apps, schema_editor):
+    Album = apps.get_model('library_manager', 'Album')
+    Artist = apps.get_model('library_manager', 'Artist')
+
+    def per_artist_total(queryset, aggregate=None):
+        per_artist = queryset.order_by().values('artist').annotate(value=aggregate or Count('id')).values('value')
+        return Coalesce(Subquery(per_artist, output_field=IntegerField()), Value(0))
+
+    downloaded_albums = Album.objects.filter(artist=OuterRef('gid'), downloaded=True)
+    Artist.objects.update(
+        downloaded_track_count=per_artist_total(
+            downloaded_albums.filter(album_type__in=["single", "album", "compilation"]).exclude(album_group__in=["appears_on"]),
+            Sum('total_tracks'),
+        ),
+        all_downloaded_album_count=per_artist_total(downloaded_albums),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_manager', '0028_artist_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LibraryStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('num_wanted', models.IntegerField(default=0)),
+                ('sum_num_wanted', models.IntegerField(default=0)),
+                ('num_wanted_downloaded', models.IntegerField(default=0)),
+                ('sum_num_wanted_downloaded', models.IntegerField(default=0)),
+                ('total_downloaded', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='artist',
+            name='all_downloaded_album_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='artist',
+            name='downloaded_track_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(populate_downloaded_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:52
+
+from django.db import migrations
+
+SEARCH_INDEX_SQL = """
+    -- Full text index over artist, album and song names; the rowid is (id << 2) | entity type, see `search.ENTITY_TYPES`
+    CREATE VIRTUAL TABLE library_manager_search USING fts5(
+        name,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    );
+    CREATE TRIGGER library_manager_artist_search_insert AFTER INSERT ON library_manager_artist BEGIN
+        INSERT INTO library_manager_search (rowid, name) VALUES ((new.id << 2) | 1, new.name);
+    END;
+    CREATE TRIGGER library_manager_artist_search_update AFTER UPDATE OF name ON library_manager_artist BEGIN
+        DELETE FROM library_manager_search WHERE rowid = (old.id << 2) | 1;
+        INSERT INTO library_manager_search (rowid, name) VALUES ((new.id << 2) | 1, new.name);
+    END;
+    CREATE TRIGGER library_manager_artist_search_delete AFTER DELETE ON library_manager_artist BEGIN
+        DELETE FROM library_manager_search WHERE rowid = (old.id << 2) | 1;
+    END;
+    INSERT INTO library_manager_search (rowid, name) SELECT (id << 2) | 1, name FROM library_manager_artist;
+    CREATE TRIGGER library_manager_album_search_insert AFTER INSERT ON library_manager_album BEGIN
+        INSERT INTO library_manager_search (rowid, name) VALUES ((new.id << 2) | 2, new.name);
+    END;
+    CREATE TRIGGER library_manager_album_search_update AFTER UPDATE OF name ON library_manager_album BEGIN
+        DELETE FROM library_manager_search WHERE rowid = (old.id << 2) | 2;
+        INSERT INTO library_manager_search (rowid, name) VALUES ((new.id << 2) | 2, new.name);
+    END;
+    CREATE TRIGGER library_manager_album_search_delete AFTER DELETE ON library_manager_album BEGIN
+        DELETE FROM library_manager_search WHERE rowid = (old.id << 2) | 2;
+    END;
+    INSERT INTO library_manager_search (rowid, name) SELECT (id << 2) | 2, name FROM library_manager_album;
+    CREATE TRIGGER library_manager_song_search_insert AFTER INSERT ON library_manager_song BEGIN
+        INSERT INTO library_manager_search (rowid, name) VALUES ((new.id << 2) | 3, new.name);
+    END;
+    CREATE TRIGGER library_manager_song_search_update AFTER UPDATE OF name ON library_manager_song BEGIN
+        DELETE FROM library_manager_search WHERE rowid = (old.id << 2) | 3;
+        INSERT INTO library_manager_search (rowid, name) VALUES ((new.id << 2) | 3, new.name);
+    END;
+    CREATE TRIGGER library_manager_song_search_delete AFTER DELETE ON library_manager_song BEGIN
+        DELETE FROM library_manager_search WHERE rowid = (old.id << 2) | 3;
+    END;
+    INSERT INTO library_manager_search (rowid, name) SELECT (id << 2) | 3, name FROM library_manager_song;
+"""
+
+DROP_SEARCH_INDEX_SQL = """
+    DROP TRIGGER IF EXISTS library_manager_artist_search_insert;
+    DROP TRIGGER IF EXISTS library_manager_artist_search_update;
+    DROP TRIGGER IF EXISTS library_manager_artist_search_delete;
+    DROP TRIGGER IF EXISTS library_manager_album_search_insert;
+    DROP TRIGGER IF EXISTS library_manager_album_search_update;
+    DROP TRIGGER IF EXISTS library_manager_album_search_delete;
+    DROP TRIGGER IF EXISTS library_manager_song_search_insert;
+    DROP TRIGGER IF EXISTS library_manager_song_search_update;
+    DROP TRIGGER IF EXISTS library_manager_song_search_delete;
+    DROP TABLE IF EXISTS library_manager_search;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_manager', '0029_library_stats'),
+    ]
+
+    operations = [
+        migrations.RunSQL(SEARCH_INDEX_SQL, DROP_SEARCH_INDEX_SQL),
+    ]
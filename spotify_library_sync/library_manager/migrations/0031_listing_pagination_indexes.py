@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:54
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_manager', '0030_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='artist',
+            index=models.Index(django.db.models.functions.text.Lower('name'), models.F('id'), name='artist_lower_name_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['created_at', 'id'], name='library_man_created_2d0284_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_manager', '0031_listing_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='song',
+            name='library_man_created_2d0284_idx',
+        ),
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['spotify_uri'], name='library_man_spotify_4cad7a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['artist', 'downloaded', 'wanted'], name='library_man_artist__4ecff2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='downloadhistory',
+            index=models.Index(fields=['url'], name='library_man_url_d7a3ee_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='downloadhistory',
+            index=models.Index(condition=models.Q(('completed_at__isnull', True)), fields=['added_at'], name='downloadhistory_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='downloadhistory',
+            index=models.Index(condition=models.Q(('completed_at__isnull', False)), fields=['added_at'], name='downloadhistory_done_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['file_path'], name='library_man_file_pa_844898_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['bitrate', 'unavailable', 'created_at', 'id'], name='library_man_bitrate_2f9854_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['downloaded', 'unavailable', 'created_at', 'id'], name='library_man_downloa_bcc71a_idx'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:00
+
+from django.db import migrations, models
+
+# SQLite rebuilds the album and song tables to add the generated columns, which drops the search index triggers
+# added in 0030_search_index, so they are recreated after the rebuild (either way)
+SEARCH_TRIGGERS_SQL = """
+    CREATE TRIGGER IF NOT EXISTS library_manager_album_search_insert AFTER INSERT ON library_manager_album BEGIN
+        INSERT INTO library_manager_search (rowid, name) VALUES ((new.id << 2) | 2, new.name);
+    END;
+    CREATE TRIGGER IF NOT EXISTS library_manager_album_search_update AFTER UPDATE OF name ON library_manager_album BEGIN
+        DELETE FROM library_manager_search WHERE rowid = (old.id << 2) | 2;
+        INSERT INTO library_manager_search (rowid, name) VALUES ((new.id << 2) | 2, new.name);
+    END;
+    CREATE TRIGGER IF NOT EXISTS library_manager_album_search_delete AFTER DELETE ON library_manager_album BEGIN
+        DELETE FROM library_manager_search WHERE rowid = (old.id << 2) | 2;
+    END;
+    CREATE TRIGGER IF NOT EXISTS library_manager_song_search_insert AFTER INSERT ON library_manager_song BEGIN
+        INSERT INTO library_manager_search (rowid, name) VALUES ((new.id << 2) | 3, new.name);
+    END;
+    CREATE TRIGGER IF NOT EXISTS library_manager_song_search_update AFTER UPDATE OF name ON library_manager_song BEGIN
+        DELETE FROM library_manager_search WHERE rowid = (old.id << 2) | 3;
+        INSERT INTO library_manager_search (rowid, name) VALUES ((new.id << 2) | 3, new.name);
+    END;
+    CREATE TRIGGER IF NOT EXISTS library_manager_song_search_delete AFTER DELETE ON library_manager_song BEGIN
+        DELETE FROM library_manager_search WHERE rowid = (old.id << 2) | 3;
+    END;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_manager', '0032_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(migrations.RunSQL.noop, SEARCH_TRIGGERS_SQL),
+        migrations.RemoveIndex(
+            model_name='song',
+            name='library_man_bitrate_2f9854_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='song',
+            name='library_man_downloa_bcc71a_idx',
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='desired',
+            field=models.GeneratedField(db_persist=False, expression=models.Case(models.When(models.Q(('album_type__in', ['single', 'album', 'compilation']), models.Q(('album_group__in', ['appears_on']), _negated=True)), then=models.Value(True)), default=models.Value(False)), output_field=models.BooleanField()),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='state',
+            field=models.GeneratedField(db_persist=False, expression=models.Case(models.When(downloaded=True, then=models.Value(1)), models.When(bitrate__gt=0, then=models.Value(4)), models.When(then=models.Value(3), unavailable=True), models.When(failed_count__gt=0, then=models.Value(2)), default=models.Value(0)), output_field=models.IntegerField(choices=[(0, 'Pending'), (1, 'Downloaded'), (2, 'Failed (retryable)'), (3, 'Unavailable'), (4, 'On disk (unverified)')])),
+        ),
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(condition=models.Q(('desired', True), ('downloaded', False), ('wanted', True)), fields=['artist'], name='album_missing_desired_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['state', 'created_at', 'id'], name='library_man_state_685920_idx'),
+        ),
+        migrations.RunSQL(SEARCH_TRIGGERS_SQL, migrations.RunSQL.noop),
+    ]
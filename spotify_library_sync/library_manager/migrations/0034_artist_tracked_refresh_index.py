@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_manager', '0033_song_state_album_desired'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='artist',
+            name='library_man_tracked_4251e6_idx',
+        ),
+        migrations.AddIndex(
+            model_name='artist',
+            index=models.Index(condition=models.Q(('tracked', True)), fields=['next_refresh_at', 'id'], name='artist_tracked_refresh_idx'),
+        ),
+    ]
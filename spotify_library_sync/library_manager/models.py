@@ -1,6 +1,6 @@
 import django.core.validators
 from django.db import models
-from django.db.models import Sum
+from django.db.models.functions import Lower
 from django_stubs_ext.db.models import TypedModelMeta
 
 from downloader import utils
@@ -16,20 +16,51 @@ class Artist(models.Model):
     tracked = models.BooleanField(default=False)
     added_at = models.DateTimeField(auto_now_add=True)
     last_synced_at = models.DateTimeField(default=None, null=True)
+    # When albums that weren't known before last appeared (initially the latest release date)
+    last_new_album_at = models.DateTimeField(default=None, null=True)
+    # When the albums should next be refreshed, based on how recently the artist released something
+    next_refresh_at = models.DateTimeField(default=None, null=True)
+    # Library stats, kept up to date by `stats.refresh_artist_stats` whenever albums or songs change
+    known_album_count = models.IntegerField(default=0)
+    missing_album_count = models.IntegerField(default=0)
+    downloaded_album_count = models.IntegerField(default=0)
+    missing_track_count = models.IntegerField(default=0)
+    song_count = models.IntegerField(default=0)
+    # Only used to roll up into `LibraryStats`
+    downloaded_track_count = models.IntegerField(default=0)
+    all_downloaded_album_count = models.IntegerField(default=0)
+
+    # Maintained by queryset updates, so saving a (possibly stale) instance must never overwrite them
+    STATS_FIELDS = (
+        'known_album_count',
+        'missing_album_count',
+        'downloaded_album_count',
+        'missing_track_count',
+        'song_count',
+        'downloaded_track_count',
+        'all_downloaded_album_count',
+    )
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.STATS_FIELDS
+            ]
+        super().save(*args, **kwargs)
 
     @property
     def number_songs(self):
-        return ContributingArtist.objects.filter(artist=self).count()
+        return self.song_count
 
     @property
     def albums(self):
-        album_base = Album.objects.filter(artist=self, album_type__in=ALBUM_TYPES_TO_DOWNLOAD).exclude(album_group__in=EXTRA_GROUPS_TO_IGNORE)
         return {
-            'known': album_base.count(),
-            'missing': album_base.filter(wanted=True, downloaded=False).count(),
-            'downloaded': album_base.filter(downloaded=True).count(),
+            'known': self.known_album_count,
+            'missing': self.missing_album_count,
+            'downloaded': self.downloaded_album_count,
             'songs': {
-                'missing': album_base.filter(wanted=True, downloaded=False).aggregate(Sum('total_tracks'))['total_tracks__sum'] or 0,
+                'missing': self.missing_track_count,
             },
         }
 
@@ -37,11 +68,23 @@ class Artist(models.Model):
         indexes = [
             models.Index(fields=['gid',]),
             models.Index(fields=['tracked',]),
+            # Tracked artists due a refresh, partial since SQLite can't use an index for bare boolean terms like `"tracked"`
+            models.Index(fields=['next_refresh_at', 'id',], condition=models.Q(tracked=True), name='artist_tracked_refresh_idx'),
+            # Keyset pagination of the index page
+            models.Index(Lower('name'), 'id', name='artist_lower_name_id_idx'),
         ]
 
     def __str__(self):
         return f"name: {self.name} | gid: {self.gid} | tracked: {self.tracked}"
 
+class SongState(models.IntegerChoices):
+    PENDING = 0, "Pending"
+    DOWNLOADED = 1, "Downloaded"
+    FAILED = 2, "Failed (retryable)"
+    UNAVAILABLE = 3, "Unavailable"
+    # A file with audio was found, but the song isn't marked downloaded yet
+    ON_DISK_UNVERIFIED = 4, "On disk (unverified)"
+
 class Song(models.Model):
     name = models.CharField(max_length=200)
     gid = models.CharField(max_length=120, unique=True)
@@ -52,6 +95,18 @@ class Song(models.Model):
     unavailable = models.BooleanField(default=False)
     file_path = models.FilePathField(null=True)
     downloaded = models.BooleanField(default=False)
+    # Computed by the database from the fields above (so it can never disagree with them), and only stored in its index
+    state = models.GeneratedField(
+        expression=models.Case(
+            models.When(downloaded=True, then=models.Value(SongState.DOWNLOADED)),
+            models.When(bitrate__gt=0, then=models.Value(SongState.ON_DISK_UNVERIFIED)),
+            models.When(unavailable=True, then=models.Value(SongState.UNAVAILABLE)),
+            models.When(failed_count__gt=0, then=models.Value(SongState.FAILED)),
+            default=models.Value(SongState.PENDING),
+        ),
+        output_field=models.IntegerField(choices=SongState.choices),
+        db_persist=False,
+    )
 
     @property
     def contributing_artists(self):
@@ -71,6 +126,9 @@ class Song(models.Model):
     class Meta(TypedModelMeta):
         indexes = [
             models.Index(fields=['gid',]),
+            models.Index(fields=['file_path',]),
+            # Songs in a given state, oldest or newest first (with `id` for keyset pagination)
+            models.Index(fields=['state', 'created_at', 'id',]),
         ]
 
     def __str__(self):
@@ -103,7 +161,12 @@ class DownloadHistory(models.Model):
         return self.progress / 10
 
     class Meta(TypedModelMeta):
-        pass
+        indexes = [
+            models.Index(fields=['url',]),
+            # The download history page lists unfinished and finished downloads separately, newest first
+            models.Index(fields=['added_at',], condition=models.Q(completed_at__isnull=True), name='downloadhistory_pending_idx'),
+            models.Index(fields=['added_at',], condition=models.Q(completed_at__isnull=False), name='downloadhistory_done_idx'),
+        ]
 
 class Album(models.Model):
     spotify_gid = models.CharField(max_length=2048, unique=True)
@@ -116,13 +179,27 @@ class Album(models.Model):
     failed_count = models.IntegerField(default=0)
     album_type = models.CharField(max_length=100, null=True)
     album_group = models.CharField(max_length=100, null=True)
-
-    @property
-    def desired_album_type(self):
-        return self.album_type in ALBUM_TYPES_TO_DOWNLOAD and self.album_group not in EXTRA_GROUPS_TO_IGNORE
+    # Whether the album is one of the types downloaded by default, computed by the database from the type and group
+    desired = models.GeneratedField(
+        expression=models.Case(
+            models.When(
+                models.Q(album_type__in=ALBUM_TYPES_TO_DOWNLOAD) & ~models.Q(album_group__in=EXTRA_GROUPS_TO_IGNORE),
+                then=models.Value(True),
+            ),
+            default=models.Value(False),
+        ),
+        output_field=models.BooleanField(),
+        db_persist=False,
+    )
 
     class Meta(TypedModelMeta):
-        pass
+        indexes = [
+            models.Index(fields=['spotify_uri',]),
+            # An artist's missing/wanted/downloaded albums
+            models.Index(fields=['artist', 'downloaded', 'wanted',]),
+            # Missing desired albums, partial since SQLite can't use an index for bare boolean terms like `"desired"`
+            models.Index(fields=['artist',], condition=models.Q(desired=True, downloaded=False, wanted=True), name='album_missing_desired_idx'),
+        ]
 
 class TrackedPlaylist(models.Model):
     name = models.CharField(max_length=2048)
@@ -130,6 +207,92 @@ class TrackedPlaylist(models.Model):
     enabled = models.BooleanField(default=True)
     auto_track_artists = models.BooleanField(default=False)
     last_synced_at = models.DateTimeField(default=None, null=True)
+    # Spotify changes the snapshot ID whenever the playlist's contents change
+    snapshot_id = models.CharField(max_length=200, default=None, null=True)
 
     class Meta(TypedModelMeta):
         pass
+
+class PlaylistTrack(models.Model):
+    playlist = models.ForeignKey(TrackedPlaylist, on_delete=models.CASCADE, related_name="tracks")
+    song = models.ForeignKey(Song, on_delete=models.CASCADE)
+    # When the track was added to the playlist on Spotify
+    added_at = models.DateTimeField(default=None, null=True)
+
+    class Meta(TypedModelMeta):
+        unique_together = ('playlist', 'song',)
+
+    def __str__(self):
+        return f"P: {self.playlist.name} | S: {self.song.name}"
+
+class LibraryDirectory(models.Model):
+    path = models.CharField(max_length=2048, unique=True)
+    mtime = models.FloatField()
+
+    class Meta(TypedModelMeta):
+        pass
+
+class LibraryFile(models.Model):
+    path = models.CharField(max_length=2048, unique=True)
+    directory = models.CharField(max_length=2048)
+    size = models.BigIntegerField()
+    mtime = models.FloatField()
+    # Not a foreign key, since files may exist for songs that aren't known (yet)
+    song_gid = models.CharField(max_length=120, null=True)
+    # Cached MediaInfo probe result (in kbps) for this exact size and mtime; null until probed
+    bitrate = models.FloatField(default=None, null=True)
+    indexed_at = models.DateTimeField(auto_now=True)
+
+    class Meta(TypedModelMeta):
+        indexes = [
+            models.Index(fields=['directory',]),
+            models.Index(fields=['song_gid',]),
+        ]
+
+    def __str__(self):
+        return f"path: {self.path} | song_gid: {self.song_gid}"
+
+class LibraryStats(models.Model):
+    # Single row snapshot of the library totals for tracked artists, see `stats.refresh_library_stats`
+    num_wanted = models.IntegerField(default=0)
+    sum_num_wanted = models.IntegerField(default=0)
+    num_wanted_downloaded = models.IntegerField(default=0)
+    sum_num_wanted_downloaded = models.IntegerField(default=0)
+    total_downloaded = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def wanted_percent_completed(self) -> float:
+        total = self.sum_num_wanted_downloaded + self.sum_num_wanted
+        return round(self.sum_num_wanted_downloaded / total * 100, 2) if total > 0 else 100
+
+    class Meta(TypedModelMeta):
+        pass
+
+    def __str__(self):
+        return f"num_wanted: {self.num_wanted} | num_wanted_downloaded: {self.num_wanted_downloaded} | updated_at: {self.updated_at}"
+
+class PendingArtistRefresh(models.Model):
+    # Artists whose albums still need fetching (new ones, or every tracked one when requested), drained in batches by `tasks.refresh_pending_artists`,
+    # which `helpers.enqueue_pending_artist_refresh` queues (at most one at a time)
+    artist = models.OneToOneField(Artist, on_delete=models.CASCADE, related_name="pending_refresh")
+    added_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta(TypedModelMeta):
+        pass
+
+    def __str__(self):
+        return f"artist: {self.artist_id} | added_at: {self.added_at}"
+
+class EnqueuedTask(models.Model):
+    # Registry of queued huey tasks that shouldn't be enqueued twice for the same key (ie. artist or playlist)
+    task_name = models.CharField(max_length=200)
+    key = models.CharField(max_length=2048)
+    task_id = models.CharField(max_length=64, unique=True)
+    enqueued_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta(TypedModelMeta):
+        unique_together = ('task_name', 'key',)
+
+    def __str__(self):
+        return f"task_name: {self.task_name} | key: {self.key}"
@@ -0,0 +1,118 @@
+import base64
+import hashlib
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from functools import cached_property
+from typing import Any, Iterator
+
+from django.core.cache import cache
+from django.db.models import Model, Q, QuerySet
+
+# Counts are only shown as totals, so they can be a little stale rather than re-counting on every page load
+COUNT_CACHE_SECONDS = 300
+
+@dataclass
+class KeysetPage:
+    object_list: list[Model]
+    next_cursor: str | None
+    previous_cursor: str | None
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self) -> bool:
+        return self.previous_cursor is not None
+
+    def __iter__(self) -> Iterator[Model]:
+        return iter(self.object_list)
+
+    def __len__(self) -> int:
+        return len(self.object_list)
+
+class KeysetPaginator:
+    """Paginate by seeking past the last row seen instead of using OFFSET, so every page costs the same as the first
+
+    Args:
+        queryset (QuerySet): the rows to paginate, every field in `ordering` must be on the model or annotated
+        per_page (int): the number of rows per page
+        ordering (list[str]): unique ordering (ie. ending with `id`), ideally matching an index, prefix with "-" for descending
+    """
+    def __init__(self, queryset: QuerySet, per_page: int, ordering: list[str]):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = ordering
+
+    @cached_property
+    def count(self) -> int:
+        if self.queryset.query.is_empty():
+            # ie. `.none()`, which has no SQL to hash
+            return 0
+        # Exact counts are a full scan of the filtered rows, so cache them per query
+        query_hash = hashlib.sha1(str(self.queryset.order_by().query).encode()).hexdigest()
+        return cache.get_or_set(f"keyset_count_{query_hash}", self.queryset.order_by().count, COUNT_CACHE_SECONDS)
+
+    def get_page(self, cursor: str | None) -> KeysetPage:
+        """Get the page the cursor points at, or the first page if it is missing or invalid"""
+        direction, values = self._decode_cursor(cursor)
+        backwards = direction == 'previous'
+
+        ordering = [self._reverse(field) for field in self.ordering] if backwards else self.ordering
+        queryset = self.queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self._after(ordering, values))
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+
+        next_cursor = None
+        previous_cursor = None
+        if len(rows) > 0:
+            if has_more or backwards:
+                next_cursor = self._encode_cursor('next', rows[-1])
+            if (has_more and backwards) or (not backwards and values is not None):
+                previous_cursor = self._encode_cursor('previous', rows[0])
+        return KeysetPage(rows, next_cursor, previous_cursor)
+
+    @staticmethod
+    def _reverse(field: str) -> str:
+        return field[1:] if field.startswith('-') else f"-{field}"
+
+    @staticmethod
+    def _after(ordering: list[str], values: list[Any]) -> Q:
+        # (a, b, c) > (x, y, z) expanded to: a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+        # with a leading a >= x so the database can seek into the index instead of scanning it
+        after = Q()
+        equal_prefix: dict[str, Any] = {}
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            after |= Q(**equal_prefix, **{f"{name}__{lookup}": value})
+            equal_prefix[name] = value
+        first_field = ordering[0]
+        first_lookup = 'lte' if first_field.startswith('-') else 'gte'
+        return Q(**{f"{first_field.lstrip('-')}__{first_lookup}": values[0]}) & after
+
+    def _encode_cursor(self, direction: str, row: Model) -> str:
+        values = [getattr(row, field.lstrip('-')) for field in self.ordering]
+        # Full precision isoformat, the database compares the parsed datetime so it must round-trip exactly
+        raw_cursor = json.dumps({'d': direction, 'v': values}, default=lambda value: value.isoformat() if isinstance(value, datetime) else str(value))
+        return base64.urlsafe_b64encode(raw_cursor.encode()).decode()
+
+    def _decode_cursor(self, cursor: str | None) -> tuple[str, list[Any] | None]:
+        if not cursor:
+            return 'next', None
+        try:
+            raw_cursor = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            direction = raw_cursor['d']
+            values = raw_cursor['v']
+        except (ValueError, TypeError, KeyError):
+            return 'next', None
+        if direction not in ('next', 'previous') or not isinstance(values, list) or len(values) != len(self.ordering):
+            return 'next', None
+        return direction, values
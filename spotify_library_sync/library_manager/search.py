@@ -0,0 +1,69 @@
+import re
+
+from django.db import connection
+from django.db.models import Model
+from django.db.models.expressions import RawSQL
+
+from .models import Album, Artist, Song
+
+# Entity type stored in the low two bits of each `library_manager_search` rowid (the id is in the rest)
+ENTITY_TYPES: dict[int, type[Model]] = {
+    1: Artist,
+    2: Album,
+    3: Song,
+}
+ENTITY_TYPE_CODES = {model: code for code, model in ENTITY_TYPES.items()}
+
+def build_match_query(search_term: str) -> str | None:
+    """Turn free text into an FTS5 query matching every word, with the last one as a prefix so results appear while typing"""
+    tokens = re.findall(r"\w+", search_term)
+    if len(tokens) == 0:
+        return None
+    return " ".join(f'"{token}"' for token in tokens[:-1]) + f' "{tokens[-1]}"*'
+
+def matching_ids(model: type[Model], search_term: str) -> RawSQL | None:
+    """A subquery of the ids of `model` whose name matches, for use in `.filter(id__in=...)`"""
+    match_query = build_match_query(search_term)
+    if match_query is None:
+        return None
+    return RawSQL(
+        "SELECT rowid >> 2 FROM library_manager_search WHERE library_manager_search MATCH %s AND (rowid & 3) = %s",
+        (match_query, ENTITY_TYPE_CODES[model]),
+    )
+
+def search_library(search_term: str, limit: int = 50) -> list[tuple[str, Model]]:
+    """Search artist, album and song names, best matches first
+
+    Returns:
+        list[tuple[str, Model]]: the entity type ("artist", "album" or "song") and instance of each result
+    """
+    match_query = build_match_query(search_term)
+    if match_query is None:
+        return []
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT rowid FROM library_manager_search WHERE library_manager_search MATCH %s ORDER BY rank LIMIT %s",
+            (match_query, limit),
+        )
+        rowids = [row[0] for row in cursor.fetchall()]
+
+    ids_by_type: dict[int, list[int]] = {}
+    for rowid in rowids:
+        ids_by_type.setdefault(rowid & 3, []).append(rowid >> 2)
+
+    instances: dict[tuple[int, int], Model] = {}
+    for entity_type, ids in ids_by_type.items():
+        queryset = ENTITY_TYPES[entity_type].objects
+        if entity_type == ENTITY_TYPE_CODES[Album]:
+            queryset = queryset.select_related('artist')
+        elif entity_type == ENTITY_TYPE_CODES[Song]:
+            queryset = queryset.select_related('primary_artist')
+        for instance_id, instance in queryset.in_bulk(ids).items():
+            instances[(entity_type, instance_id)] = instance
+
+    return [
+        (ENTITY_TYPES[rowid & 3]._meta.model_name, instances[(rowid & 3, rowid >> 2)])
+        for rowid in rowids
+        if (rowid & 3, rowid >> 2) in instances
+    ]
@@ -1,11 +1,23 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
-from library_manager.models import Artist
-from library_manager import tasks
+from library_manager.models import Album, Artist, ContributingArtist, PendingArtistRefresh
+from library_manager import helpers, stats
 
 @receiver(post_save, sender=Artist)
 def artist_save(sender, instance: Artist, created: bool, **kwargs):
-    # If it's a new artist, let's fetch all their albums
+    # If it's a new artist, let's fetch all their albums (along with any other new artists)
     if created:
-        tasks.fetch_all_albums_for_artist(instance.id)
+        PendingArtistRefresh.objects.get_or_create(artist=instance)
+        helpers.enqueue_pending_artist_refresh()
+
+@receiver(post_save, sender=Album)
+@receiver(post_delete, sender=Album)
+def album_changed(sender, instance: Album, **kwargs):
+    # Only the artist's own row, the library totals are rolled up once per batch by whatever changed the albums
+    stats.refresh_artist_stats(Artist.objects.filter(gid=instance.artist_id))
+
+@receiver(post_save, sender=ContributingArtist)
+@receiver(post_delete, sender=ContributingArtist)
+def contributing_artist_changed(sender, instance: ContributingArtist, **kwargs):
+    stats.refresh_artist_stats(Artist.objects.filter(id=instance.artist_id))
@@ -0,0 +1,51 @@
+from django.db.models import Count, IntegerField, OuterRef, QuerySet, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import Album, Artist, ContributingArtist, LibraryStats
+
+def _per_artist_total(queryset: QuerySet, artist_field: str, aggregate=None) -> Coalesce:
+    per_artist = queryset.order_by().values(artist_field).annotate(value=aggregate or Count('id')).values('value')
+    return Coalesce(Subquery(per_artist, output_field=IntegerField()), Value(0))
+
+def refresh_artist_stats(artists: QuerySet[Artist] | None = None) -> int:
+    """Recompute the stored album and song counts of `artists` (or every artist) in a single statement
+
+    Returns:
+        int: the number of artists updated
+    """
+    if artists is None:
+        artists = Artist.objects.all()
+
+    desired_albums = Album.objects.filter(artist=OuterRef('gid'), desired=True)
+    missing_albums = desired_albums.filter(wanted=True, downloaded=False)
+
+    return artists.update(
+        known_album_count=_per_artist_total(desired_albums, 'artist'),
+        missing_album_count=_per_artist_total(missing_albums, 'artist'),
+        downloaded_album_count=_per_artist_total(desired_albums.filter(downloaded=True), 'artist'),
+        missing_track_count=_per_artist_total(missing_albums, 'artist', Sum('total_tracks')),
+        song_count=_per_artist_total(ContributingArtist.objects.filter(artist=OuterRef('pk')), 'artist'),
+        downloaded_track_count=_per_artist_total(desired_albums.filter(downloaded=True), 'artist', Sum('total_tracks')),
+        all_downloaded_album_count=_per_artist_total(Album.objects.filter(artist=OuterRef('gid'), downloaded=True), 'artist'),
+    )
+
+def refresh_library_stats() -> LibraryStats:
+    """Roll the per-artist stats up into the `LibraryStats` snapshot
+
+    This only reads the artist table, so it is cheap enough to run whenever downloads or album syncs finish.
+    """
+    tracked_artists = Artist.objects.filter(tracked=True).aggregate(
+        num_wanted=Coalesce(Sum('missing_album_count'), 0),
+        sum_num_wanted=Coalesce(Sum('missing_track_count'), 0),
+        num_wanted_downloaded=Coalesce(Sum('downloaded_album_count'), 0),
+        sum_num_wanted_downloaded=Coalesce(Sum('downloaded_track_count'), 0),
+    )
+    total_downloaded = Artist.objects.aggregate(total_downloaded=Coalesce(Sum('all_downloaded_album_count'), 0))
+    library_stats, _ = LibraryStats.objects.update_or_create(id=1, defaults={**tracked_artists, **total_downloaded})
+    return library_stats
+
+def get_library_stats() -> LibraryStats:
+    library_stats = LibraryStats.objects.filter(id=1).first()
+    if library_stats is None:
+        library_stats = refresh_library_stats()
+    return library_stats
@@ -1,25 +1,74 @@
-import time
+from contextlib import contextmanager
+from typing import Iterator
 
 from django.conf import settings
 
-from .models import Album, Artist, DownloadHistory, Song, TrackedPlaylist, ALBUM_TYPES_TO_DOWNLOAD, EXTRA_GROUPS_TO_IGNORE
-from . import helpers
+from .models import Album, Artist, EnqueuedTask, PendingArtistRefresh, Song, SongState, TrackedPlaylist, EXTRA_GROUPS_TO_IGNORE
+from . import helpers, stats
+from downloader.audio_probe import AudioProber
+from downloader.discography import DiscographyRefresher
+from downloader.library_indexer import LibraryIndexer
+from downloader.metrics import default_metrics
+from downloader.rate_limiter import RateLimited, default_rate_limiter
 from downloader.utils import sanitize_and_strip_url
 from downloader.spotdl_wrapper import SpotdlWrapper
 from downloader.spotipy_tasks import track_artists_in_playlist
 from lib.config_class import Config
 
 from huey import crontab
+from huey import signals as huey_signals
 import huey.contrib.djhuey as huey
 from huey.api import Task
+from huey.exceptions import RetryTask
 from huey_monitor.tqdm import ProcessInfo
 
 from django.db.models.functions import Now
-from django.utils import timezone
 
 spotdl_wrapper = SpotdlWrapper(Config())
+discography_refresher = DiscographyRefresher(spotdl_wrapper.downloader, max_concurrency=settings.discography_refresh_concurrency)
+
+# Number of new artists to fetch albums for per `refresh_pending_artists` run
+PENDING_ARTIST_REFRESH_BATCH_SIZE = 100
+
+@huey.signal(huey_signals.SIGNAL_COMPLETE, huey_signals.SIGNAL_ERROR, huey_signals.SIGNAL_CANCELED, huey_signals.SIGNAL_REVOKED, huey_signals.SIGNAL_EXPIRED)
+def release_enqueued_task(signal, task, exc=None):
+    # A task that errored but still has retries left is put back on the queue, so it stays registered
+    if signal == huey_signals.SIGNAL_ERROR and task.retries:
+        return
+    EnqueuedTask.objects.filter(task_id=task.id).delete()
+
+@huey.post_execute()
+def flush_metrics(task, task_value, exc):
+    # Make each task's samples visible at /metrics once it finishes, rather than after the next flush interval
+    default_metrics().flush()
+
+@huey.on_shutdown()
+def flush_metrics_on_shutdown():
+    # Samples recorded since the last flush would otherwise be lost when the worker exits
+    default_metrics().flush()
+
+def reschedule_if_rate_limited(upstream: str):
+    # Hand the worker back and retry once the budget has refilled, rather than sleeping in the worker
+    wait = default_rate_limiter().time_until_available(upstream)
+    if wait > 0:
+        raise RetryTask(f"Waiting {round(wait)}s for the {upstream} rate limit", delay=wait)
+
+def raise_if_rate_limited(failures: dict[int, Exception]):
+    # For work that collects its failures rather than raising them (ie. `DiscographyRefresher.refresh`)
+    rate_limited = next((exception for exception in failures.values() if isinstance(exception, RateLimited)), None)
+    if rate_limited is not None:
+        raise rate_limited
+
+@contextmanager
+def reschedule_when_rate_limited() -> Iterator[None]:
+    # Work that runs out of budget part way through stops where it is, and is retried once the budget has refilled
+    try:
+        yield
+    except RateLimited as exception:
+        raise RetryTask(str(exception), delay=exception.wait) from exception
 
 @huey.task(context=True, priority=3)
+@reschedule_when_rate_limited()
 def fetch_all_albums_for_artist(artist_id: int, task: Task = None):
     artist = Artist.objects.get(id=artist_id)
     downloader_config = Config()
@@ -30,13 +79,49 @@ def fetch_all_albums_for_artist(artist_id: int, task: Task = None):
         downloader_config.process_info = process_info
     spotdl_wrapper.execute(downloader_config)
 
+@huey.periodic_task(crontab(minute='*/15'), priority=3)
+def queue_pending_artist_refresh():
+    # Picks up artists added without a `post_save` (ie. bulk imports), through the same registration as the signal
+    # so the pending set is never drained by two tasks at once
+    if PendingArtistRefresh.objects.exists():
+        helpers.enqueue_pending_artist_refresh()
+
+@huey.task(priority=3, context=True)
+@reschedule_when_rate_limited()
+def refresh_pending_artists(task: Task = None):
+    # New artists are collected into a pending set (including by bulk imports, which never fire `post_save`),
+    # so one task fetches albums for batches of them rather than a task per artist. `helpers.refresh_all_tracked_artists` adds to it too
+    pending_artist_count = PendingArtistRefresh.objects.count()
+    if pending_artist_count == 0:
+        return
+
+    print(f"Fetching albums for {pending_artist_count} pending artist(s)")
+    process_info = ProcessInfo(task, desc='pending artist album fetch', total=pending_artist_count) if task is not None else None
+    # Artists that failed stay pending for the next run, but aren't retried by this one
+    failed_artist_ids: set[int] = set()
+    # Keep draining, since artists added while this runs can't enqueue another refresh until it's finished
+    while pending_artist_ids := list(
+        PendingArtistRefresh.objects.exclude(artist_id__in=failed_artist_ids).order_by('added_at', 'id').values_list('artist_id', flat=True)[:PENDING_ARTIST_REFRESH_BATCH_SIZE]
+    ):
+        reschedule_if_rate_limited('spotify')
+        failures: dict[int, Exception] = {}
+        discography_refresher.refresh(list(Artist.objects.filter(id__in=pending_artist_ids)), failures=failures)
+        PendingArtistRefresh.objects.filter(artist_id__in=pending_artist_ids).exclude(artist_id__in=failures.keys()).delete()
+        failed_artist_ids.update(failures.keys())
+        if process_info is not None:
+            process_info.update(n=len(pending_artist_ids))
+
+        # The rest of the batch would only run into the same limit, so stop and pick up where this left off once it has refilled
+        raise_if_rate_limited(failures)
+
 @huey.task(context=True, priority=1, retries=2, retry_delay=30)
+@reschedule_when_rate_limited()
 def download_missing_albums_for_artist(artist_id: int, task: Task = None, delay: int = 0):
-    # Add delay (if applicable) to reduce chance of flagging when backfilling library
-    time.sleep(delay)
+    # `delay` is no longer used (the download budget is enforced instead), but tasks enqueued by older versions still pass it
+    reschedule_if_rate_limited('audio_download')
 
     artist = Artist.objects.get(id=artist_id)
-    missing_albums = Album.objects.filter(artist=artist, downloaded=False, wanted=True, album_type__in=ALBUM_TYPES_TO_DOWNLOAD).exclude(album_group__in=EXTRA_GROUPS_TO_IGNORE)
+    missing_albums = Album.objects.filter(artist=artist, desired=True, downloaded=False, wanted=True)
     print(f"missing albums search for artist {artist.id} found {missing_albums.count()}")
     downloader_config = Config()
     if task is not None:
@@ -59,7 +144,9 @@ def sync_tracked_playlist(tracked_playlist: TrackedPlaylist, task: Task = None):
     helpers.enqueue_playlists([tracked_playlist], priority=task.priority)
 
 @huey.task(context=True, priority=2, retries=2, retry_delay=30)
+@reschedule_when_rate_limited()
 def download_playlist(playlist_url: str, tracked: bool = True, force_playlist_resync: bool = False, task: Task = None):
+    reschedule_if_rate_limited('audio_download')
     playlist_url = sanitize_and_strip_url(playlist_url)
 
     downloader_config = Config(
@@ -74,13 +161,15 @@ def download_playlist(playlist_url: str, tracked: bool = True, force_playlist_re
     spotdl_wrapper.execute(downloader_config)
 
 @huey.task(context=True, priority=0, retries=2, retry_delay=30)
+@reschedule_when_rate_limited()
 def retry_all_missing_known_songs(task: Task = None):
-    missing_known_songs_list = Song.objects.filter(bitrate=0,unavailable=False).order_by("created_at").select_related('primary_artist').filter(primary_artist__tracked=True)[:100]
-    failed_known_songs_list = Song.objects.filter(failed_count__gt=0,bitrate=0,unavailable=False).order_by("created_at")[:100]
+    reschedule_if_rate_limited('audio_download')
+    missing_known_songs_list = Song.objects.filter(state=SongState.PENDING, primary_artist__tracked=True).order_by("created_at")[:100]
+    failed_known_songs_list = Song.objects.filter(state=SongState.FAILED).order_by("created_at")[:100]
     # Combine results for iterating
-    missing_known_songs_list = missing_known_songs_list | failed_known_songs_list
+    missing_known_songs_list = list(missing_known_songs_list) + list(failed_known_songs_list)
 
-    if missing_known_songs_list.count() == 0:
+    if len(missing_known_songs_list) == 0:
         print("All songs downloaded, exiting missing known song loop!")
         return
 
@@ -97,11 +186,13 @@ def retry_all_missing_known_songs(task: Task = None):
         downloader_config.process_info = process_info
     spotdl_wrapper.execute(downloader_config)
 
-    # Queue up next batch after ensuring rate limit has passed
-    retry_all_missing_known_songs.schedule(delay=30)
+    # Queue up next batch for once the download budget allows it
+    retry_all_missing_known_songs.schedule(delay=default_rate_limiter().time_until_available('audio_download'))
 
 @huey.task(context=True, priority=3, retries=2, retry_delay=30)
+@reschedule_when_rate_limited()
 def download_extra_album_types_for_artist(artist_id: int, task: Task = None):
+    reschedule_if_rate_limited('audio_download')
     artist = Artist.objects.get(id=artist_id)
     missing_albums = Album.objects.filter(artist=artist, downloaded=False, wanted=True, album_group__in=EXTRA_GROUPS_TO_IGNORE)
     print(f"extra album missing albums search for artist {artist.id} found {missing_albums.count()}")
@@ -122,35 +213,38 @@ def download_extra_album_types_for_artist(artist_id: int, task: Task = None):
     artist.save()
 
 @huey.task(context=True, priority=3)
+@reschedule_when_rate_limited()
 def sync_tracked_playlist_artists(playlist: TrackedPlaylist, task: Task = None):
     # Given a playlist, track the artists without actually downloading the playlist (potentially, again)
     track_artists_in_playlist(playlist.url, task)
 
-@huey.periodic_task(crontab(minute='0', hour='*/8'), priority=1, context=True)
+@huey.periodic_task(crontab(minute='0'), priority=1, context=True)
+@reschedule_when_rate_limited()
 def update_tracked_artists(task: Task = None):
-    all_tracked_artists = Artist.objects.filter(tracked=True).order_by("last_synced_at", "added_at", "id")
-    existing_tasks = helpers.get_all_tasks_with_name('fetch_all_albums_for_artist')
-    already_enqueued_artists = helpers.convert_first_task_args_to_list(existing_tasks)
-    helpers.update_tracked_artists_albums(already_enqueued_artists, all_tracked_artists, priority=task.priority)
-
-# Severely throttling automatic playlist download for tracked artists for the time being;
-# There is a high likelyhood of being flagged due to high usage at the moment and a new scalable solution needs to be investigated.
+    reschedule_if_rate_limited('spotify')
+    # Only artists that are due (based on how recently they released something) are refreshed, up to the cycle's budget
+    due_artists = discography_refresher.due_artists(settings.artist_refresh_request_budget)
+    print(f"Refreshing albums for {len(due_artists)} tracked artist(s) that are due")
+    failures: dict[int, Exception] = {}
+    discography_refresher.refresh(due_artists, failures=failures)
+    # The artists that ran into the limit are still due, so pick them up once it has refilled
+    raise_if_rate_limited(failures)
+
+# Automatic downloads for tracked artists are held back whenever the shared download budget is used up,
+# since there is a high likelyhood of being flagged due to high usage
 @huey.periodic_task(crontab(minute='45', hour='*/8'), priority=0, context=True)
 def download_missing_tracked_artists(task: Task = None):
     if settings.disable_missing_tracked_artist_download:
         print(f"Skipping queued missing tracked artists due to disable_missing_tracked_artist_download setting")
         return
     
-    twelve_hours_ago = timezone.now() - timezone.timedelta(hours=12)
-    recently_downloaded_songs = DownloadHistory.objects.filter(added_at__gte=twelve_hours_ago)
-    if (recently_downloaded_songs.count() > 250):
-        print(f"Skipping queued missing tracked artists due to quantity of recent downloads ({recently_downloaded_songs.count()})")
+    download_budget_wait = default_rate_limiter().time_until_available('audio_download')
+    if (download_budget_wait > 0):
+        print(f"Skipping queued missing tracked artists since the download budget is used up (refills in {round(download_budget_wait)}s)")
         return
     # Limit to only desired album types (ignoring `appears_on`), and limit results so this won't throttle
-    all_tracked_artists = Artist.objects.filter(tracked=True, album__downloaded=False, album__wanted=True, album__album_type__in=ALBUM_TYPES_TO_DOWNLOAD).exclude(album__album_group__in=EXTRA_GROUPS_TO_IGNORE).distinct().order_by("last_synced_at", "added_at", "id")[:150]
-    existing_tasks = helpers.get_all_tasks_with_name('download_missing_albums_for_artist')
-    already_enqueued_artists = helpers.convert_first_task_args_to_list(existing_tasks)
-    helpers.download_missing_tracked_artists(already_enqueued_artists, all_tracked_artists, priority=task.priority)
+    all_tracked_artists = Artist.objects.filter(tracked=True, album__desired=True, album__downloaded=False, album__wanted=True).distinct().order_by("last_synced_at", "added_at", "id")[:150]
+    helpers.download_missing_tracked_artists(all_tracked_artists, priority=task.priority)
 
 @huey.periodic_task(crontab(minute='0', hour='*/4'), priority=1, context=True)
 def sync_tracked_playlists(task: Task = None):
@@ -161,15 +255,37 @@ def sync_tracked_playlists(task: Task = None):
 def cleanup_huey_history():
     helpers.cleanup_huey_history()
 
+@huey.periodic_task(crontab(minute='15', hour='6'), priority=1)
+def recompute_library_stats():
+    # The stats are kept up to date as things change, this catches anything that changed behind their back (ie. the admin or shell)
+    stats.refresh_artist_stats()
+    stats.refresh_library_stats()
+
+@huey.periodic_task(crontab(minute='30', hour='5'), priority=1)
+def index_library(full: bool = False):
+    library_indexer = LibraryIndexer()
+    library_indexer.scan(full=full)
+    library_indexer.probe_missing_bitrates(AudioProber())
+    library_indexer.reconcile()
+
 @huey.task(context=True, priority=0, retries=2, retry_delay=30)
-def validate_undownloaded_songs(task: Task = None, ):
-    non_downloaded_songs_that_should_exist = Song.objects.filter(bitrate__gt=0,unavailable=False,downloaded=False).order_by("created_at")[:50]
-    non_downloaded_songs_that_maybe_should_exist = Song.objects.filter(bitrate__gt=0,unavailable=True,downloaded=False).order_by("created_at")[:50]
+@reschedule_when_rate_limited()
+def validate_undownloaded_songs(task: Task = None, reindex: bool = True):
+    reschedule_if_rate_limited('audio_download')
+    # Most "undownloaded" songs are already on disk, so reconcile against the library index before re-downloading anything
+    if reindex:
+        try:
+            index_library.call_local()
+        except FileNotFoundError as exception:
+            print(f"Skipping library reconciliation: {exception}")
+
+    non_downloaded_songs_that_should_exist = list(Song.objects.filter(state=SongState.ON_DISK_UNVERIFIED, unavailable=False).order_by("created_at")[:50])
+    non_downloaded_songs_that_maybe_should_exist = list(Song.objects.filter(state=SongState.ON_DISK_UNVERIFIED, unavailable=True).order_by("created_at")[:50])
 
-    non_downloaded_songs = non_downloaded_songs_that_should_exist | non_downloaded_songs_that_maybe_should_exist
+    non_downloaded_songs = non_downloaded_songs_that_should_exist + non_downloaded_songs_that_maybe_should_exist
 
-    non_downloaded_songs_count = non_downloaded_songs.count()
-    non_downloaded_songs_that_should_exist_count = non_downloaded_songs_that_should_exist.count()
+    non_downloaded_songs_count = len(non_downloaded_songs)
+    non_downloaded_songs_that_should_exist_count = len(non_downloaded_songs_that_should_exist)
 
     # No songs to attempt
     if non_downloaded_songs_count == 0:
@@ -193,5 +309,5 @@ def validate_undownloaded_songs(task: Task = None, ):
     if non_downloaded_songs_that_should_exist_count == 0:
         print("All songs marked downloaded that should be!")
         return
-    # Queue up next batch after ensuring rate limit has passed
-    validate_undownloaded_songs()
\ No newline at end of file
+    # Queue up next batch for once the download budget allows it
+    validate_undownloaded_songs.schedule(kwargs={'reindex': False}, delay=default_rate_limiter().time_until_available('audio_download'))
\ No newline at end of file
@@ -1,3 +1,900 @@
-from django.test import TestCase
+import base64
+import html
+import json
+import os
+import re
+import tempfile
+from unittest.mock import patch
+from urllib.parse import quote
 
-# Create your tests here.
+from django.db import connection
+from django.db.models import Q, QuerySet
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+from huey.exceptions import RetryTask
+from spotdl.types.song import SongError
+
+from downloader import utils
+from downloader.discography import MIN_REFRESH_INTERVAL, DiscographyRefresher
+from downloader.downloader import Downloader
+from downloader.fakes import FakeAudioDownloader, FakeSpotdl, FakeSpotifyCatalog, FakeSpotifyClient, m4a_bytes
+from downloader.library_indexer import LibraryIndexer
+from downloader.metrics import MetricsStore
+from downloader.rate_limiter import RateLimited, RateLimiter
+from downloader.spotdl_songs import song_from_metadata
+from downloader.spotdl_wrapper import SpotdlWrapper
+from downloader.spotify_cache import SpotifyResponseCache
+from lib.config_class import Config
+from .pagination import KeysetPaginator
+from . import helpers, stats, tasks
+from .models import ALBUM_TYPES_TO_DOWNLOAD, Album, Artist, DownloadHistory, EnqueuedTask, LibraryFile, LibraryStats, PendingArtistRefresh, PlaylistTrack, Song, SongState, TrackedPlaylist, EXTRA_GROUPS_TO_IGNORE
+
+def use_memory_metrics(test_case: SimpleTestCase) -> MetricsStore:
+    """Record the pipeline metrics into an in-memory store for the rest of the test, rather than the configured one"""
+    metrics_store = MetricsStore(":memory:")
+    # `time_stage` looks the store up in its own module, the rest import the accessor by name
+    for target in ('downloader.metrics', 'downloader.spotdl_wrapper', 'downloader.spotdl_override'):
+        metrics_patch = patch(f'{target}.default_metrics', return_value=metrics_store)
+        metrics_patch.start()
+        test_case.addCleanup(metrics_patch.stop)
+    return metrics_store
+
+# Querysets here mirror the ones in tasks.py, views.py and stats.py, keep them in sync when those change
+class HotQueryPlanTests(TestCase):
+    """Make sure the hot library queries are answered from an index rather than a full table scan"""
+
+    @classmethod
+    def setUpTestData(cls):
+        artists = Artist.objects.bulk_create([
+            Artist(name=f"Artist {i}", gid=f"artist{i}", tracked=i % 2 == 0)
+            for i in range(20)
+        ])
+        cls.artist = artists[0]
+        Album.objects.bulk_create([
+            Album(
+                spotify_gid=f"album{i}",
+                spotify_uri=f"spotify:album:album{i}",
+                artist=artists[i % len(artists)],
+                name=f"Album {i}",
+                total_tracks=10,
+                downloaded=i % 3 == 0,
+                wanted=i % 5 != 0,
+                album_type=["album", "single", "compilation", "appears_on"][i % 4],
+                album_group=["album", "single", "appears_on"][i % 3],
+            )
+            for i in range(200)
+        ])
+        Song.objects.bulk_create([
+            Song(
+                name=f"Song {i}",
+                gid=f"song{i}",
+                primary_artist=artists[i % len(artists)],
+                bitrate=0 if i % 4 == 0 else 320,
+                unavailable=i % 7 == 0,
+                downloaded=i % 4 != 0 and i % 6 != 0,
+                failed_count=i % 5,
+                file_path=f"/music/song{i}.mp3",
+            )
+            for i in range(500)
+        ])
+        now = timezone.now()
+        DownloadHistory.objects.bulk_create([
+            DownloadHistory(url=f"https://open.spotify.com/album/album{i}", completed_at=None if i % 10 == 0 else now)
+            for i in range(200)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def assertNoFullTableScan(self, queryset: QuerySet):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            plan = [row[3] for row in cursor.fetchall()]
+        # "SCAN <table>" without "USING ... INDEX" reads every row of the table
+        full_scans = [detail for detail in plan if re.match(r"SCAN \w+$", detail)]
+        self.assertEqual(full_scans, [], f"Full table scan in plan {plan} for {sql}")
+
+    def test_missing_albums_for_artist(self):
+        self.assertNoFullTableScan(
+            Album.objects.filter(artist=self.artist, desired=True, downloaded=False, wanted=True)
+        )
+        self.assertNoFullTableScan(
+            Album.objects.filter(artist=self.artist, downloaded=False, wanted=True, album_group__in=EXTRA_GROUPS_TO_IGNORE)
+        )
+
+    def test_artist_albums_page(self):
+        self.assertNoFullTableScan(Album.objects.filter(artist=self.artist, downloaded=False, wanted=True))
+        self.assertNoFullTableScan(Album.objects.filter(artist=self.artist, downloaded=False, wanted=False))
+        self.assertNoFullTableScan(Album.objects.filter(artist=self.artist, downloaded=True))
+
+    def test_album_by_uri(self):
+        self.assertNoFullTableScan(Album.objects.filter(spotify_uri="spotify:album:album1"))
+
+    def test_artist_stats(self):
+        # Run as a correlated subquery per artist by `stats.refresh_artist_stats`
+        desired_albums = Album.objects.filter(artist=self.artist, desired=True)
+        self.assertNoFullTableScan(desired_albums)
+        self.assertNoFullTableScan(desired_albums.filter(wanted=True, downloaded=False))
+
+    def test_tracked_artists_with_missing_albums(self):
+        self.assertNoFullTableScan(
+            Artist.objects.filter(tracked=True, album__desired=True, album__downloaded=False, album__wanted=True).distinct().order_by("last_synced_at", "added_at", "id")[:150]
+        )
+
+    def test_retry_missing_known_songs(self):
+        self.assertNoFullTableScan(Song.objects.filter(state=SongState.PENDING, primary_artist__tracked=True).order_by("created_at")[:100])
+        self.assertNoFullTableScan(Song.objects.filter(state=SongState.FAILED).order_by("created_at")[:100])
+
+    def test_validate_undownloaded_songs(self):
+        self.assertNoFullTableScan(Song.objects.filter(state=SongState.ON_DISK_UNVERIFIED, unavailable=False).order_by("created_at")[:50])
+        self.assertNoFullTableScan(Song.objects.filter(state=SongState.ON_DISK_UNVERIFIED, unavailable=True).order_by("created_at")[:50])
+
+    def test_missing_song_views(self):
+        missing_known_songs_list = Song.objects.filter(
+            Q(state=SongState.PENDING, primary_artist__tracked=True) | Q(state=SongState.FAILED),
+        ).select_related('primary_artist')
+        self.assertNoFullTableScan(missing_known_songs_list.order_by("-created_at", "-id")[:26])
+        # A later page, seeking past the last row of the previous one
+        self.assertNoFullTableScan(
+            missing_known_songs_list.filter(KeysetPaginator._after(["-created_at", "-id"], [timezone.now(), 100])).order_by("-created_at", "-id")[:26]
+        )
+        self.assertNoFullTableScan(Song.objects.filter(state=SongState.UNAVAILABLE).order_by("-created_at", "-id")[:26])
+        self.assertNoFullTableScan(Song.objects.filter(state=SongState.ON_DISK_UNVERIFIED, unavailable=False).order_by("-created_at", "-id")[:26])
+
+    def test_due_artists(self):
+        self.assertNoFullTableScan(
+            Artist.objects.filter(Q(next_refresh_at=None) | Q(next_refresh_at__lte=timezone.now()), tracked=True).order_by('next_refresh_at', 'id')
+        )
+
+    def test_song_by_file_path(self):
+        self.assertNoFullTableScan(Song.objects.filter(file_path="/music/song1.mp3"))
+
+    def test_download_history(self):
+        self.assertNoFullTableScan(DownloadHistory.objects.filter(completed_at=None).order_by("-added_at"))
+        self.assertNoFullTableScan(DownloadHistory.objects.filter(completed_at__isnull=False).order_by("-added_at")[:50])
+        self.assertNoFullTableScan(DownloadHistory.objects.filter(url="https://open.spotify.com/album/album1", completed_at=None))
+
+class GeneratedFieldTests(TestCase):
+    """`Song.state` and `Album.desired` are computed by the database, and must agree with the fields they're computed from"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.artist = Artist.objects.bulk_create([Artist(name="Artist", gid="generatedartist")])[0]
+        cls.song = Song.objects.bulk_create([Song(name="Song", gid=f"{2000:032x}", primary_artist=cls.artist)])[0]
+        cls.album = Album.objects.bulk_create([Album(spotify_gid="generatedalbum", artist=cls.artist, name="Album", total_tracks=1)])[0]
+
+    def assertSongState(self, expected_state: SongState, **fields):
+        Song.objects.filter(id=self.song.id).update(**fields)
+        self.assertEqual(Song.objects.get(id=self.song.id).state, expected_state)
+        # The same expression is used when filtering, which is what the state index is for
+        self.assertTrue(Song.objects.filter(id=self.song.id, state=expected_state).exists())
+
+    def assertDesired(self, expected_desired: bool, **fields):
+        Album.objects.filter(id=self.album.id).update(**fields)
+        self.assertEqual(Album.objects.get(id=self.album.id).desired, expected_desired)
+        self.assertTrue(Album.objects.filter(id=self.album.id, desired=expected_desired).exists())
+
+    def test_song_state_precedence(self):
+        # Each field only matters when none of the ones before it apply: downloaded > bitrate > unavailable > failed > pending
+        for expected_state, fields in [
+            (SongState.DOWNLOADED, {'downloaded': True, 'bitrate': 320, 'unavailable': True, 'failed_count': 2}),
+            (SongState.ON_DISK_UNVERIFIED, {'downloaded': False, 'bitrate': 320, 'unavailable': True, 'failed_count': 2}),
+            (SongState.UNAVAILABLE, {'downloaded': False, 'bitrate': 0, 'unavailable': True, 'failed_count': 2}),
+            (SongState.FAILED, {'downloaded': False, 'bitrate': 0, 'unavailable': False, 'failed_count': 2}),
+            (SongState.PENDING, {'downloaded': False, 'bitrate': 0, 'unavailable': False, 'failed_count': 0}),
+        ]:
+            with self.subTest(expected_state=expected_state.label):
+                self.assertSongState(expected_state, **fields)
+
+    def test_unavailable_song_on_disk_isnt_listed_as_undownloaded(self):
+        # A bitrate outranks unavailable in the state, so the listing has to exclude unavailable songs itself
+        self.assertSongState(SongState.ON_DISK_UNVERIFIED, downloaded=False, bitrate=320, unavailable=True, failed_count=4)
+        response = self.client.get(reverse('library_manager:undownloaded_songs'))
+        self.assertEqual(list(response.context['songs_not_marked_downloaded_that_should_be']), [])
+        self.assertEqual(response.context['songs_not_marked_downloaded_that_should_be_count'], 0)
+
+        self.assertSongState(SongState.ON_DISK_UNVERIFIED, unavailable=False)
+        response = self.client.get(reverse('library_manager:undownloaded_songs'))
+        self.assertEqual([song.id for song in response.context['songs_not_marked_downloaded_that_should_be']], [self.song.id])
+
+    def test_song_becomes_unavailable_after_repeated_failures(self):
+        self.assertSongState(SongState.FAILED, failed_count=3)
+        song = Song.objects.get(id=self.song.id)
+        song.increment_failed_count()
+        self.assertEqual(Song.objects.get(id=self.song.id).state, SongState.UNAVAILABLE)
+
+    def test_album_desired(self):
+        for album_type in ALBUM_TYPES_TO_DOWNLOAD:
+            with self.subTest(album_type=album_type):
+                self.assertDesired(True, album_type=album_type, album_group=album_type)
+        for expected_desired, fields in [
+            (True, {'album_type': "album", 'album_group': None}),
+            (False, {'album_type': "album", 'album_group': EXTRA_GROUPS_TO_IGNORE[0]}),
+            (False, {'album_type': "appears_on", 'album_group': "album"}),
+            (False, {'album_type': None, 'album_group': "album"}),
+        ]:
+            with self.subTest(**fields):
+                self.assertDesired(expected_desired, **fields)
+
+class SongFromMetadataTests(SimpleTestCase):
+    """`song_from_metadata` has to build the same song `SpotdlSong.from_url` would, without fetching anything"""
+
+    def setUp(self):
+        catalog = FakeSpotifyCatalog(seed=1)
+        self.artist = catalog.add_artist()
+        self.album = catalog.add_album(self.artist, 'album')
+        self.track = catalog.tracks[self.album['tracks']['items'][2]['id']]
+
+    def test_maps_track_album_and_artist_metadata(self):
+        song = song_from_metadata(self.track, self.album, self.artist)
+
+        self.assertEqual(song.name, self.track['name'])
+        self.assertEqual(song.song_id, self.track['id'])
+        self.assertEqual(song.url, self.track['external_urls']['spotify'])
+        self.assertEqual(song.artists, [artist['name'] for artist in self.track['artists']])
+        self.assertEqual(song.artist, self.artist['name'])
+        self.assertEqual(song.artist_id, self.artist['id'])
+        self.assertEqual(song.album_id, self.album['id'])
+        self.assertEqual(song.album_name, self.album['name'])
+        self.assertEqual(song.album_artist, self.artist['name'])
+        self.assertEqual(song.album_type, 'album')
+        self.assertEqual(song.genres, self.album['genres'] + self.artist['genres'])
+        self.assertEqual(song.copyright_text, self.album['copyrights'][0]['text'])
+        self.assertEqual(song.publisher, self.album['label'])
+        self.assertEqual(song.track_number, 3)
+        self.assertEqual(song.tracks_count, self.album['total_tracks'])
+        self.assertEqual(song.disc_number, 1)
+        self.assertEqual(song.disc_count, 1)
+        self.assertEqual(song.duration, self.track['duration_ms'] // 1000)
+        self.assertEqual(song.date, self.album['release_date'])
+        self.assertEqual(song.year, int(self.album['release_date'][:4]))
+        self.assertEqual(song.isrc, self.track['external_ids']['isrc'])
+        self.assertEqual(song.explicit, self.track['explicit'])
+        self.assertEqual(song.popularity, self.track['popularity'])
+
+    def test_uses_largest_cover_and_tolerates_missing_optional_metadata(self):
+        self.assertEqual(song_from_metadata(self.track, self.album, self.artist).cover_url, self.album['images'][0]['url'])
+
+        album = {**self.album, 'images': [], 'copyrights': []}
+        track = {**self.track, 'external_ids': {}}
+        song = song_from_metadata(track, album, self.artist)
+        self.assertIsNone(song.cover_url)
+        self.assertIsNone(song.copyright_text)
+        self.assertIsNone(song.isrc)
+
+    def test_disc_count_comes_from_the_last_track(self):
+        album = {**self.album, 'tracks': {'items': [*self.album['tracks']['items'][:-1], {**self.album['tracks']['items'][-1], 'disc_number': 2}]}}
+        self.assertEqual(song_from_metadata(self.track, album, self.artist).disc_count, 2)
+
+    def test_tracks_that_no_longer_exist_are_rejected(self):
+        with self.assertRaises(SongError):
+            song_from_metadata({**self.track, 'duration_ms': 0}, self.album, self.artist)
+        with self.assertRaises(SongError):
+            song_from_metadata({**self.track, 'name': " "}, self.album, self.artist)
+
+    def test_missing_required_metadata_raises_key_error(self):
+        # Callers fall back to `SpotdlSong.from_url` on a KeyError
+        album = {field: value for field, value in self.album.items() if field != 'label'}
+        with self.assertRaises(KeyError):
+            song_from_metadata(self.track, album, self.artist)
+
+class PlaylistDiffTests(TestCase):
+    """Tracked playlists are synced by the difference between the fetched tracks and the stored membership"""
+
+    def setUp(self):
+        use_memory_metrics(self)
+        self.catalog = FakeSpotifyCatalog(seed=2)
+        self.downloader = Downloader(FakeSpotifyClient(self.catalog), response_cache=SpotifyResponseCache(":memory:"))
+        self.playlist = self.catalog.add_playlist(6)
+        self.tracked_playlist = TrackedPlaylist.objects.create(name=self.playlist['name'], url=self.playlist['external_urls']['spotify'])
+
+    def sync(self) -> tuple[list[str], list[str]]:
+        """Sync the playlist the way `SpotdlWrapper.execute` does, returning the added and removed track IDs"""
+        tracks = self.downloader.get_download_queue(self.tracked_playlist.url, force_refresh=True)
+        added_tracks, removed_playlist_track_ids = self.downloader.diff_playlist_tracks(self.tracked_playlist, tracks)
+        removed_track_ids = [
+            utils.gid_to_uri(song_gid)
+            for song_gid in PlaylistTrack.objects.filter(id__in=removed_playlist_track_ids).values_list('song__gid', flat=True)
+        ]
+        db_songs = self.downloader.upsert_tracks(added_tracks)
+        self.downloader.update_playlist_tracks(self.tracked_playlist, added_tracks, removed_playlist_track_ids, db_songs)
+        return [track['id'] for track in added_tracks], removed_track_ids
+
+    def assertMembership(self):
+        self.assertCountEqual(
+            [utils.gid_to_uri(song_gid) for song_gid in self.tracked_playlist.tracks.values_list('song__gid', flat=True)],
+            [item['track']['id'] for item in self.playlist['tracks']['items']],
+        )
+
+    def test_first_sync_adds_every_track(self):
+        added_track_ids, removed_track_ids = self.sync()
+        self.assertEqual(added_track_ids, [item['track']['id'] for item in self.playlist['tracks']['items']])
+        self.assertEqual(removed_track_ids, [])
+        self.assertMembership()
+        first_item = self.playlist['tracks']['items'][0]
+        self.assertEqual(
+            self.tracked_playlist.tracks.get(song__gid=utils.uri_to_gid(first_item['track']['id'])).added_at,
+            utils.convert_date_string_to_datetime(first_item['added_at']),
+        )
+
+    def test_unchanged_playlist_has_no_difference(self):
+        self.sync()
+        self.assertEqual(self.sync(), ([], []))
+        self.assertMembership()
+
+    def test_added_tracks(self):
+        self.sync()
+        new_track_ids = self.catalog.add_playlist_tracks(self.playlist['id'], 3)
+        self.assertEqual(self.sync(), (new_track_ids, []))
+        self.assertMembership()
+
+    def test_removed_tracks(self):
+        self.sync()
+        removed_items = [self.playlist['tracks']['items'].pop(1), self.playlist['tracks']['items'].pop(-1)]
+        added_track_ids, removed_track_ids = self.sync()
+        self.assertEqual(added_track_ids, [])
+        self.assertCountEqual(removed_track_ids, [item['track']['id'] for item in removed_items])
+        self.assertMembership()
+        # Only the membership is removed, the songs stay in the library
+        self.assertEqual(Song.objects.filter(gid__in=[utils.uri_to_gid(item['track']['id']) for item in removed_items]).count(), 2)
+
+    def test_reordered_tracks(self):
+        self.sync()
+        self.playlist['tracks']['items'].reverse()
+        self.assertEqual(self.sync(), ([], []))
+        self.assertMembership()
+
+    def test_added_and_removed_tracks(self):
+        self.sync()
+        removed_item = self.playlist['tracks']['items'].pop(0)
+        self.playlist['tracks']['items'].reverse()
+        new_track_ids = self.catalog.add_playlist_tracks(self.playlist['id'], 2)
+        self.assertEqual(self.sync(), (new_track_ids, [removed_item['track']['id']]))
+        self.assertMembership()
+
+    def test_tracks_without_an_id_are_ignored(self):
+        # ie. local files added to the playlist
+        self.playlist['tracks']['items'].append({**self.playlist['tracks']['items'][0], 'track': {**self.playlist['tracks']['items'][0]['track'], 'id': None}})
+        added_track_ids, _ = self.sync()
+        self.assertEqual(len(added_track_ids), 6)
+
+class LibraryReconcileTests(TestCase):
+    """`LibraryIndexer.reconcile` brings `Song.downloaded` and `Song.file_path` in line with the files that are on disk"""
+
+    @classmethod
+    def setUpTestData(cls):
+        # Bulk created, so the new artist doesn't queue an album refresh
+        cls.artist = Artist.objects.bulk_create([Artist(name="Artist", gid="reconcileartist")])[0]
+
+    def setUp(self):
+        use_memory_metrics(self)
+        self.library_indexer = LibraryIndexer(root="/music")
+
+    def create_song(self, gid: str, **fields) -> Song:
+        return Song.objects.create(name=gid, gid=gid, primary_artist=self.artist, **fields)
+
+    @staticmethod
+    def index_file(path: str, song_gid: str | None, mtime: float = 1, bitrate: float | None = None) -> LibraryFile:
+        return LibraryFile.objects.create(path=path, directory=os.path.dirname(path), size=1024, mtime=mtime, song_gid=song_gid, bitrate=bitrate)
+
+    def test_moved_file_updates_the_path(self):
+        song = self.create_song("moved", downloaded=True, bitrate=256, file_path="/music/Artist/Old Album/Moved.m4a")
+        self.index_file("/music/Artist/New Album/Moved.m4a", song.gid)
+
+        self.assertEqual(self.library_indexer.reconcile(), {'marked_downloaded': 1, 'marked_not_downloaded': 0})
+        song.refresh_from_db()
+        self.assertTrue(song.downloaded)
+        self.assertEqual(song.file_path, "/music/Artist/New Album/Moved.m4a")
+
+    def test_deleted_file_marks_the_song_not_downloaded(self):
+        song = self.create_song("deleted", downloaded=True, bitrate=256, file_path="/music/Artist/Album/Deleted.m4a")
+
+        self.assertEqual(self.library_indexer.reconcile(), {'marked_downloaded': 0, 'marked_not_downloaded': 1})
+        song.refresh_from_db()
+        self.assertFalse(song.downloaded)
+        self.assertEqual(song.state, SongState.ON_DISK_UNVERIFIED)
+
+    def test_unchanged_file_is_left_alone(self):
+        song = self.create_song("unchanged", downloaded=True, bitrate=256, file_path="/music/Artist/Album/Unchanged.m4a")
+        self.index_file(song.file_path, song.gid)
+
+        self.assertEqual(self.library_indexer.reconcile(), {'marked_downloaded': 0, 'marked_not_downloaded': 0})
+        song.refresh_from_db()
+        self.assertTrue(song.downloaded)
+
+    def test_file_on_disk_marks_the_song_downloaded_with_its_probed_bitrate(self):
+        song = self.create_song("found", failed_count=1)
+        self.index_file("/music/Artist/Album/Found.m4a", song.gid, bitrate=160)
+
+        self.assertEqual(self.library_indexer.reconcile(), {'marked_downloaded': 1, 'marked_not_downloaded': 0})
+        song.refresh_from_db()
+        self.assertTrue(song.downloaded)
+        self.assertEqual(song.file_path, "/music/Artist/Album/Found.m4a")
+        self.assertEqual(song.bitrate, 160)
+
+    def test_newest_copy_wins(self):
+        song = self.create_song("copies")
+        self.index_file("/music/Artist/Album/Copies.m4a", song.gid, mtime=1)
+        self.index_file("/music/Artist/Album (Deluxe)/Copies.m4a", song.gid, mtime=2)
+
+        self.library_indexer.reconcile()
+        song.refresh_from_db()
+        self.assertEqual(song.file_path, "/music/Artist/Album (Deluxe)/Copies.m4a")
+
+    def test_untagged_file_is_matched_on_its_download_path(self):
+        song = self.create_song("untagged", downloaded=True, bitrate=256, file_path="/music/Artist/Album/Untagged.m4a")
+        library_file = self.index_file(song.file_path, None)
+
+        self.assertEqual(self.library_indexer.reconcile(), {'marked_downloaded': 0, 'marked_not_downloaded': 0})
+        library_file.refresh_from_db()
+        self.assertEqual(library_file.song_gid, song.gid)
+
+    def test_scan_then_reconcile(self):
+        with tempfile.TemporaryDirectory() as root:
+            kept_path = os.path.join(root, "Artist", "Album", "Kept.m4a")
+            removed_path = os.path.join(root, "Artist", "Album", "Removed.m4a")
+            os.makedirs(os.path.dirname(kept_path))
+            for path in (kept_path, removed_path):
+                with open(path, "wb") as audio_file:
+                    audio_file.write(m4a_bytes(0.1, 128))
+            kept_song = self.create_song("kept", downloaded=True, bitrate=128, file_path=kept_path)
+            removed_song = self.create_song("removed", downloaded=True, bitrate=128, file_path=removed_path)
+
+            library_indexer = LibraryIndexer(root=root)
+            self.assertEqual(library_indexer.scan()['files_indexed'], 2)
+            os.remove(removed_path)
+            self.assertEqual(library_indexer.scan()['files_removed'], 1)
+
+            self.assertEqual(library_indexer.reconcile(), {'marked_downloaded': 0, 'marked_not_downloaded': 1})
+            kept_song.refresh_from_db()
+            removed_song.refresh_from_db()
+            self.assertTrue(kept_song.downloaded)
+            self.assertFalse(removed_song.downloaded)
+
+class FakeClock:
+    def __init__(self, now: float = 1000000):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+class RateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        # 10 tokens, refilling at one every 6 seconds
+        self.rate_limiter = RateLimiter(":memory:", budgets={'test': {'capacity': 10, 'per_hour': 600}}, clock=self.clock)
+
+    def test_full_bucket_allows_a_burst_up_to_capacity(self):
+        self.assertEqual(self.rate_limiter.time_until_available('test', 10), 0)
+        for _ in range(10):
+            self.assertEqual(self.rate_limiter.try_acquire('test'), 0)
+        self.assertAlmostEqual(self.rate_limiter.try_acquire('test'), 6)
+
+    def test_tokens_refill_over_time(self):
+        self.assertEqual(self.rate_limiter.try_acquire('test', 10), 0)
+        self.assertAlmostEqual(self.rate_limiter.time_until_available('test', 2), 12)
+
+        self.clock.advance(6)
+        self.assertAlmostEqual(self.rate_limiter.time_until_available('test'), 0)
+        self.assertAlmostEqual(self.rate_limiter.time_until_available('test', 2), 6)
+        self.assertAlmostEqual(self.rate_limiter.try_acquire('test', 2), 6)
+        # A refused request doesn't take anything
+        self.assertEqual(self.rate_limiter.try_acquire('test'), 0)
+        self.assertAlmostEqual(self.rate_limiter.time_until_available('test'), 6)
+
+    def test_refill_stops_at_capacity(self):
+        self.assertEqual(self.rate_limiter.try_acquire('test', 10), 0)
+        self.clock.advance(24 * 60 * 60)
+        self.assertEqual(self.rate_limiter.try_acquire('test', 10), 0)
+        self.assertAlmostEqual(self.rate_limiter.time_until_available('test'), 6)
+
+    def test_time_until_available_takes_nothing(self):
+        for _ in range(20):
+            self.rate_limiter.time_until_available('test', 10)
+        self.assertEqual(self.rate_limiter.try_acquire('test', 10), 0)
+
+    def test_requests_larger_than_capacity_wait_for_a_full_bucket(self):
+        self.assertEqual(self.rate_limiter.try_acquire('test', 5), 0)
+        self.assertAlmostEqual(self.rate_limiter.time_until_available('test', 50), 30)
+
+    def test_take_raises_with_the_wait(self):
+        self.rate_limiter.take('test', 10)
+        with self.assertRaises(RateLimited) as raised:
+            self.rate_limiter.take('test', 3)
+        self.assertEqual(raised.exception.upstream, 'test')
+        self.assertAlmostEqual(raised.exception.wait, 18)
+
+    def test_unlimited_upstreams(self):
+        rate_limiter = RateLimiter(":memory:", budgets={'disabled': {'capacity': 1, 'per_hour': 0}}, clock=self.clock)
+        for upstream in ('disabled', 'unknown'):
+            for _ in range(5):
+                rate_limiter.take(upstream)
+            self.assertEqual(rate_limiter.time_until_available(upstream, 1000), 0)
+
+class RateLimitedDownloadTests(TestCase):
+    """A download that runs out of budget part way through stops, and picks up where it left off when retried"""
+
+    def setUp(self):
+        use_memory_metrics(self)
+        work_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(work_directory.cleanup)
+        self.clock = FakeClock()
+        # Shared with the prefetch threads, so not in memory (which would give each thread its own buckets)
+        self.rate_limiter = RateLimiter(
+            os.path.join(work_directory.name, "rate_limits.sqlite3"),
+            budgets={'audio_search': {'capacity': 4, 'per_hour': 3600}},
+            clock=self.clock,
+        )
+        rate_limiter_patch = patch('downloader.spotdl_wrapper.default_rate_limiter', return_value=self.rate_limiter)
+        rate_limiter_patch.start()
+        self.addCleanup(rate_limiter_patch.stop)
+
+        self.catalog = FakeSpotifyCatalog(seed=3)
+        audio_downloader = FakeAudioDownloader(os.path.join(work_directory.name, "music"), duration=0.1)
+        self.addCleanup(audio_downloader.executor.shutdown)
+        self.spotdl_wrapper = SpotdlWrapper(
+            Config(),
+            spotdl=FakeSpotdl(audio_downloader),
+            spotipy_client=FakeSpotifyClient(self.catalog),
+            response_cache=SpotifyResponseCache(":memory:"),
+        )
+        self.addCleanup(self.spotdl_wrapper.prefetch_executor.shutdown)
+        self.addCleanup(self.spotdl_wrapper.audio_prober.executor.shutdown)
+
+    def test_rate_limited_playlist_sync_resumes(self):
+        playlist = self.catalog.add_playlist(10)
+        tracked_playlist = TrackedPlaylist.objects.create(name=playlist['name'], url=playlist['external_urls']['spotify'])
+        track_gids = [utils.uri_to_gid(item['track']['id']) for item in playlist['tracks']['items']]
+
+        with self.assertRaises(RateLimited) as raised:
+            self.spotdl_wrapper.execute(Config(urls=[tracked_playlist.url]))
+        self.assertEqual(raised.exception.upstream, 'audio_search')
+        self.assertLess(Song.objects.filter(gid__in=track_gids, downloaded=True).count(), 10)
+        # Nothing is recorded as synced, so the retry sees the same added tracks
+        tracked_playlist.refresh_from_db()
+        self.assertIsNone(tracked_playlist.last_synced_at)
+        self.assertEqual(tracked_playlist.tracks.count(), 0)
+
+        # Retry the way huey would, once the budget has refilled
+        for _ in range(10):
+            self.clock.advance(raised.exception.wait)
+            try:
+                self.assertEqual(self.spotdl_wrapper.execute(Config(urls=[tracked_playlist.url])), 0)
+                break
+            except RateLimited as exception:
+                raised.exception = exception
+                tracked_playlist.refresh_from_db()
+                self.assertEqual(tracked_playlist.tracks.count(), 0)
+        self.assertEqual(Song.objects.filter(gid__in=track_gids, downloaded=True).count(), 10)
+        tracked_playlist.refresh_from_db()
+        self.assertIsNotNone(tracked_playlist.last_synced_at)
+        self.assertEqual(tracked_playlist.tracks.count(), 10)
+        # The unfinished download is resumed rather than started (and charged for) again
+        self.assertEqual(DownloadHistory.objects.filter(url=tracked_playlist.url).count(), 1)
+
+class PendingArtistRefreshTests(TestCase):
+    """New artists stay pending until their albums have been fetched"""
+
+    def setUp(self):
+        use_memory_metrics(self)
+        self.catalog = FakeSpotifyCatalog(seed=4, albums_per_artist=2)
+        self.spotify_client = FakeSpotifyClient(self.catalog)
+        refresher = DiscographyRefresher(Downloader(self.spotify_client, response_cache=SpotifyResponseCache(":memory:")), max_concurrency=1)
+        for target, replacement in (('discography_refresher', refresher), ('default_rate_limiter', lambda: RateLimiter(":memory:", budgets={}))):
+            task_patch = patch(f'library_manager.tasks.{target}', replacement)
+            task_patch.start()
+            self.addCleanup(task_patch.stop)
+
+        self.artists = Artist.objects.bulk_create([
+            Artist(name=catalog_artist['name'], gid=utils.uri_to_gid(catalog_artist['id']))
+            for catalog_artist in (self.catalog.add_artist() for _ in range(3))
+        ])
+        # Not in the catalog, so fetching its albums fails
+        self.missing_artist = Artist.objects.bulk_create([Artist(name="Missing", gid=utils.uri_to_gid(self.catalog.random_id()))])[0]
+        PendingArtistRefresh.objects.bulk_create([PendingArtistRefresh(artist=artist) for artist in [*self.artists, self.missing_artist]])
+
+    def test_only_refreshed_artists_leave_the_pending_set(self):
+        tasks.refresh_pending_artists.call_local()
+        self.assertEqual(list(PendingArtistRefresh.objects.values_list('artist_id', flat=True)), [self.missing_artist.id])
+        self.assertEqual(Album.objects.filter(artist__in=self.artists).count(), 6)
+
+    def test_rate_limited_refresh_is_rescheduled(self):
+        rate_limited_artist_id = self.artists[1].gid
+        artist_albums = self.spotify_client.artist_albums
+
+        def rate_limited_artist_albums(artist_id: str, **kwargs) -> dict:
+            if utils.uri_to_gid(artist_id) == rate_limited_artist_id:
+                raise RateLimited('spotify', 30)
+            return artist_albums(artist_id, **kwargs)
+
+        with patch.object(self.spotify_client, 'artist_albums', rate_limited_artist_albums):
+            with self.assertRaises(RetryTask) as raised:
+                tasks.refresh_pending_artists.call_local()
+        self.assertEqual(raised.exception.delay, 30)
+        self.assertCountEqual(PendingArtistRefresh.objects.values_list('artist_id', flat=True), [self.artists[1].id, self.missing_artist.id])
+
+        tasks.refresh_pending_artists.call_local()
+        self.assertEqual(list(PendingArtistRefresh.objects.values_list('artist_id', flat=True)), [self.missing_artist.id])
+
+    def test_refresh_all_tracked_artists_queues_every_tracked_artist(self):
+        PendingArtistRefresh.objects.exclude(artist=self.artists[0]).delete()
+        Artist.objects.filter(id__in=[self.artists[0].id, self.artists[2].id]).update(tracked=True, next_refresh_at=timezone.now() + timezone.timedelta(days=1))
+        with patch('library_manager.helpers.enqueue_pending_artist_refresh') as enqueue_pending_artist_refresh:
+            helpers.refresh_all_tracked_artists()
+        enqueue_pending_artist_refresh.assert_called_once()
+        # Including the ones that aren't due yet
+        self.assertCountEqual(PendingArtistRefresh.objects.values_list('artist_id', flat=True), [self.artists[0].id, self.artists[2].id])
+
+        tasks.refresh_pending_artists.call_local()
+        self.assertFalse(PendingArtistRefresh.objects.exists())
+        self.assertEqual(Album.objects.filter(artist__in=[self.artists[0], self.artists[2]]).count(), 4)
+
+class TrackedArtistRefreshTests(TestCase):
+    """Running out of the Spotify budget part way through a cycle leaves the remaining artists due, rather than backing them off"""
+
+    def setUp(self):
+        use_memory_metrics(self)
+        self.catalog = FakeSpotifyCatalog(seed=6, albums_per_artist=1)
+        self.spotify_client = FakeSpotifyClient(self.catalog)
+        self.refresher = DiscographyRefresher(Downloader(self.spotify_client, response_cache=SpotifyResponseCache(":memory:")), max_concurrency=1)
+        for target, replacement in (('discography_refresher', self.refresher), ('default_rate_limiter', lambda: RateLimiter(":memory:", budgets={}))):
+            task_patch = patch(f'library_manager.tasks.{target}', replacement)
+            task_patch.start()
+            self.addCleanup(task_patch.stop)
+
+        self.artists = Artist.objects.bulk_create([
+            Artist(name=catalog_artist['name'], gid=utils.uri_to_gid(catalog_artist['id']), tracked=True)
+            for catalog_artist in (self.catalog.add_artist() for _ in range(3))
+        ])
+        # Not in the catalog, so fetching its albums fails for real
+        self.missing_artist = Artist.objects.bulk_create([Artist(name="Missing", gid=utils.uri_to_gid(self.catalog.random_id()), tracked=True)])[0]
+
+    def test_rate_limited_artists_stay_due(self):
+        artist_albums = self.spotify_client.artist_albums
+        rate_limited_gids = {artist.gid for artist in self.artists[1:]}
+
+        def rate_limited_artist_albums(artist_id: str, **kwargs) -> dict:
+            if utils.uri_to_gid(artist_id) in rate_limited_gids:
+                raise RateLimited('spotify', 60)
+            return artist_albums(artist_id, **kwargs)
+
+        with patch.object(self.spotify_client, 'artist_albums', rate_limited_artist_albums):
+            with self.assertRaises(RetryTask) as raised:
+                tasks.update_tracked_artists.call_local()
+        self.assertEqual(raised.exception.delay, 60)
+
+        refreshed = {artist.id: artist.next_refresh_at for artist in Artist.objects.all()}
+        self.assertGreater(refreshed[self.artists[0].id], timezone.now() + MIN_REFRESH_INTERVAL)
+        self.assertIsNone(refreshed[self.artists[1].id])
+        self.assertIsNone(refreshed[self.artists[2].id])
+        # Only a real failure is backed off
+        self.assertAlmostEqual(refreshed[self.missing_artist.id], timezone.now() + MIN_REFRESH_INTERVAL, delta=timezone.timedelta(minutes=1))
+        self.assertCountEqual(
+            [artist.id for artist in self.refresher.due_artists(100)],
+            [self.artists[1].id, self.artists[2].id],
+        )
+
+    def test_rate_limit_stops_before_later_batches(self):
+        failures: dict[int, Exception] = {}
+        artist_albums = self.spotify_client.artist_albums
+
+        def rate_limited_artist_albums(artist_id: str, **kwargs) -> dict:
+            if utils.uri_to_gid(artist_id) == self.artists[0].gid:
+                raise RateLimited('spotify', 60)
+            return artist_albums(artist_id, **kwargs)
+
+        with patch('downloader.discography.ARTIST_BATCH_SIZE', 2), patch.object(self.spotify_client, 'artist_albums', rate_limited_artist_albums):
+            stats = self.refresher.refresh(list(Artist.objects.order_by('id')), failures=failures)
+        self.assertEqual({key: stats[key] for key in ('artists', 'failed', 'rate_limited')}, {'artists': 1, 'failed': 0, 'rate_limited': 1})
+        self.assertEqual(list(failures), [self.artists[0].id])
+        self.assertFalse(Artist.objects.filter(id__in=[self.artists[2].id, self.missing_artist.id]).exclude(next_refresh_at=None).exists())
+
+    def test_update_waits_for_the_budget_before_starting(self):
+        rate_limiter = RateLimiter(":memory:", budgets={'spotify': {'capacity': 1, 'per_hour': 60}})
+        rate_limiter.take('spotify')
+        with patch('library_manager.tasks.default_rate_limiter', return_value=rate_limiter):
+            with self.assertRaises(RetryTask):
+                tasks.update_tracked_artists.call_local()
+        self.assertFalse(Artist.objects.exclude(next_refresh_at=None).exists())
+
+class LibraryStatsTests(TestCase):
+    """Album changes keep their artist's counts current, while the library totals are rolled up once per batch"""
+
+    def setUp(self):
+        use_memory_metrics(self)
+        self.catalog = FakeSpotifyCatalog(seed=5, albums_per_artist=0)
+        self.downloader = Downloader(FakeSpotifyClient(self.catalog), response_cache=SpotifyResponseCache(":memory:"))
+        self.artist = Artist.objects.bulk_create([Artist(name="Artist", gid="statsartist", tracked=True)])[0]
+        stats.refresh_library_stats()
+
+    def test_album_save_only_refreshes_its_artist(self):
+        album = Album.objects.create(spotify_gid="statsalbum", artist=self.artist, spotify_uri="spotify:album:statsalbum", total_tracks=10, name="Album", album_type="album", album_group="album")
+        self.artist.refresh_from_db()
+        self.assertEqual(self.artist.missing_album_count, 1)
+        self.assertEqual(LibraryStats.objects.get().num_wanted, 0)
+
+        album.downloaded = True
+        album.save()
+        self.assertEqual(stats.refresh_library_stats().num_wanted_downloaded, 1)
+
+    def test_tracking_upserted_artists_refreshes_the_library_totals(self):
+        catalog_artist = self.catalog.add_artist()
+        album = self.catalog.add_album(catalog_artist, 'album')
+        Artist.objects.bulk_create([Artist(name=catalog_artist['name'], gid=utils.uri_to_gid(catalog_artist['id']))])
+        self.downloader.get_artist_albums(utils.uri_to_gid(catalog_artist['id']))
+        self.assertEqual(LibraryStats.objects.get().num_wanted, 0)
+
+        self.downloader.upsert_tracks(self.catalog.albums[album['id']]['tracks']['items'][:1], track_artists=True)
+        self.assertEqual(LibraryStats.objects.get().num_wanted, 1)
+
+class ArtistIndexSearchTests(TestCase):
+    """The artist list filtered by the search box, and paginated with the search carried over"""
+
+    @classmethod
+    def setUpTestData(cls):
+        Artist.objects.bulk_create([Artist(name=f"Rock & Roll {i}", gid=f"indexartist{i}") for i in range(51)])
+        cls.index_url = reverse('library_manager:index')
+
+    def test_punctuation_only_search_matches_nothing(self):
+        response = self.client.get(self.index_url, {'search_artist': "&&"})
+        self.assertEqual(response.context['artist_count'], 0)
+        self.assertEqual(len(response.context['page_obj']), 0)
+
+    def test_empty_search_lists_every_artist(self):
+        response = self.client.get(self.index_url, {'search_artist': ""})
+        self.assertEqual(response.context['artist_count'], 51)
+
+    def test_pagination_links_keep_the_encoded_search(self):
+        response = self.client.get(self.index_url, {'search_artist': "rock & roll", 'tracked': "false"})
+        self.assertEqual(response.context['artist_count'], 51)
+        self.assertEqual(response.context['search_term_and_page'], "?search_artist=rock+%26+roll&tracked=False&cursor")
+
+        next_page = self.client.get(f"{self.index_url}{response.context['search_term_and_page']}={response.context['page_obj'].next_cursor}")
+        self.assertEqual(len(next_page.context['page_obj']), 1)
+
+class KeysetPaginatorTests(TestCase):
+    """Walking a keyset paginated list forwards and backwards visits every row exactly once, in order"""
+
+    @classmethod
+    def setUpTestData(cls):
+        # Runs of equal names, so most page boundaries fall in the middle of a tie
+        Artist.objects.bulk_create([Artist(name=name, gid=f"pageartist{i}") for i, name in enumerate("abbbbccdddde")])
+        # Same for the timestamps, which also have to survive the round trip through the cursor
+        added_at = timezone.now().replace(microsecond=123456)
+        Artist.objects.filter(name__in=["b", "c"]).update(added_at=added_at)
+        Artist.objects.exclude(name__in=["b", "c"]).update(added_at=added_at - timezone.timedelta(minutes=1))
+
+    def walk(self, paginator: KeysetPaginator) -> tuple[list[list[int]], list[list[int]]]:
+        """Every page's ids following the next cursors from the first page, then following the previous cursors back"""
+        forward_pages: list[list[int]] = []
+        page = paginator.get_page(None)
+        self.assertFalse(page.has_previous)
+        while True:
+            forward_pages.append([artist.id for artist in page])
+            if not page.has_next:
+                break
+            page = paginator.get_page(page.next_cursor)
+
+        backward_pages = [[artist.id for artist in page]]
+        while page.has_previous:
+            page = paginator.get_page(page.previous_cursor)
+            backward_pages.insert(0, [artist.id for artist in page])
+        return forward_pages, backward_pages
+
+    def assertWalks(self, ordering: list[str]):
+        expected_ids = list(Artist.objects.order_by(*ordering).values_list('id', flat=True))
+        forward_pages, backward_pages = self.walk(KeysetPaginator(Artist.objects.all(), 5, ordering))
+        self.assertEqual([len(page) for page in forward_pages], [5, 5, 2])
+        self.assertEqual(sum(forward_pages, []), expected_ids)
+        self.assertEqual(backward_pages, forward_pages)
+
+    def test_cursor_round_trips_the_last_row(self):
+        paginator = KeysetPaginator(Artist.objects.all(), 5, ["-added_at", "name", "id"])
+        page = paginator.get_page(None)
+        direction, values = paginator._decode_cursor(page.next_cursor)
+        self.assertEqual(direction, 'next')
+        last_artist = page.object_list[-1]
+        self.assertEqual(values, [last_artist.added_at.isoformat(), last_artist.name, last_artist.id])
+
+    def test_ties_across_page_boundaries(self):
+        self.assertWalks(["name", "id"])
+
+    def test_descending_order(self):
+        self.assertWalks(["-name", "-id"])
+
+    def test_ties_in_descending_timestamps(self):
+        self.assertWalks(["-added_at", "-id"])
+
+    def test_malformed_or_tampered_cursor_falls_back_to_the_first_page(self):
+        paginator = KeysetPaginator(Artist.objects.all(), 5, ["name", "id"])
+        first_page_ids = [artist.id for artist in paginator.get_page(None)]
+
+        def encode(raw_cursor) -> str:
+            return base64.urlsafe_b64encode(json.dumps(raw_cursor).encode()).decode()
+
+        for cursor in [
+            "not a cursor!",
+            base64.urlsafe_b64encode(b"not json").decode(),
+            encode(["next", ["b", 1]]),
+            encode({'d': "sideways", 'v': ["b", 1]}),
+            encode({'d': "next", 'v': ["b"]}),
+            encode({'d': "next", 'v': "b"}),
+            encode({'v': ["b", 1]}),
+        ]:
+            with self.subTest(cursor=cursor):
+                page = paginator.get_page(cursor)
+                self.assertEqual([artist.id for artist in page], first_page_ids)
+                self.assertFalse(page.has_previous)
+
+class MissingSongsPaginationTests(TestCase):
+    """The missing and unavailable song lists on the same page are paged independently"""
+
+    @classmethod
+    def setUpTestData(cls):
+        artist = Artist.objects.bulk_create([Artist(name="Artist", gid="missingartist", tracked=True)])[0]
+        Song.objects.bulk_create(
+            [Song(name=f"Failed {i}", gid=f"{i:032x}", primary_artist=artist, failed_count=1) for i in range(30)]
+            + [Song(name=f"Unavailable {i}", gid=f"{1000 + i:032x}", primary_artist=artist, failed_count=4, unavailable=True) for i in range(30)]
+        )
+        cls.missing_known_songs_url = reverse('library_manager:missing_known_songs')
+
+    def next_links(self, response) -> list[str]:
+        """The next links on the page, the missing list's (when it has a next page) first"""
+        return [html.unescape(link) for link in re.findall(r'<a href="(\?[^"]*)">next</a>', response.content.decode())]
+
+    def test_paging_one_list_keeps_the_other_page(self):
+        response = self.client.get(self.missing_known_songs_url)
+        response = self.client.get(self.missing_known_songs_url + self.next_links(response)[0])
+        missing_page = [song.id for song in response.context['missing_known_songs_list']]
+        self.assertEqual(len(missing_page), 5)
+
+        # The missing list is on its last page now, so only the unavailable list has a next link
+        response = self.client.get(self.missing_known_songs_url + self.next_links(response)[-1])
+        self.assertEqual([song.id for song in response.context['missing_known_songs_list']], missing_page)
+        self.assertEqual(len(response.context['missing_known_songs_list_unavailable']), 5)
+
+    def test_cursors_are_encoded(self):
+        response = self.client.get(self.missing_known_songs_url)
+        cursor = response.context['missing_known_songs_list'].next_cursor
+        self.assertIn(f"cursor={quote(cursor, safe='')}&", self.next_links(response)[0])
+
+class MetricsStoreTests(SimpleTestCase):
+    def test_unwritable_store_keeps_the_samples(self):
+        with tempfile.NamedTemporaryFile() as not_a_directory:
+            # The store's directory can't be created under a file
+            metrics_store = MetricsStore(os.path.join(not_a_directory.name, "metrics.sqlite3"), flush_interval=0)
+            with self.assertLogs('downloader.metrics', 'WARNING'):
+                metrics_store.count_tracks('ok', 2)
+        self.assertEqual(metrics_store._pending_counters, {('spotify_sync_tracks_total', 'result="ok"'): 2})
+
+class MetricsViewTests(TestCase):
+    """/metrics combines the recorded pipeline metrics with gauges read when it's scraped"""
+
+    def setUp(self):
+        self.metrics_store = MetricsStore(":memory:")
+        metrics_patch = patch('library_manager.views.default_metrics', return_value=self.metrics_store)
+        metrics_patch.start()
+        self.addCleanup(metrics_patch.stop)
+
+    def test_queue_gauges_are_counted(self):
+        self.metrics_store.count_tracks('ok', 3)
+        EnqueuedTask.objects.bulk_create([
+            EnqueuedTask(task_name="library_manager.tasks.download_playlist", key=f"playlist{i}", task_id=f"task{i}")
+            for i in range(2)
+        ] + [EnqueuedTask(task_name="library_manager.tasks.refresh_pending_artists", key="all", task_id="task2")])
+
+        with patch('library_manager.views.HUEY.pending_count', return_value=4), patch('library_manager.views.HUEY.scheduled_count', return_value=1):
+            response = self.client.get(reverse('metrics'))
+        lines = response.content.decode().splitlines()
+        for expected_line in [
+            'spotify_sync_tracks_total{result="ok"} 3',
+            'spotify_sync_huey_queue_depth{state="pending"} 4',
+            'spotify_sync_huey_queue_depth{state="scheduled"} 1',
+            'spotify_sync_enqueued_tasks{task="library_manager.tasks.download_playlist"} 2',
+            'spotify_sync_enqueued_tasks{task="library_manager.tasks.refresh_pending_artists"} 1',
+        ]:
+            self.assertIn(expected_line, lines)
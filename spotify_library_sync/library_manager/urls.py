@@ -6,6 +6,7 @@ app_name = "library_manager"
 urlpatterns = [
     # ex: /library_manager/
     path("", views.index, name="index"),
+    path("search", views.search_library, name="search"),
     path("download_playlist", views.download_playlist, name="download_playlist"),
     path("retry_all_missing_known_songs", views.retry_all_missing_known_songs, name="retry_all_missing_known_songs"),
     path("validate_undownloaded_songs", views.validate_undownloaded_songs, name="validate_undownloaded_songs"),
@@ -16,6 +17,7 @@ urlpatterns = [
     path("undownloaded_songs", views.undownloaded_songs, name="undownloaded_songs"),
     path("tracked_playlists", views.tracked_playlists, name="tracked_playlists"),
     path("tracked_playlists/<int:tracked_playlist_id>/", views.tracked_playlists_prefilled, name="tracked_playlists_prefilled"),
+    path("tracked_playlists/<int:tracked_playlist_id>/tracks", views.tracked_playlist_tracks, name="tracked_playlist_tracks"),
     path("tracked_playlists/<int:tracked_playlist_id>/sync", views.sync_tracked_playlist, name="sync_tracked_playlist"),
     path("tracked_playlists/<int:tracked_playlist_id>/delete", views.delete_tracked_playlist, name="delete_tracked_playlist"),
     path("tracked_playlists/<int:tracked_playlist_id>/sync_artists", views.sync_tracked_playlist_artists, name="sync_tracked_playlist_artists"),
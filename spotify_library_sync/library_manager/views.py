@@ -1,56 +1,55 @@
+from urllib.parse import urlencode
+
 from django.core.exceptions import ValidationError
-from django.core.paginator import Paginator
-from django.db.models import Sum
+from django.db.models import Count, Q
 from django.db.models.functions import Lower
-from django.http import HttpRequest, HttpResponseRedirect
+from django.http import HttpRequest, HttpResponse, HttpResponseRedirect
 from django.shortcuts import get_object_or_404, redirect, render
+from huey.contrib.djhuey import HUEY
 
+from downloader.metrics import MetricsStore, default_metrics
 from downloader.utils import sanitize_and_strip_url
-from .models import Album, Artist, ContributingArtist, DownloadHistory, Song, TrackedPlaylist, ALBUM_TYPES_TO_DOWNLOAD, EXTRA_GROUPS_TO_IGNORE
+from .models import Album, Artist, ContributingArtist, DownloadHistory, EnqueuedTask, PlaylistTrack, Song, SongState, TrackedPlaylist
 from .forms import DownloadPlaylistForm, ToggleTrackedForm, TrackedPlaylistForm
-from . import tasks
+from .pagination import KeysetPaginator
+from . import helpers, search, stats, tasks
 
 def index(request: HttpRequest):
     search_term = request.GET.get("search_artist")
     tracked_term = request.GET.get("tracked")
     raw_artist_list = Artist.objects
-    search_term_and_page = '?'
+    # Carried over into the pagination links
+    query_params: dict[str, str] = {}
     if search_term is not None:
-        raw_artist_list = raw_artist_list.filter(name__icontains=search_term)
-        search_term_and_page += f"search_artist={search_term}&"
+        matching_artist_ids = search.matching_ids(Artist, search_term)
+        if matching_artist_ids is not None:
+            raw_artist_list = raw_artist_list.filter(id__in=matching_artist_ids)
+        elif search_term.strip() != '':
+            # Nothing but punctuation, which no name can match
+            raw_artist_list = raw_artist_list.none()
+        query_params['search_artist'] = search_term
     if tracked_term is not None:
         tracked_artists = tracked_term is True or tracked_term.lower() == 'true'
         raw_artist_list = raw_artist_list.filter(tracked=tracked_artists)
-        search_term_and_page += f"tracked={tracked_artists}&"
-    search_term_and_page += 'page'
-    artist_list = raw_artist_list.order_by(Lower("name")).all()
-    paginator = Paginator(artist_list, 50)
+        query_params['tracked'] = tracked_artists
+    search_term_and_page = f"?{urlencode(query_params)}&cursor" if query_params else "?cursor"
+    artist_list = raw_artist_list.annotate(name_lower=Lower("name"))
+    paginator = KeysetPaginator(artist_list, 50, ["name_lower", "id"])
     # Remove default playlist after
     download_playlist_form = DownloadPlaylistForm()
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
-
-    wanted_base = Album.objects.filter(downloaded=False, wanted=True, album_type__in=ALBUM_TYPES_TO_DOWNLOAD).exclude(album_group__in=EXTRA_GROUPS_TO_IGNORE).select_related('artist').filter(artist__tracked=True)
-    wanted_downloaded_base = Album.objects.filter(downloaded=True, album_type__in=ALBUM_TYPES_TO_DOWNLOAD).exclude(album_group__in=EXTRA_GROUPS_TO_IGNORE).select_related('artist').filter(artist__tracked=True)
-
-    sum_num_wanted = wanted_base.aggregate(Sum('total_tracks'))['total_tracks__sum'] or 0
-    sum_num_wanted_downloaded = wanted_downloaded_base.aggregate(Sum('total_tracks'))['total_tracks__sum'] or 0
-    wanted_percent_completed = round(sum_num_wanted_downloaded / (sum_num_wanted_downloaded + sum_num_wanted) * 100, 2) if (sum_num_wanted_downloaded + sum_num_wanted) > 0 else 100
-
-    # Extra stats
-    extra_stats = {
-        'num_wanted': wanted_base.count(),
-        'sum_num_wanted': sum_num_wanted,
-        'num_wanted_downloaded': wanted_downloaded_base.count(),
-        'sum_num_wanted_downloaded': sum_num_wanted_downloaded,
-        'wanted_percent_completed': wanted_percent_completed,
-        'total_downloaded': Album.objects.filter(downloaded=True).count()
-    }
-    return render(request, "library_manager/index.html", {"playlist_form": download_playlist_form, "page_obj": page_obj, "search_term_and_page": search_term_and_page, "extra_stats": extra_stats})
+    page_obj = paginator.get_page(request.GET.get("cursor"))
+
+    extra_stats = stats.get_library_stats()
+    return render(request, "library_manager/index.html", {"playlist_form": download_playlist_form, "page_obj": page_obj, "artist_count": paginator.count, "search_term_and_page": search_term_and_page, "extra_stats": extra_stats})
+
+def search_library(request: HttpRequest):
+    search_term = request.GET.get("q", "")
+    results = search.search_library(search_term)
+    return render(request, "library_manager/search.html", {"search_term": search_term, "results": results})
 
 def artist(request: HttpRequest, artist_id: int):
     artist_details = get_object_or_404(Artist, pk=artist_id)
-    artist_songs = ContributingArtist.objects.filter(artist=artist_details)
+    artist_songs = ContributingArtist.objects.filter(artist=artist_details).select_related('song')
     form = ToggleTrackedForm({'tracked': artist_details.tracked})
     return render(request, "library_manager/artist.html", {"artist_details": artist_details, "artist_songs": artist_songs, 'form': form})
 
@@ -73,6 +72,7 @@ def album_set_wanted(request: HttpRequest, artist_id: int, album_id: int):
     print(f"got {tracked}")
     album.wanted = tracked
     album.save()
+    stats.refresh_library_stats()
     return HttpResponseRedirect(request.META.get('HTTP_REFERER', '/'))
 
 def song(request: HttpRequest, song_id: int):
@@ -85,6 +85,8 @@ def track_artist(request: HttpRequest, artist_id: int):
         artist_details = get_object_or_404(Artist, pk=artist_id)
         artist_details.tracked = form.cleaned_data['tracked']
         artist_details.save()
+        # (Un)tracking an artist moves their albums in or out of the library totals
+        stats.refresh_library_stats()
         return HttpResponseRedirect(request.META.get('HTTP_REFERER', '/'))
     raise ValidationError({'tracked': ["Must be a boolean!",]})
 
@@ -110,7 +112,7 @@ def validate_undownloaded_songs(request: HttpRequest):
 
 def download_history(request: HttpRequest):
     download_history_not_done = DownloadHistory.objects.filter(completed_at=None).order_by("-added_at")
-    download_history_done = DownloadHistory.objects.exclude(completed_at=None).order_by("-added_at")[:50]
+    download_history_done = DownloadHistory.objects.filter(completed_at__isnull=False).order_by("-added_at")[:50]
     download_playlist_form = DownloadPlaylistForm()
     return render(request, "library_manager/download_history.html", {
         "download_history_not_done": download_history_not_done,
@@ -119,41 +121,47 @@ def download_history(request: HttpRequest):
     })
 
 def missing_known_songs(request: HttpRequest):
-    missing_known_songs_list = Song.objects.filter(bitrate=0,unavailable=False).order_by("-created_at").select_related('primary_artist').filter(primary_artist__tracked=True)
-    failed_known_songs_list = Song.objects.filter(failed_count__gt=0,bitrate=0,unavailable=False).order_by("-created_at").select_related('primary_artist')
-    # Combine results for displaying
-    missing_known_songs_list = missing_known_songs_list | failed_known_songs_list
+    # Missing songs of tracked artists, or that have already failed to download
+    missing_known_songs_list = Song.objects.filter(
+        Q(state=SongState.PENDING, primary_artist__tracked=True) | Q(state=SongState.FAILED),
+    ).select_related('primary_artist')
+    missing_known_songs_paginator = KeysetPaginator(missing_known_songs_list, 25, ["-created_at", "-id"])
 
-    missing_known_songs_list_unavailable = Song.objects.filter(bitrate=0,unavailable=True).order_by("-created_at").select_related('primary_artist')
+    missing_known_songs_list_unavailable = Song.objects.filter(state=SongState.UNAVAILABLE).select_related('primary_artist')
+    missing_known_songs_unavailable_paginator = KeysetPaginator(missing_known_songs_list_unavailable, 25, ["-created_at", "-id"])
     download_playlist_form = DownloadPlaylistForm()
+    # Each list's links carry the other list's cursor, so paging one doesn't reset the other
+    cursor = request.GET.get("cursor", "")
+    unavailable_cursor = request.GET.get("unavailable_cursor", "")
     return render(request, "library_manager/missing_known_songs.html", {
-        "missing_known_songs_list": missing_known_songs_list[:25],
-        "missing_known_songs_list_count": missing_known_songs_list.count(),
-        "missing_known_songs_list_unavailable": missing_known_songs_list_unavailable[:25],
-        "missing_known_songs_list_unavailable_count": missing_known_songs_list_unavailable.count(),
+        "missing_known_songs_list": missing_known_songs_paginator.get_page(cursor),
+        "missing_known_songs_list_count": missing_known_songs_paginator.count,
+        "cursor": cursor,
+        "missing_known_songs_list_unavailable": missing_known_songs_unavailable_paginator.get_page(unavailable_cursor),
+        "unavailable_cursor": unavailable_cursor,
+        "missing_known_songs_list_unavailable_count": missing_known_songs_unavailable_paginator.count,
         "playlist_form": download_playlist_form
     })
 
 def undownloaded_songs(request:HttpRequest):
-    songs_not_marked_downloaded_that_should_be = Song.objects.filter(bitrate__gt=0,unavailable=False,downloaded=False)
-    
+    # Songs on disk that are also marked unavailable are only ever "maybe" downloaded, see `tasks.validate_undownloaded_songs`
+    songs_not_marked_downloaded_that_should_be = Song.objects.filter(state=SongState.ON_DISK_UNVERIFIED, unavailable=False)
+    paginator = KeysetPaginator(songs_not_marked_downloaded_that_should_be, 25, ["-created_at", "-id"])
+
     download_playlist_form = DownloadPlaylistForm()
     return render(request, "library_manager/undownloaded_songs.html", {
-        "songs_not_marked_downloaded_that_should_be": songs_not_marked_downloaded_that_should_be[:25],
-        "songs_not_marked_downloaded_that_should_be_count": songs_not_marked_downloaded_that_should_be.count(),
+        "songs_not_marked_downloaded_that_should_be": paginator.get_page(request.GET.get("cursor")),
+        "songs_not_marked_downloaded_that_should_be_count": paginator.count,
         "playlist_form": download_playlist_form
     })
 
 def download_all_for_tracked_artists(request: HttpRequest):
     all_tracked_artists = Artist.objects.filter(tracked=True).order_by("last_synced_at", "added_at", "id")
-    for artist in all_tracked_artists:
-        tasks.download_missing_albums_for_artist(artist.id)
+    helpers.download_missing_tracked_artists(all_tracked_artists)
     return HttpResponseRedirect(request.META.get('HTTP_REFERER', '/'))
 
 def fetch_all_for_tracked_artists(request: HttpRequest):
-    all_tracked_artists = Artist.objects.filter(tracked=True)
-    for artist in all_tracked_artists:
-        tasks.fetch_all_albums_for_artist(artist.id)
+    helpers.refresh_all_tracked_artists()
     return HttpResponseRedirect(request.META.get('HTTP_REFERER', '/'))
 
 def fetch_all_albums_for_artist(request: HttpRequest, artist_id: int):
@@ -174,6 +182,14 @@ def tracked_playlists(request: HttpRequest):
         "tracked_playlist_form": tracked_playlist_form,
     })
 
+def tracked_playlist_tracks(request: HttpRequest, tracked_playlist_id: int):
+    tracked_playlist = get_object_or_404(TrackedPlaylist, pk=tracked_playlist_id)
+    playlist_tracks = PlaylistTrack.objects.filter(playlist=tracked_playlist).select_related('song', 'song__primary_artist').order_by("added_at", "id")
+    return render(request, "library_manager/tracked_playlist_tracks.html", {
+        "tracked_playlist": tracked_playlist,
+        "playlist_tracks": playlist_tracks,
+    })
+
 def tracked_playlists_prefilled(request: HttpRequest, tracked_playlist_id: int):
     tracked_playlist = get_object_or_404(TrackedPlaylist, pk=tracked_playlist_id)
 
@@ -221,4 +237,20 @@ def sync_tracked_playlist(request: HttpRequest, tracked_playlist_id: int):
 def sync_tracked_playlist_artists(request: HttpRequest, tracked_playlist_id: int):
     tracked_playlist = get_object_or_404(TrackedPlaylist, pk=tracked_playlist_id)
     tasks.sync_tracked_playlist_artists(tracked_playlist)
-    return HttpResponseRedirect(request.META.get('HTTP_REFERER', '/'))
\ No newline at end of file
+    return HttpResponseRedirect(request.META.get('HTTP_REFERER', '/'))
+
+def metrics(request: HttpRequest):
+    # Queue depth is counted by huey's storage when scraped (rather than loading and unpickling every queued task),
+    # the pipeline metrics are recorded by the worker processes
+    queue_depth = {
+        MetricsStore.format_labels({'state': 'pending'}): HUEY.pending_count(),
+        MetricsStore.format_labels({'state': 'scheduled'}): HUEY.scheduled_count(),
+    }
+    queue_depth_metric = MetricsStore.render_gauge('spotify_sync_huey_queue_depth', "Tasks waiting in the huey queue, by state", queue_depth)
+    # Only tasks enqueued through `helpers.enqueue_unique` are registered, but those are the ones that can pile up
+    enqueued_tasks = {
+        MetricsStore.format_labels({'task': task_name}): count
+        for task_name, count in EnqueuedTask.objects.values_list('task_name').annotate(count=Count('id')).order_by('task_name')
+    }
+    enqueued_tasks_metric = MetricsStore.render_gauge('spotify_sync_enqueued_tasks', "Uniquely enqueued tasks that haven't finished yet, by task name", enqueued_tasks)
+    return HttpResponse(default_metrics().render() + queue_depth_metric + enqueued_tasks_metric, content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -17,8 +17,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import include, path
 
+from library_manager import views as library_manager_views
+
 urlpatterns = [
     path("library_manager/", include("library_manager.urls")),
+    path("metrics", library_manager_views.metrics, name="metrics"),
     path("admin/", admin.site.urls),
     path("__debug__/", include("debug_toolbar.urls")),
 ]